@@ -1,7 +1,27 @@
 from scipy import stats
 import numpy as np
+import hashlib
 import json
 import sys
+import zlib
+from lib.instrumentation import tracer
+
+# Bootstrap settings, which can be overridden in the config with
+# bootstrap_resamples, bootstrap_seed and bootstrap_quantiles.  The median
+# always gets a confidence interval.
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_SEED = 0
+BOOTSTRAP_QUANTILES = [0.95]
+BOOTSTRAP_LEVEL = 0.95
+
+# Significance level of the categorical tests, after correcting for the
+# number of labels compared.
+CATEGORICAL_ALPHA = 0.05
+
+# Histograms with more buckets are merged into bins holding about the same
+# number of samples before resampling, which bounds the size of the
+# resample matrices.
+BOOTSTRAP_MAX_BINS = 1000
 
 # Expand the histogram into an array of values
 def flatten_histogram(bins, counts):
@@ -174,6 +194,27 @@ def calculate_histogram_ttest(bins, counts, data, control):
   data["tests"]["ttest"]["p-value"] = p_value
   data["tests"]["ttest"]["effect"] = effect
 
+# Count, mean, median and 95th percentile of a histogram.
+def calc_histogram_summary(bins, counts):
+  bins = np.asarray(bins, dtype=float)
+  counts = np.asarray(counts, dtype=float)
+  n = counts.sum()
+  if n == 0:
+    return {"n": 0, "mean": None, "median": None, "p95": None}
+
+  order = np.argsort(bins)
+  bins = bins[order]
+  counts = counts[order]
+  cdf = np.cumsum(counts)/n
+  median = bins[min(np.searchsorted(cdf, 0.5), len(bins)-1)]
+  p95 = bins[min(np.searchsorted(cdf, 0.95), len(bins)-1)]
+  return {"n": n, "mean": float(np.dot(bins, counts)/n), "median": float(median), "p95": float(p95)}
+
+def calc_uplift(mean, control_mean):
+  if mean is None or not control_mean:
+    return None
+  return (mean-control_mean)/control_mean*100.0
+
 def calc_confidence_interval(data, confidence=0.95):
     a = 1.0 * np.array(data)
     n = len(a)
@@ -181,6 +222,167 @@ def calc_confidence_interval(data, confidence=0.95):
     h = se * stats.t.ppf((1 + confidence) / 2., n-1)
     return [m, se, m-h, m+h]
 
+def quantile_label(q):
+  if q == 0.5:
+    return "median"
+  return f"p{q*100:g}"
+
+# Merge adjacent buckets into at most max_bins bins of about the same number
+# of samples.  Returns the count, mean value, and lowest and highest bucket
+# of each bin.  Histograms with few buckets are returned as is.
+def rebin_histogram(bins, counts, max_bins=BOOTSTRAP_MAX_BINS):
+  bins = np.asarray(bins, dtype=float)
+  counts = np.asarray(counts, dtype=float)
+  order = np.argsort(bins, kind="stable")
+  bins = bins[order]
+  counts = counts[order]
+  if len(bins) <= max_bins:
+    return counts, bins, bins, bins
+
+  cum = np.cumsum(counts)
+  group = np.floor((cum-counts)/cum[-1]*max_bins).astype(np.int64)
+  starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+  ends = np.r_[starts[1:], len(bins)] - 1
+  bin_counts = np.add.reduceat(counts, starts)
+  bin_sums = np.add.reduceat(counts*bins, starts)
+  means = np.divide(bin_sums, bin_counts, out=bins[starts].copy(), where=bin_counts > 0)
+  return bin_counts, means, bins[starts], bins[ends]
+
+# Mean and quantiles of a matrix of histograms with one row per resample.
+# Quantiles are the first bin reaching q, interpolated within merged bins.
+def calc_resample_stats(resampled, n, means, lo, hi, quantiles):
+  values = np.empty((resampled.shape[0], 1+len(quantiles)))
+  values[:, 0] = resampled @ means / n
+
+  cum = np.cumsum(resampled, axis=1)
+  rows = np.arange(resampled.shape[0])
+  for j, q in enumerate(quantiles):
+    target = q*n
+    idx = np.minimum((cum < target).sum(axis=1), cum.shape[1]-1)
+    bin_counts = resampled[rows, idx]
+    frac = np.divide(target-(cum[rows, idx]-bin_counts), bin_counts,
+                     out=np.ones(len(rows)), where=bin_counts > 0)
+    values[:, j+1] = lo[idx] + frac*(hi[idx]-lo[idx])
+  return values
+
+# Bootstrap the mean and quantiles of a histogram from its buckets.  Each
+# resample is a multinomial draw of n samples over the buckets, and the
+# resamples are drawn in batches as a matrix with one row per resample.
+# Returns the observed statistics and a matrix of the resampled ones.
+def bootstrap_histogram(bins, counts, quantiles, resamples, rng, batch_size=250):
+  bin_counts, means, lo, hi = rebin_histogram(bins, counts)
+  n = int(round(bin_counts.sum()))
+  if n == 0 or resamples <= 0:
+    return None, None
+
+  observed = calc_resample_stats(bin_counts[np.newaxis, :], bin_counts.sum(), means, lo, hi, quantiles)[0]
+  p = bin_counts/bin_counts.sum()
+  batches = []
+  for start in range(0, resamples, batch_size):
+    resampled = rng.multinomial(n, p, size=min(batch_size, resamples-start))
+    batches.append(calc_resample_stats(resampled, n, means, lo, hi, quantiles))
+  return observed, np.vstack(batches)
+
+def calc_percentile_interval(values, level=BOOTSTRAP_LEVEL):
+  low, high = np.quantile(values, [(1-level)/2, (1+level)/2])
+  return {"min": float(low), "max": float(high)}
+
+# Fill the standard error and confidence interval of the mean, and the
+# intervals of the median and quantiles.  With the resamples of control, the
+# relative uplift of each statistic gets an interval too.  Control and
+# branch are resampled independently, so their resamples are paired by index.
+def calculate_bootstrap_intervals(observed, resampled, labels, result, control=None):
+  result["se"] = float(np.std(resampled[:, 0], ddof=1))
+  result["confidence"] = calc_percentile_interval(resampled[:, 0])
+
+  intervals = {}
+  for j, label in enumerate(labels):
+    intervals[label] = {"value": float(observed[j])} | calc_percentile_interval(resampled[:, j])
+    if control is None:
+      continue
+    control_observed, control_resampled = control
+    if control_observed[j] == 0 or np.any(control_resampled[:, j] == 0):
+      continue
+    uplifts = (resampled[:, j]-control_resampled[:, j])/control_resampled[:, j]*100.0
+    intervals[label]["uplift"] = {
+      "value": float((observed[j]-control_observed[j])/control_observed[j]*100.0)
+    } | calc_percentile_interval(uplifts)
+
+  result["bootstrap"] = {
+    "resamples": len(resampled),
+    "level": BOOTSTRAP_LEVEL,
+    "stats": intervals
+  }
+
+# Align the labels of categorical histograms, in the order they first
+# appear.  Returns the labels, and a matrix of counts with one row per
+# histogram and one column per label.
+def align_categorical_counts(histograms):
+  index = {}
+  for labels, counts in histograms:
+    for label in labels:
+      index.setdefault(label, len(index))
+
+  matrix = np.zeros((len(histograms), len(index)))
+  for i, (labels, counts) in enumerate(histograms):
+    np.add.at(matrix[i], [index[label] for label in labels], np.asarray(counts, dtype=float))
+  return list(index), matrix
+
+# Holm-Bonferroni correction of each row of p-values.
+def holm_correction(p_values):
+  m = p_values.shape[1]
+  order = np.argsort(p_values, axis=1)
+  ordered = np.take_along_axis(p_values, order, axis=1)
+  adjusted = np.minimum(np.maximum.accumulate(ordered*(m-np.arange(m)), axis=1), 1.0)
+  corrected = np.empty_like(adjusted)
+  np.put_along_axis(corrected, order, adjusted, axis=1)
+  return corrected
+
+# Chi-square test of independence of each table in a stack of contingency
+# tables.  Labels without any counts in a table are ignored.
+def calc_chi_square(tables):
+  totals = tables.sum(axis=(1, 2), keepdims=True)
+  rows = tables.sum(axis=2, keepdims=True)
+  cols = tables.sum(axis=1, keepdims=True)
+  expected = rows*cols/np.where(totals > 0, totals, 1)
+  terms = np.divide((tables-expected)**2, expected, out=np.zeros_like(tables), where=expected > 0)
+  score = terms.sum(axis=(1, 2))
+  dof = ((rows[:, :, 0] > 0).sum(axis=1)-1)*((cols[:, 0, :] > 0).sum(axis=1)-1)
+  p_value = np.where(dof > 0, stats.chi2.sf(score, np.maximum(dof, 1)), 1.0)
+  return score, p_value, dof
+
+# Compare the label proportions of every branch to control at once.  counts
+# has one row per branch with control first.  Each branch gets a chi-square
+# test against control, and a two-proportion z-test per label with the
+# p-values corrected for the number of labels.
+def calc_categorical_tests(counts):
+  totals = counts.sum(axis=1, keepdims=True)
+  ratios = np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+  control_counts, control_total, control_ratios = counts[:1], totals[:1], ratios[:1]
+  branch_counts, branch_totals, branch_ratios = counts[1:], totals[1:], ratios[1:]
+
+  # Overall test across all branches, and each branch against control.
+  overall = calc_chi_square(counts[np.newaxis])
+  pairs = np.stack([np.broadcast_to(control_counts, branch_counts.shape), branch_counts], axis=1)
+  chi2 = calc_chi_square(pairs)
+
+  pooled = (branch_counts+control_counts)/np.maximum(branch_totals+control_total, 1)
+  se = np.sqrt(pooled*(1-pooled)*(1/np.maximum(branch_totals, 1)+1/np.maximum(control_total, 1)))
+  z = np.divide(branch_ratios-control_ratios, se, out=np.zeros_like(se), where=se > 0)
+  p_value = 2*stats.norm.sf(np.abs(z))
+  p_adjusted = holm_correction(p_value) if p_value.shape[1] > 0 else p_value
+
+  return {
+    "totals": totals[:, 0],
+    "ratios": ratios,
+    "uplift": (branch_ratios-control_ratios)*100,
+    "overall": overall,
+    "chi2": chi2,
+    "z": z,
+    "p_value": p_value,
+    "p_adjusted": p_adjusted
+  }
+
 def createNumericalTemplate():
   template = {
       "desc": "",
@@ -211,7 +413,8 @@ def createCategoricalTemplate():
       "labels": [],
       "counts": [],
       "ratios": [],
-      "sum": 0
+      "sum": 0,
+      "tests": {}
   }
   return template
 
@@ -239,11 +442,20 @@ def createResultsTemplate(config):
   return template
 
 class DataAnalyzer:
-  def __init__(self, config):
+  def __init__(self, config, previousResults=None):
     self.config = config
     self.event_controldf = None
     self.control = self.config["branches"][0]
     self.results = createResultsTemplate(config)
+    self.previousResults = previousResults
+
+    # Each branch, segment and metric draws its resamples from its own
+    # generator, so the intervals are reproducible for a given seed no
+    # matter which metrics are analyzed together.
+    self.bootstrapResamples = self.config.get("bootstrap_resamples", BOOTSTRAP_RESAMPLES)
+    self.bootstrapQuantiles = [0.5] + [q for q in self.config.get("bootstrap_quantiles", BOOTSTRAP_QUANTILES) if q != 0.5]
+    self.bootstrapSeed = self.config.get("bootstrap_seed", BOOTSTRAP_SEED)
+    self.controlResamples = {}
 
     self.binVals = {}
     for field in self.config["pageload_event_metrics"]:
@@ -252,12 +464,120 @@ class DataAnalyzer:
   def processTelemetryData(self, telemetryData):
     for branch in self.config['branches']:
       self.processTelemetryDataForBranch(telemetryData, branch)
+    self.processCategoricalData(telemetryData)
+
+    if 'daily' in telemetryData:
+      self.processDailyData(telemetryData['daily'])
     return self.results
 
+  # The daily statistics of a metric depend on the config its data was
+  # fetched and bucketed with: the segments, the ISP blacklist, and the
+  # bounds and bucket resolution of the metric.
+  def dailyConfigHash(self, metric_type, metric):
+    blacklist = []
+    if 'isp_blacklist' in self.config:
+      with open(self.config['isp_blacklist'], 'r') as file:
+        blacklist = [line.strip() for line in file]
+    text = json.dumps({
+      "segments": self.config['segments'],
+      "blacklist": blacklist,
+      "metric": self.config[metric_type][metric]
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+  # Statistics of days that were already complete in the previous results
+  # can be reused as is, if they were computed with the same config.
+  def getPreviousDailyResults(self, branch, segment, metric_type, metric, configHash):
+    previous = {}
+    if self.previousResults is None:
+      return previous
+    try:
+      entries = self.previousResults[branch][segment][metric_type][metric]["daily"]
+      if self.previousResults["daily_config"][f"{metric_type}/{metric}"] != configHash:
+        return previous
+    except KeyError:
+      return previous
+    for entry in entries:
+      if entry["day"] < self.previousResults["endDate"]:
+        previous[entry["day"]] = entry
+    return previous
+
+  # Calculate the daily and cumulative mean, median and p95 of each numerical
+  # metric.  Days are processed in order while keeping a running total of the
+  # bucket counts, so each day only adds its own counts to the cumulative
+  # histogram instead of summing all the previous days again.
+  def processDailyData(self, daily):
+    print("Calculating daily trends.")
+    metrics = []
+    for hist in self.config["histograms"]:
+      if self.config["histograms"][hist]["kind"] != "categorical":
+        metrics.append(("histograms", hist, hist.split('.')[-1]))
+    for metric in self.config["pageload_event_metrics"]:
+      metrics.append(("pageload_event_metrics", metric, metric))
+
+    self.results["daily_config"] = {}
+    for metric_type, metric, name in metrics:
+      self.results["daily_config"][f"{metric_type}/{name}"] = self.dailyConfigHash(metric_type, metric)
+
+    for branch in self.config['branches']:
+      for segment in self.config['segments']:
+        for metric_type, metric, name in metrics:
+          configHash = self.results["daily_config"][f"{metric_type}/{name}"]
+          previous = self.getPreviousDailyResults(branch, segment, metric_type, name, configHash)
+          cumulative = {}
+          entries = []
+          with tracer.span("daily_statistics", metric=metric, branch=branch, segment=segment):
+            for day in daily:
+              data = daily[day][branch][segment][metric_type][metric]
+              for b, c in zip(data["bins"], data["counts"]):
+                cumulative[b] = cumulative.get(b, 0) + c
+
+              if day in previous:
+                entry = previous[day]
+              else:
+                entry = calc_histogram_summary(data["bins"], data["counts"])
+                entry["day"] = day
+                entry["cumulative"] = calc_histogram_summary(list(cumulative.keys()), list(cumulative.values()))
+              entries.append(entry)
+          self.results[branch][segment][metric_type][name]["daily"] = entries
+
+    # Uplift of the daily and cumulative means compared to control.
+    for branch in self.config['branches']:
+      if branch == self.control:
+        continue
+      for segment in self.config['segments']:
+        for metric_type, metric, name in metrics:
+          entries = self.results[branch][segment][metric_type][name]["daily"]
+          control_entries = self.results[self.control][segment][metric_type][name]["daily"]
+          for entry, control_entry in zip(entries, control_entries):
+            entry["uplift"] = calc_uplift(entry["mean"], control_entry["mean"])
+            entry["cumulative"]["uplift"] = calc_uplift(entry["cumulative"]["mean"], control_entry["cumulative"]["mean"])
+
   def processTelemetryDataForBranch(self, data, branch):
     self.processHistogramData(data, branch)
     self.processPageLoadEventData(data, branch)
 
+  # Bootstrap confidence intervals of the mean, median and quantiles, and of
+  # their uplift compared to control.  Control is processed first, and its
+  # resamples are kept for the other branches.
+  def processBootstrap(self, bins, counts, result, branch, segment, metric):
+    if self.bootstrapResamples <= 0:
+      return
+    with tracer.span("bootstrap", metric=metric, branch=branch, segment=segment):
+      key = zlib.crc32(f"{branch}/{segment}/{metric}".encode("utf-8"))
+      rng = np.random.default_rng([self.bootstrapSeed, key])
+      observed, resampled = bootstrap_histogram(bins, counts, self.bootstrapQuantiles,
+                                                self.bootstrapResamples, rng)
+      if resampled is None:
+        return
+      labels = ["mean"] + [quantile_label(q) for q in self.bootstrapQuantiles]
+      if branch == self.control:
+        self.controlResamples[(segment, metric)] = (observed, resampled)
+        calculate_bootstrap_intervals(observed, resampled, labels, result)
+      else:
+        control = self.controlResamples.get((segment, metric))
+        calculate_bootstrap_intervals(observed, resampled, labels, result, control)
+
   def processNumericalHistogramData(self, hist, data, branch, segment):
     hist_name = hist.split('.')[-1]
     print(f"      processing numerical histogram: {hist}")
@@ -269,37 +589,61 @@ class DataAnalyzer:
     desc = self.config["histograms"][hist]["desc"]
     self.results[branch][segment]["histograms"][hist_name]["desc"] = desc
 
-    calculate_histogram_stats(bins, counts, self.results[branch][segment]["histograms"][hist_name])
+    with tracer.span("statistics", metric=hist, branch=branch, segment=segment):
+      calculate_histogram_stats(bins, counts, self.results[branch][segment]["histograms"][hist_name])
+    self.processBootstrap(bins, counts, self.results[branch][segment]["histograms"][hist_name], branch, segment, hist)
 
     # Calculate statistical tests
     if branch != self.control:
       control_data = data[self.control][segment]["histograms"][hist]
       branch_data = data[branch][segment]["histograms"][hist]
       result = self.results[branch][segment]["histograms"][hist_name]
-      calculate_histogram_tests_subsampling(control_data, branch_data, result)
+      with tracer.span("tests", metric=hist, branch=branch, segment=segment):
+        calculate_histogram_tests_subsampling(control_data, branch_data, result)
 
-  def processCategoricalHistogramData(self, hist, data, branch, segment):
+  # Categorical histograms are analyzed for all branches together, once the
+  # labels of every branch are aligned.
+  def processCategoricalHistogramData(self, hist, data, segment):
     hist_name = hist.split('.')[-1]
     print(f"      processing categorical histogram: {hist}")
     desc = self.config["histograms"][hist]["desc"]
-    labels = data[branch][segment]["histograms"][hist]["bins"]
-    counts = data[branch][segment]["histograms"][hist]["counts"]
-
-    self.results[branch][segment]["histograms"][hist_name]["desc"] = desc
-    self.results[branch][segment]["histograms"][hist_name]["labels"] = labels
-    self.results[branch][segment]["histograms"][hist_name]["counts"] = counts
-    total = sum(counts)
+    branches = self.config['branches']
 
-    self.results[branch][segment]["histograms"][hist_name]["sum"] = total
-    ratios = [x/total for x in counts]
-    self.results[branch][segment]["histograms"][hist_name]["ratios"] = ratios
+    histograms = [(data[branch][segment]["histograms"][hist]["bins"],
+                   data[branch][segment]["histograms"][hist]["counts"]) for branch in branches]
+    with tracer.span("tests", metric=hist, segment=segment):
+      labels, counts = align_categorical_counts(histograms)
+      tests = calc_categorical_tests(counts)
 
-    if branch != self.control:
-      ratios_control = self.results[self.control][segment]["histograms"][hist_name]["ratios"]
-      uplift = []
-      for i in range(len(ratios)):
-        uplift.append((ratios[i]-ratios_control[i])*100)
-        self.results[branch][segment]["histograms"][hist_name]["uplift"] = uplift
+    for i, branch in enumerate(branches):
+      result = self.results[branch][segment]["histograms"][hist_name]
+      result["desc"] = desc
+      result["labels"] = labels
+      result["counts"] = counts[i].tolist()
+      result["sum"] = float(tests["totals"][i])
+      result["ratios"] = tests["ratios"][i].tolist()
+      if branch == self.control:
+        score, p_value, dof = tests["overall"]
+        result["tests"]["chi2"] = {"score": float(score[0]), "p-value": float(p_value[0]), "dof": int(dof[0])}
+        continue
+
+      j = i-1
+      score, p_value, dof = tests["chi2"]
+      result["uplift"] = tests["uplift"][j].tolist()
+      result["tests"]["chi2"] = {"score": float(score[j]), "p-value": float(p_value[j]), "dof": int(dof[j])}
+      result["tests"]["ztest"] = {
+        "score": tests["z"][j].tolist(),
+        "p-value": tests["p_value"][j].tolist(),
+        "p-adjusted": tests["p_adjusted"][j].tolist()
+      }
+      result["significant"] = np.flatnonzero(tests["p_adjusted"][j] < CATEGORICAL_ALPHA).tolist()
+
+  def processCategoricalData(self, data):
+    print("Calculating categorical histogram statistics.")
+    for segment in self.config['segments']:
+      for hist in self.config["histograms"]:
+        if self.config["histograms"][hist]["kind"] == "categorical":
+          self.processCategoricalHistogramData(hist, data, segment)
 
   def processHistogramData(self, data, branch):
     print(f"Calculating histogram statistics for branch: {branch}")
@@ -308,9 +652,7 @@ class DataAnalyzer:
     
       for hist in self.config["histograms"]:
         kind = self.config["histograms"][hist]["kind"]
-        if kind=="categorical":
-          self.processCategoricalHistogramData(hist, data, branch, segment)
-        else:
+        if kind!="categorical":
           self.processNumericalHistogramData(hist, data, branch, segment)
 
 
@@ -327,14 +669,17 @@ class DataAnalyzer:
         counts = data[branch][segment]["pageload_event_metrics"][metric]["counts"]
         desc = self.config["pageload_event_metrics"][metric]["desc"]
         self.results[branch][segment]["pageload_event_metrics"][metric]["desc"] = desc
-        calculate_histogram_stats(bins, counts, self.results[branch][segment]["pageload_event_metrics"][metric])
+        with tracer.span("statistics", metric=metric, branch=branch, segment=segment):
+          calculate_histogram_stats(bins, counts, self.results[branch][segment]["pageload_event_metrics"][metric])
+        self.processBootstrap(bins, counts, self.results[branch][segment]["pageload_event_metrics"][metric], branch, segment, metric)
 
         # Calculate statistical tests
         if branch != self.control:
           control_data = data[self.control][segment]["pageload_event_metrics"][metric]
           branch_data = data[branch][segment]["pageload_event_metrics"][metric]
           result = self.results[branch][segment]["pageload_event_metrics"][metric]
-          calculate_histogram_tests_subsampling(control_data, branch_data, result)
+          with tracer.span("tests", metric=metric, branch=branch, segment=segment):
+            calculate_histogram_tests_subsampling(control_data, branch_data, result)
 
         # Calculate statistical tests
         #if branch != self.control:
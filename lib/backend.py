@@ -0,0 +1,316 @@
+import os
+import re
+import sys
+import threading
+from lib.instrumentation import tracer
+
+# Backends execute a rendered query and return the results as a dataframe
+# with the columns selected by the query.
+
+# Results are downloaded as a stream of arrow record batches.  Rows are summed
+# per key (every column except counts) as they arrive, so memory use tracks
+# the size of the aggregated histograms rather than the raw download.
+# The schema is needed to build the (empty) dataframe of a query without
+# rows, since no batch may be downloaded then.
+def aggregate_record_batches(batches, schema, compact_rows=1000000):
+  import pyarrow as pa
+
+  def aggregate(table):
+    keys = [c for c in table.column_names if c != "counts"]
+    if "counts" not in table.column_names:
+      return table
+    # Engines may return sums as decimals, but counts are always integers.
+    i = table.column_names.index("counts")
+    table = table.set_column(i, "counts", table.column("counts").cast(pa.int64()))
+    table = table.group_by(keys).aggregate([("counts", "sum")])
+    return table.rename_columns(keys + ["counts"])
+
+  partials = []
+  rows = 0
+  for batch in batches:
+    if batch.num_rows == 0:
+      schema = batch.schema
+      continue
+    partial = aggregate(pa.Table.from_batches([batch]))
+    partials.append(partial)
+    rows = rows + partial.num_rows
+
+    # Periodically merge the partial aggregates together.
+    if rows > compact_rows and len(partials) > 1:
+      partials = [aggregate(pa.concat_tables(partials))]
+      rows = partials[0].num_rows
+
+  if len(partials) == 0:
+    table = schema.empty_table()
+  else:
+    table = aggregate(pa.concat_tables(partials))
+
+  keys = [c for c in table.column_names if c != "counts"]
+  table = table.sort_by([(k, "ascending") for k in keys])
+  categories = [c for c in ["segment", "branch"] if c in table.column_names]
+  return table.to_pandas(categories=categories)
+
+# Only pass the parameters that the query references.
+def used_parameters(query, parameters):
+  if not parameters:
+    return {}
+  names = set(re.findall(r"@(\w+)", query))
+  return {name: value for name, value in parameters.items() if name in names}
+
+def bigquery_parameters(parameters):
+  from google.cloud import bigquery
+  params = []
+  for name, value in parameters.items():
+    if isinstance(value, list):
+      params.append(bigquery.ArrayQueryParameter(name, "STRING", value))
+    elif isinstance(value, int):
+      params.append(bigquery.ScalarQueryParameter(name, "INT64", value))
+    elif isinstance(value, float):
+      params.append(bigquery.ScalarQueryParameter(name, "FLOAT64", value))
+    else:
+      params.append(bigquery.ScalarQueryParameter(name, "STRING", value))
+  return params
+
+# Arrow schema of the results of a BigQuery query, from the types of the
+# columns the queries return.
+def bigquery_arrow_schema(fields):
+  import pyarrow as pa
+  types = {
+    "STRING": pa.string(),
+    "INTEGER": pa.int64(),
+    "INT64": pa.int64(),
+    "FLOAT": pa.float64(),
+    "FLOAT64": pa.float64(),
+    "NUMERIC": pa.decimal128(38, 9),
+    "BOOLEAN": pa.bool_(),
+    "BOOL": pa.bool_(),
+    "DATE": pa.date32(),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC")
+  }
+  return pa.schema([(field.name, types[field.field_type]) for field in fields])
+
+class BigQueryBackend:
+  def __init__(self):
+    self.client = None
+    self.storageClient = None
+    self.lock = threading.Lock()
+
+  # The bigquery client is only created once a query actually needs to run,
+  # so cached data can be used without credentials.
+  def connect(self):
+    with self.lock:
+      if self.client is not None:
+        return
+      from google.cloud import bigquery
+
+      # Use the Storage Read API when available, otherwise results are
+      # paged through the REST API.
+      try:
+        from google.cloud import bigquery_storage
+        self.storageClient = bigquery_storage.BigQueryReadClient()
+      except ImportError:
+        print("WARNING: google-cloud-bigquery-storage not installed, downloads will be slower.")
+      self.client = bigquery.Client()
+
+  def query(self, query, parameters=None):
+    return self.result(self.submit(query, parameters))
+
+  # Start a query job without waiting for it.  Returns a reference to the
+  # job that can be saved, and passed to result() by a later run.
+  def submit(self, query, parameters=None):
+    self.connect()
+    from google.cloud import bigquery
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=bigquery_parameters(used_parameters(query, parameters)))
+    job = self.client.query(query, job_config=job_config)
+    return {"job_id": job.job_id, "location": job.location}
+
+  # Wait for a job to finish and download its results.  Finished jobs are
+  # read from their destination table.  Raises if the job failed, or its
+  # results expired.
+  def result(self, jobRef):
+    self.connect()
+    job = self.client.get_job(jobRef["job_id"], location=jobRef.get("location"))
+    with tracer.span("query_wait"):
+      rows = job.result()
+    tracer.recordJob({
+      "engine": "bigquery",
+      "job_id": job.job_id,
+      "bytes_processed": job.total_bytes_processed,
+      "bytes_billed": job.total_bytes_billed,
+      "slot_millis": job.slot_millis,
+      "cache_hit": job.cache_hit
+    })
+
+    with tracer.span("download"):
+      batches = rows.to_arrow_iterable(bqstorage_client=self.storageClient)
+      return aggregate_record_batches(batches, bigquery_arrow_schema(rows.schema))
+
+  # Estimate the bytes the query would scan with a dry run, which is free.
+  def estimate(self, query, parameters=None):
+    self.connect()
+    from google.cloud import bigquery
+    job_config = bigquery.QueryJobConfig(
+        dry_run=True, use_query_cache=False,
+        query_parameters=bigquery_parameters(used_parameters(query, parameters)))
+    job = self.client.query(query, job_config=job_config)
+    return job.total_bytes_processed
+
+# Find the index of the parenthesis closing the one at text[start].
+def find_closing_paren(text, start):
+  depth = 0
+  quote = None
+  for i in range(start, len(text)):
+    c = text[i]
+    if quote:
+      if c == quote:
+        quote = None
+    elif c == "'" or c == '"':
+      quote = c
+    elif c == "(":
+      depth = depth + 1
+    elif c == ")":
+      depth = depth - 1
+      if depth == 0:
+        return i
+  raise ValueError("Unbalanced parenthesis in query.")
+
+# Rewrite every UNNEST(...) that is used as a table expression into a
+# DuckDB subquery.  Aliased UNNESTs keep the element as a struct, while
+# anonymous ones expose the struct fields (e.g. key and value) as columns.
+def translate_unnest(query):
+  pattern = re.compile(r"(CROSS\s+JOIN|FROM|,|IN)\s+UNNEST\s*\(", re.IGNORECASE)
+  pos = 0
+  while True:
+    m = pattern.search(query, pos)
+    if m is None:
+      return query
+    start = m.end() - 1
+    end = find_closing_paren(query, start)
+    expr = query[start+1:end]
+
+    alias = re.match(r"\s+as\s+(\w+)", query[end+1:], re.IGNORECASE)
+    if m.group(1).upper() == "IN":
+      replacement = f"(SELECT UNNEST({expr}))"
+      tail = end+1
+    elif alias:
+      replacement = f"(SELECT UNNEST({expr}) AS {alias.group(1)})"
+      tail = end+1+alias.end()
+    else:
+      replacement = f"(SELECT UNNEST({expr}, recursive := true))"
+      tail = end+1
+
+    prefix = query[:m.start(1)] + m.group(1) + " "
+    query = prefix + replacement + query[tail:]
+    pos = len(prefix)+len("(SELECT UNNEST(")
+
+# PARSE_JSON(x)[key] has no direct equivalent, so extract the key instead.
+def translate_json_subscript(query):
+  pattern = re.compile(r"PARSE_JSON\s*\(", re.IGNORECASE)
+  while True:
+    m = pattern.search(query)
+    if m is None:
+      return query
+    end = find_closing_paren(query, m.end()-1)
+    expr = query[m.end():end]
+    if query[end+1:end+2] == "[":
+      close = query.index("]", end+1)
+      key = query[end+2:close]
+      query = query[:m.start()] + f"json_extract({expr}, '$.\"' || {key} || '\"')" + query[close+1:]
+    else:
+      query = query[:m.start()] + f"CAST({expr} AS JSON)" + query[end+1:]
+
+# Translate the BigQuery dialect used by the sql templates into DuckDB.
+# Only the constructs used by the templates are supported.
+def translate_bigquery_sql(query):
+  # BigQuery string literals can be double quoted, while DuckDB uses
+  # double quotes for identifiers.
+  query = re.sub(r'"([^"\n]*)"', lambda m: "'" + m.group(1).replace("'", "''") + "'", query)
+
+  # Fully qualified table names become a single quoted identifier.
+  query = re.sub(r"`([^`]+)`", r'"\1"', query)
+
+  query = re.sub(r"mozfun\.map\.get_key\s*\(", "mozfun_map_get_key(", query)
+  query = re.sub(r"bqutil\.fn\.json_extract_keys\s*\(", "json_keys(", query)
+  query = re.sub(r"\bSAFE_CAST\s*\(", "TRY_CAST(", query, flags=re.IGNORECASE)
+  query = re.sub(r"\[\s*offset\s*\(\s*(\d+)\s*\)\s*\]",
+                 lambda m: f"[{int(m.group(1))+1}]", query, flags=re.IGNORECASE)
+  query = translate_json_subscript(query)
+  query = translate_unnest(query)
+  # Named query parameters.
+  query = re.sub(r"@(\w+)", r"$\1", query)
+  return query
+
+class DuckDBBackend:
+  # Tables are read from parquet files in parquetDir/<project.dataset.table>/,
+  # e.g. parquetDir/mozdata.firefox_desktop.metrics/*.parquet
+  def __init__(self, parquetDir):
+    try:
+      import duckdb
+    except ImportError:
+      print("ERROR: the duckdb backend requires duckdb: pip install duckdb")
+      sys.exit(1)
+
+    if not parquetDir or not os.path.isdir(parquetDir):
+      print(f"ERROR: parquet directory '{parquetDir}' does not exist.")
+      sys.exit(1)
+
+    self.parquetDir = parquetDir
+    self.con = duckdb.connect()
+    self.tables = set()
+    self.lock = threading.Lock()
+
+    # Functions used by the templates that DuckDB doesn't provide.
+    self.con.execute("CREATE MACRO date(x) AS CAST(x AS DATE)")
+    self.con.execute("CREATE MACRO int64(x) AS CAST(x AS BIGINT)")
+    self.con.execute("CREATE MACRO mozfun_map_get_key(m, k) AS list_extract(list_filter(m, x -> x.key = k), 1).value")
+
+  def registerTable(self, table):
+    with self.lock:
+      if table in self.tables:
+        return
+      self.tables.add(table)
+      self.createView(table)
+
+  # There is no schema to give a missing table, and the queries would fail
+  # on its columns anyway, so stop with the name of the table instead.
+  def createView(self, table):
+    tableDir = os.path.join(self.parquetDir, table)
+    if not os.path.isdir(tableDir):
+      print(f"ERROR: no parquet data for {table}, expected it in {tableDir}/.")
+      sys.exit(1)
+    files = os.path.join(tableDir, "**", "*.parquet").replace("'", "''")
+    self.con.execute(f"CREATE VIEW \"{table}\" AS SELECT * FROM read_parquet('{files}', union_by_name=true)")
+
+  def query(self, query, parameters=None):
+    for table in re.findall(r"`([^`]+)`", query):
+      self.registerTable(table)
+    # Each query uses its own cursor so that queries can run concurrently.
+    with tracer.span("query_wait"):
+      cursor = self.con.cursor()
+      reader = cursor.execute(translate_bigquery_sql(query), used_parameters(query, parameters)).fetch_record_batch()
+    tracer.recordJob({"engine": "duckdb"})
+
+    with tracer.span("download"):
+      return aggregate_record_batches(reader, reader.schema)
+
+  # DuckDB has no dry run, so use the size of the parquet files of the
+  # referenced tables as an upper bound.
+  def estimate(self, query, parameters=None):
+    total = 0
+    for table in set(re.findall(r"`([^`]+)`", query)):
+      tableDir = os.path.join(self.parquetDir, table)
+      for root, dirs, files in os.walk(tableDir):
+        for f in files:
+          if f.endswith(".parquet"):
+            total = total + os.path.getsize(os.path.join(root, f))
+    return total
+
+def createBackend(name, parquetDir=None):
+  if name == "bigquery":
+    return BigQueryBackend()
+  elif name == "duckdb":
+    return DuckDBBackend(parquetDir)
+  else:
+    print(f"ERROR: unknown backend '{name}'.")
+    sys.exit(1)
@@ -1,19 +1,29 @@
 #!/usr/bin/env python3
+import copy
+import datetime
 import json
 import os
+import re
 import sys
 import time
-import numpy as np
-import django
-from django.apps import apps
 import lib.parser as parser
-from django.conf import settings
-from lib.telemetry import TelemetryClient
-from lib.analysis import DataAnalyzer
-from lib.report import ReportGenerator
+from lib.backend import createBackend
+from lib.instrumentation import tracer
+
+# Percentage of clients (by sample_id) used by each stage of a preview.
+PREVIEW_SAMPLES = [1, 10, 100]
+
+# Keys of the results of a metric that the summary section uses.  Streamed
+# results only keep these for each metric.
+SUMMARY_KEYS = ["desc", "n", "mean", "std", "se", "confidence", "tests", "labels", "uplift", "significant", "sum"]
+
+# Heavy dependencies (bigquery, pandas, scipy, django, airium, bs4) are
+# imported on the code paths that use them, so that reports served from
+# the local cache start quickly.
 
 class NpEncoder(json.JSONEncoder):
   def default(self, obj):
+    import numpy as np
     if isinstance(obj, np.integer):
       return int(obj)
     if isinstance(obj, np.floating):
@@ -23,6 +33,9 @@ class NpEncoder(json.JSONEncoder):
     return super(NpEncoder, self).default(obj)
 
 def setupDjango():
+  import django
+  from django.apps import apps
+  from django.conf import settings
   if apps.ready:
     return
 
@@ -36,18 +49,31 @@ def setupDjango():
   settings.configure(TEMPLATES=TEMPLATES)
   django.setup()
 
+# Data fetched by a local backend is kept apart from the BigQuery data, so
+# that a BigQuery run never reuses the caches of a run on fixtures.
+def backendDataDir(dataDir, backend):
+  if backend == "bigquery":
+    return dataDir
+  return os.path.join(dataDir, backend)
+
 def setupDirs(slug, dataDir, reportDir, generate_report):
   if not os.path.isdir(dataDir):
-    os.mkdir(dataDir)
+    os.makedirs(dataDir)
   if not os.path.isdir(os.path.join(dataDir,slug)):
     os.mkdir(os.path.join(dataDir,slug))
   if generate_report:
     if not os.path.isdir(reportDir):
       os.mkdir(reportDir)
 
-def getResultsForExperiment(slug, dataDir, config, skipCache):
-  sqlClient = TelemetryClient(dataDir, config, skipCache)
-  telemetryData = sqlClient.getResults()
+def getResultsForExperiment(slug, dataDir, config, skipCache, backend, previousResults=None, shardDays=None, jobs=4,
+                            sampleRanges=None):
+  from lib.telemetry import TelemetryClient
+  from lib.analysis import DataAnalyzer
+
+  setupDjango()
+  sqlClient = TelemetryClient(dataDir, config, skipCache, backend, shardDays, jobs, sampleRanges)
+  with tracer.span("telemetry"):
+    telemetryData = sqlClient.getResults()
 
   # Change the branches to a list for easier use during analysis.
   branch_names = []
@@ -55,22 +81,28 @@ def getResultsForExperiment(slug, dataDir, config, skipCache):
     branch_names.append(config['branches'][i]['name'])
   config['branches'] = branch_names
 
-  analyzer = DataAnalyzer(config)
-  results = analyzer.processTelemetryData(telemetryData)
+  with tracer.span("analysis"):
+    analyzer = DataAnalyzer(config, previousResults)
+    results = analyzer.processTelemetryData(telemetryData)
 
   # Save the queries into the results and cache them.
-  queriesFile=os.path.join(dataDir, f"{slug}-queries.json")
-  if 'queries' in telemetryData and telemetryData['queries']:
-    with open(queriesFile, 'w') as f:
-      json.dump(telemetryData['queries'], f, indent=2, cls=NpEncoder)
-  else:
-    queries = checkForLocalResults(queriesFile)
-    if queries is not None:
-      telemetryData['queries'] = queries
-
-  results['queries'] = telemetryData['queries']
+  results['queries'] = saveQueries(dataDir, slug, telemetryData.get('queries', []), skipCache)
   return results
 
+# The queries of the metrics that were already cached, by an earlier run or
+# by a batch query, are kept from the cached queries, so the report shows
+# the queries of every metric.
+def saveQueries(dataDir, slug, queries, skipCache):
+  queriesFile = os.path.join(dataDir, f"{slug}-queries.json")
+  cached = None if skipCache else checkForLocalResults(queriesFile)
+  if cached is not None:
+    names = set(query["name"] for query in queries)
+    queries = queries + [query for query in cached if query["name"] not in names]
+  if queries:
+    with open(queriesFile, 'w') as f:
+      json.dump(queries, f, indent=2, cls=NpEncoder)
+  return queries
+
 def checkForLocalResults(resultsFile):
   if os.path.isfile(resultsFile):
     with open(resultsFile, 'r') as f:
@@ -78,10 +110,292 @@ def checkForLocalResults(resultsFile):
       return results
   return None
 
-def generate_report(args):
-  startTime = time.time()
+# The html report only needs to be regenerated if the results, or the
+# templates and code used to render them have changed.  An unchanged report
+# isn't rewritten, and keeps its old modification time, so the check is
+# based on the content of the files instead: the hashes of the report and of
+# everything it was rendered from are recorded next to the results.
+def reportStampFile(resultsFile):
+  return re.sub(r"-results\.json$", "-report.json", resultsFile)
+
+# Streamed reports are assembled from the results and rendered fragments of
+# each metric in streamDir, so those files are dependencies too.
+def reportDependencies(resultsFile, streamDir=None):
+  from lib.publish import fileHash
+
+  libDir = os.path.dirname(__file__)
+  dependencies = {"results": resultsFile, "report.py": os.path.join(libDir, 'report.py')}
+  for templateDir in ['html', 'static']:
+    for f in sorted(os.listdir(os.path.join(libDir, 'templates', templateDir))):
+      dependencies[f"{templateDir}/{f}"] = os.path.join(libDir, 'templates', templateDir, f)
+  if streamDir is not None and os.path.isdir(streamDir):
+    for f in sorted(os.listdir(streamDir)):
+      dependencies[f"stream/{f}"] = os.path.join(streamDir, f)
+  return {name: fileHash(filename) for name, filename in dependencies.items()}
+
+def writeReportStamp(reportFile, resultsFile, streamDir=None):
+  from lib.publish import fileHash
+
+  stamp = {"report": fileHash(reportFile), "dependencies": reportDependencies(resultsFile, streamDir)}
+  with open(reportStampFile(resultsFile), 'w') as f:
+    json.dump(stamp, f, indent=2)
+
+def reportIsCurrent(reportFile, resultsFile, streamDir=None):
+  from lib.publish import fileHash
+
+  stamp = parser.checkForLocalFile(reportStampFile(resultsFile))
+  if stamp is None or not os.path.isfile(reportFile) or not os.path.isfile(resultsFile):
+    return False
+  return (stamp["report"] == fileHash(reportFile)
+          and stamp["dependencies"] == reportDependencies(resultsFile, streamDir))
+
+# Results of an ongoing experiment only cover the data up to the day
+# they were generated, so they are refreshed once new days are available.
+# Preview results that were not refined to the full population yet are
+# also refreshed.
+def resultsAreOutdated(results):
+  if results.get("sample_percent", 100) < 100:
+    return True
+  if not results.get("isOngoing", False):
+    return False
+  # Days are UTC dates, as in the telemetry partitions.
+  today = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d')
+  return results["endDate"] < today
+
+def writeHTMLReport(results, reportFile, renderFragments=True, jobs=None, cacheDir=None):
+  if 'stream' in results:
+    writeStreamedHTMLReport(results, reportFile, renderFragments, cacheDir)
+    return
+
+  with tracer.span("html_report"):
+    from lib.report import ReportGenerator
+
+    setupDjango()
+    gen = ReportGenerator(results, cacheDir)
+    report = gen.createHTMLReport(jobs)
+    publishReport(reportFile, report)
+
+# Reports are written with their compressed siblings, and the shared
+# javascript and css they link to.  A report whose content didn't change
+# is left untouched.  Large reports are published from the file they were
+# streamed to, rather than from memory.
+def publishReport(reportFile, report=None, sourceFile=None):
+  from lib.publish import publish, publishFile, publishAssets
+
+  with tracer.span("publish"):
+    reportDir = os.path.dirname(reportFile)
+    publishAssets(reportDir)
+    if sourceFile is not None:
+      changed = publishFile(reportFile, sourceFile)
+    else:
+      changed = publish(reportFile, report)
+    if not changed:
+      print(f"Report {reportFile} is unchanged.")
+
+def streamFragmentFile(streamDir, segment, metric_type, metric):
+  segment = re.sub(r"[^\w.-]", "_", segment)
+  return os.path.join(streamDir, f"{metric_type}-{metric}-{segment}.html")
+
+# Render the html cells of a single metric, one file per segment.  Returns
+# the keys of the cached cells that were used.
+def writeMetricFragments(results, streamDir, metric_type, metric, kind, cacheDir=None):
+  from lib.report import ReportGenerator
 
   setupDjango()
+  with tracer.span("html_report"):
+    gen = ReportGenerator(results, cacheDir)
+    for segment in results['segments']:
+      with open(streamFragmentFile(streamDir, segment, metric_type, metric), 'w') as f:
+        f.write(gen.createMetricFragment(segment, metric, metric_type, kind))
+  return gen.usedKeys
+
+# The fragments are rendered again from the results of each metric when the
+# templates changed since the report was generated.
+def writeStreamedHTMLReport(results, reportFile, renderFragments=True, cacheDir=None):
+  from lib.report import ReportGenerator
+
+  streamDir = results['stream']['dir']
+  if renderFragments:
+    from lib.report import prune_cell_cache
+
+    cellKeys = set()
+    for entry in results['stream']['metrics']:
+      metricResults = checkForLocalResults(os.path.join(streamDir, entry['file']))
+      cellKeys |= writeMetricFragments(metricResults, streamDir, entry['metric_type'], entry['metric'],
+                                       entry['kind'], cacheDir)
+    prune_cell_cache(cacheDir, cellKeys)
+
+  with tracer.span("html_report"):
+    setupDjango()
+    gen = ReportGenerator(results)
+    tmpFile = f"{reportFile}.stream"
+    with open(tmpFile, "w") as f:
+      gen.writeStreamedHTMLReport(f, lambda segment, metric_type, metric:
+                                  streamFragmentFile(streamDir, segment, metric_type, metric))
+    publishReport(reportFile, sourceFile=tmpFile)
+
+def summaryRecord(result):
+  record = {key: result[key] for key in SUMMARY_KEYS if key in result}
+  if "tests" in record:
+    record["tests"] = {name: test for name, test in record["tests"].items() if name != "ztest"}
+  return record
+
+# The streaming mode fetches, analyzes and renders one metric at a time.  The
+# results and html cells of each metric are written to {dataDir}/{slug}-stream/
+# before moving on to the next metric, so memory use is bounded by the largest
+# metric instead of the whole report.  The returned results only hold the
+# small records of each metric used by the summary section.
+def streamResultsForExperiment(slug, dataDir, config, skipCache, backend, shardDays=None, jobs=4):
+  from lib.telemetry import TelemetryClient
+  from lib.analysis import DataAnalyzer
+  from lib.report import prune_cell_cache
+
+  setupDjango()
+  streamDir = os.path.join(dataDir, f"{slug}-stream")
+  os.makedirs(streamDir, exist_ok=True)
+
+  branch_names = [branch['name'] for branch in config['branches']]
+  results = {}
+  for branch in branch_names:
+    results[branch] = {}
+    for segment in config['segments']:
+      results[branch][segment] = {"histograms": {}, "pageload_event_metrics": {}}
+
+  # Each metric is fetched by its own client, so the queries of every metric
+  # are dry run first and checked against the budget of the whole report.
+  if 'max_bytes_scanned' in config:
+    with tracer.span("telemetry"):
+      budgetClient = TelemetryClient(dataDir, copy.deepcopy(config), skipCache, backend, shardDays, jobs)
+      budgetClient.checkBudget(budgetClient.planMetrics(budgetClient.getMetricsToFetch(), fuse=False))
+      del budgetClient
+
+  metrics = [("histograms", histogram) for histogram in config['histograms']]
+  metrics.extend(("pageload_event_metrics", metric) for metric in config['pageload_event_metrics'])
+  histograms = {}
+  event_metrics = {}
+  queries = []
+  entries = []
+  cacheDir = os.path.join(dataDir, "html-cache")
+  cellKeys = set()
+  for metric_type, metric in metrics:
+    print("---------------------------------")
+    print(f"Streaming {metric}")
+    metricConfig = copy.deepcopy(config)
+    metricConfig['histograms'] = {}
+    metricConfig['pageload_event_metrics'] = {}
+    metricConfig[metric_type][metric] = config[metric_type][metric]
+
+    with tracer.span("telemetry"):
+      sqlClient = TelemetryClient(dataDir, metricConfig, skipCache, backend, shardDays, jobs)
+      telemetryData = sqlClient.getResults()
+    queries.extend(telemetryData['queries'])
+
+    # Histograms without data are removed by the client.
+    if metric not in metricConfig[metric_type]:
+      continue
+
+    # The daily statistics of the previous results of the metric are reused.
+    name = metric.split('.')[-1]
+    metricFile = f"{metric_type}-{name}.json"
+    previousResults = None if skipCache else checkForLocalResults(os.path.join(streamDir, metricFile))
+
+    metricConfig['branches'] = branch_names
+    with tracer.span("analysis"):
+      analyzer = DataAnalyzer(metricConfig, previousResults)
+      metricResults = analyzer.processTelemetryData(telemetryData) | metricConfig
+    metricResults['queries'] = telemetryData['queries']
+    del telemetryData, sqlClient, analyzer
+
+    with tracer.span("write_results"):
+      with open(os.path.join(streamDir, metricFile), 'w') as f:
+        json.dump(metricResults, f, indent=2, cls=NpEncoder)
+
+    kind = metricConfig['histograms'][metric]['kind'] if metric_type == "histograms" else "numerical"
+    cellKeys |= writeMetricFragments(metricResults, streamDir, metric_type, name, kind, cacheDir)
+
+    for branch in branch_names:
+      for segment in config['segments']:
+        results[branch][segment][metric_type][name] = summaryRecord(metricResults[branch][segment][metric_type][name])
+    if metric_type == "histograms":
+      histograms[metric] = metricConfig['histograms'][metric]
+    else:
+      event_metrics[metric] = metricConfig['pageload_event_metrics'][metric]
+    entries.append({"metric_type": metric_type, "metric": name, "kind": kind, "file": metricFile})
+    del metricResults
+
+  prune_cell_cache(cacheDir, cellKeys)
+
+  # Only keep the metrics that had data.
+  config['histograms'] = histograms
+  config['pageload_event_metrics'] = event_metrics
+  config['branches'] = branch_names
+
+  results['queries'] = saveQueries(dataDir, slug, queries, skipCache)
+  results['stream'] = {"dir": streamDir, "metrics": entries}
+  return results
+
+def writeInstrumentation(dataDir, slug, args):
+  instrumentationFile = os.path.join(dataDir, f"{slug}-instrumentation.json")
+  print(f"Writing instrumentation to {instrumentationFile}")
+  tracer.write(instrumentationFile)
+
+  if args.trace:
+    traceFile = os.path.join(dataDir, f"{slug}-trace.json")
+    print(f"Writing chrome trace to {traceFile}")
+    tracer.writeChromeTrace(traceFile)
+
+  stages = tracer.summary()["stages"]
+  for stage in ["load_results", "telemetry", "analysis", "write_results", "html_report"]:
+    if stage in stages:
+      print(f"  {stage:<15}: {stages[stage]['total']:.1f} seconds")
+
+# Annotate the metrics, and add the experiment details from the Nimbus API.
+def prepareConfig(config, dataDir, slug, skipCache):
+  # Annotate metrics
+  with tracer.span("annotate_metrics"):
+    parser.annotateMetrics(config)
+
+  if config["is_experiment"] == True:
+    # Parse Nimbus API.
+    with tracer.span("nimbus_api"):
+      api = parser.parseNimbusAPI(dataDir, slug, skipCache)
+    config = config | api
+
+    # If the experiment is a rollout, then use the non-enrolled branch
+    # as the control.
+    if config['isRollout'] == True:
+      config['include_non_enrolled_branch'] = True
+
+    # If non-enrolled branch was included, add an extra branch.
+    if 'include_non_enrolled_branch' in config:
+      include_non_enrolled_branch = config['include_non_enrolled_branch']
+      if include_non_enrolled_branch == True or include_non_enrolled_branch.lower() == "true":
+        config['include_non_enrolled_branch'] = True
+        if config['isRollout'] == True:
+          config["branches"].insert(0, {'name': 'default'})
+        else:
+          config["branches"].append({'name': 'default'})
+    else:
+      config['include_non_enrolled_branch'] = False
+
+    # Make control the first element if not already.
+    if "control" in config:
+      control = config["control"]
+      del config["control"]
+      if config["branches"][0]["name"] != control:
+        for i,b in enumerate(config["branches"]):
+          if b["name"] == control:
+            tmpFirst   = config["branches"][0]
+            tmpControl = config["branches"][i]
+            config["branches"][i] = tmpFirst
+            config["branches"][0] = tmpControl
+            break
+  return config
+
+def generate_report(args):
+  startTime = time.time()
+  tracer.reset()
+  renderFragments = True
 
   # Parse config file.
   print("Loading config file: ", args.config)
@@ -90,85 +404,134 @@ def generate_report(args):
 
   # Setup local dirs
   print("Setting up local directories.")
-  setupDirs(slug, args.dataDir, args.reportDir, args.html_report)
-  dataDir=os.path.join(args.dataDir, slug)
+  baseDataDir = backendDataDir(args.dataDir, args.backend)
+  setupDirs(slug, baseDataDir, args.reportDir, args.html_report)
+  dataDir=os.path.join(baseDataDir, slug)
   reportDir=args.reportDir
   skipCache=args.skip_cache
 
   # Check for local results first.
   resultsFile= os.path.join(dataDir, f"{slug}-results.json")
+  cacheDir = os.path.join(dataDir, "html-cache")
+  previousResults = None
   if skipCache:
     results = None
   else:
-    results = checkForLocalResults(resultsFile)
+    with tracer.span("load_results"):
+      results = checkForLocalResults(resultsFile)
+    if results is not None and resultsAreOutdated(results):
+      print(f"Results in {resultsFile} are out of date, fetching new data.")
+      previousResults = results
+      results = None
 
   # If results not found, generate them.
   if results is None:
-    # Annotate metrics
-    parser.annotateMetrics(config)
+    tracer.count("results.cache.miss")
 
-    if config["is_experiment"] == True:
-      # Parse Nimbus API.
-      api = parser.parseNimbusAPI(dataDir, slug, skipCache)
-      config = config | api
-
-      # If the experiment is a rollout, then use the non-enrolled branch
-      # as the control.
-      if config['isRollout'] == True:
-        config['include_non_enrolled_branch'] = True
-
-      # If non-enrolled branch was included, add an extra branch.
-      if 'include_non_enrolled_branch' in config:
-        include_non_enrolled_branch = config['include_non_enrolled_branch']
-        if include_non_enrolled_branch == True or include_non_enrolled_branch.lower() == "true":
-          config['include_non_enrolled_branch'] = True
-          if config['isRollout'] == True:
-            config["branches"].insert(0, {'name': 'default'})
-          else:
-            config["branches"].append({'name': 'default'})
-      else:
-        config['include_non_enrolled_branch'] = False
-
-      # Make control the first element if not already.
-      if "control" in config:
-        control = config["control"]
-        del config["control"]
-        if config["branches"][0]["name"] != control:
-          for i,b in enumerate(config["branches"]):
-            if b["name"] == control:
-              tmpFirst   = config["branches"][0]
-              tmpControl = config["branches"][i]
-              config["branches"][i] = tmpFirst
-              config["branches"][0] = tmpControl
-              break
+    config = prepareConfig(config, dataDir, slug, skipCache)
 
     print("Using Config:")
     configStr = json.dumps(config, indent=2)
     print(configStr)
 
-    # Get statistical results
-    origConfig = config.copy()
-    results = getResultsForExperiment(slug, dataDir, config, skipCache)
-    results = results | config
-    results['input'] = origConfig
+    # Daily results can only be reused from results of the whole population.
+    if previousResults is not None and previousResults.get("sample_percent", 100) < 100:
+      previousResults = None
 
-    # Save results to disk.
-    print("---------------------------------")
-    print(f"Writing results to {resultsFile}")
-    with open(resultsFile, 'w') as f:
-      json.dump(results, f, indent=2, cls=NpEncoder)
+    if args.stream:
+      stageConfig = copy.deepcopy(config)
+      origConfig = stageConfig.copy()
+      results = streamResultsForExperiment(slug, dataDir, stageConfig, skipCache, createBackend(args.backend, args.parquetDir),
+                                           args.shard_days, args.jobs)
+      results = results | stageConfig
+      results['input'] = origConfig
+
+      print("---------------------------------")
+      print(f"Writing results to {resultsFile}")
+      with tracer.span("write_results"):
+        with open(resultsFile, 'w') as f:
+          json.dump(results, f, indent=2, cls=NpEncoder)
+      renderFragments = False
+    else:
+      # A preview first runs the whole pipeline on a small sample of clients,
+      # and then refines the report with larger samples.  Each stage only
+      # fetches the sample_id ranges that previous stages didn't cache.
+      stages = PREVIEW_SAMPLES if args.preview else [100]
+      backend = createBackend(args.backend, args.parquetDir)
+      for i, percent in enumerate(stages):
+        sampleRanges = None
+        if args.preview:
+          bounds = [0] + stages[:i+1]
+          sampleRanges = list(zip(bounds[:-1], bounds[1:]))
+          print("---------------------------------")
+          print(f"Generating preview with {percent}% of clients.")
+
+        # Get statistical results
+        stageConfig = copy.deepcopy(config)
+        origConfig = stageConfig.copy()
+        results = getResultsForExperiment(slug, dataDir, stageConfig, skipCache and i == 0, backend,
+                                          previousResults if percent == 100 else None,
+                                          args.shard_days, args.jobs, sampleRanges)
+        results = results | stageConfig
+        results['input'] = origConfig
+        results['sample_percent'] = percent
+
+        # Save results to disk.
+        print("---------------------------------")
+        print(f"Writing results to {resultsFile}")
+        with tracer.span("write_results"):
+          with open(resultsFile, 'w') as f:
+            json.dump(results, f, indent=2, cls=NpEncoder)
+
+        if args.html_report and percent < 100:
+          reportFile = os.path.join(reportDir, f"{slug}.html")
+          print(f"Writing preview html report to {reportFile}")
+          writeHTMLReport(results, reportFile, jobs=args.render_jobs, cacheDir=cacheDir)
   else:
+    tracer.count("results.cache.hit")
     print("---------------------------------")
     print(f"Found local results in {resultsFile}")
 
   if args.html_report:
     reportFile = os.path.join(reportDir, f"{slug}.html")
-    print(f"Generating html report in {reportFile}")
-
-    gen = ReportGenerator(results)
-    report = gen.createHTMLReport()
-    with open(reportFile, "w") as f:
-      f.write(report)
+    streamDir = results['stream']['dir'] if 'stream' in results else None
+    if not skipCache and reportIsCurrent(reportFile, resultsFile, streamDir):
+      print(f"Found up to date html report in {reportFile}")
+    else:
+      print(f"Generating html report in {reportFile}")
+      writeHTMLReport(results, reportFile, renderFragments, args.render_jobs, cacheDir)
+      writeReportStamp(reportFile, resultsFile, streamDir)
 
+  writeInstrumentation(dataDir, slug, args)
   executionTime = time.time()-startTime
   print(f"Execution time: {executionTime:.1f} seconds")
+
+# Fetch the telemetry of several experiments together before their reports
+# are generated, so that experiments on the same channel share the table
+# scans.  Experiments with up to date results are skipped.
+def prefetch_experiments(argsList):
+  from lib.telemetry import TelemetryClient, prefetchExperiments
+
+  clients = []
+  backend = None
+  for args in argsList:
+    if args.skip_cache or args.preview or args.shard_days or args.backend != argsList[0].backend:
+      continue
+    config = parser.parseConfigFile(args.config)
+    slug = config['slug']
+    baseDataDir = backendDataDir(args.dataDir, args.backend)
+    setupDirs(slug, baseDataDir, args.reportDir, args.html_report)
+    dataDir = os.path.join(baseDataDir, slug)
+
+    results = checkForLocalResults(os.path.join(dataDir, f"{slug}-results.json"))
+    if results is not None and not resultsAreOutdated(results):
+      continue
+
+    config = prepareConfig(config, dataDir, slug, False)
+    if backend is None:
+      backend = createBackend(args.backend, args.parquetDir)
+    clients.append(TelemetryClient(dataDir, config, False, backend, None, args.jobs))
+
+  if len(clients) > 1:
+    setupDjango()
+    prefetchExperiments(clients)
@@ -0,0 +1,151 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Peak resident set size of this process in bytes.
+def get_peak_rss():
+  try:
+    import resource
+  except ImportError:
+    return None
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Linux reports kilobytes, macOS reports bytes.
+  if sys.platform == "darwin":
+    return rss
+  return rss * 1024
+
+# Records timing spans, counters and query job statistics for a report run.
+# Spans can be nested and recorded from multiple threads.
+class Instrumentation:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.local = threading.local()
+    self.reset()
+
+  def reset(self):
+    with self.lock:
+      self.startTime = time.time()
+      self.spans = []
+      self.counters = {}
+      self.jobs = []
+
+  def currentArgs(self):
+    stack = getattr(self.local, "stack", [])
+    args = {}
+    for entry in stack:
+      args.update(entry)
+    return args
+
+  @contextmanager
+  def span(self, name, **args):
+    if not hasattr(self.local, "stack"):
+      self.local.stack = []
+    self.local.stack.append(args)
+    start = time.time()
+    try:
+      yield
+    finally:
+      end = time.time()
+      self.local.stack.pop()
+      with self.lock:
+        self.spans.append({
+          "name": name,
+          "start": start - self.startTime,
+          "duration": end - start,
+          "thread": threading.get_ident(),
+          "process": os.getpid(),
+          "peak_rss": get_peak_rss(),
+          "args": args
+        })
+
+  def count(self, name, n=1):
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + n
+
+  # Job statistics are tagged with the arguments of the enclosing spans,
+  # e.g. the metric being fetched.
+  def recordJob(self, stats):
+    stats = self.currentArgs() | stats
+    with self.lock:
+      self.jobs.append(stats)
+
+  # The spans and counters recorded so far, to be merged into the tracer of
+  # another process.
+  def records(self):
+    with self.lock:
+      return {"startTime": self.startTime, "spans": list(self.spans), "counters": dict(self.counters)}
+
+  # Merge the records of another process.  Its spans are shifted to start
+  # from the start time of this tracer.
+  def merge(self, records):
+    offset = records["startTime"] - self.startTime
+    with self.lock:
+      for span in records["spans"]:
+        self.spans.append(span | {"start": span["start"] + offset})
+      for name, n in records["counters"].items():
+        self.counters[name] = self.counters.get(name, 0) + n
+
+  def summary(self):
+    stages = {}
+    for span in self.spans:
+      if span["name"] not in stages:
+        stages[span["name"]] = {"count": 0, "total": 0.0, "max": 0.0}
+      stage = stages[span["name"]]
+      stage["count"] = stage["count"] + 1
+      stage["total"] = stage["total"] + span["duration"]
+      stage["max"] = max(stage["max"], span["duration"])
+
+    totals = {}
+    for key in ["bytes_processed", "bytes_billed", "slot_millis"]:
+      totals[key] = sum(job.get(key) or 0 for job in self.jobs)
+    totals["cache_hits"] = sum(1 for job in self.jobs if job.get("cache_hit"))
+
+    return {
+      "wall_time": time.time() - self.startTime,
+      "peak_rss": get_peak_rss(),
+      "stages": stages,
+      "counters": self.counters,
+      "jobs": totals
+    }
+
+  def write(self, filename):
+    with self.lock:
+      data = {
+        "summary": self.summary(),
+        "spans": sorted(self.spans, key=lambda s: s["start"]),
+        "jobs": self.jobs
+      }
+    with open(filename, 'w') as f:
+      json.dump(data, f, indent=2, default=str)
+
+  # Write the spans in the Chrome trace event format, which can be
+  # opened in chrome://tracing or https://ui.perfetto.dev.
+  def writeChromeTrace(self, filename):
+    events = []
+    pid = os.getpid()
+    with self.lock:
+      for span in self.spans:
+        events.append({
+          "name": span["name"],
+          "ph": "X",
+          "ts": span["start"] * 1e6,
+          "dur": span["duration"] * 1e6,
+          "pid": span.get("process", pid),
+          "tid": span["thread"],
+          "args": span["args"]
+        })
+      for name in self.counters:
+        events.append({
+          "name": name,
+          "ph": "C",
+          "ts": (time.time() - self.startTime) * 1e6,
+          "pid": pid,
+          "args": {"value": self.counters[name]}
+        })
+    with open(filename, 'w') as f:
+      json.dump({"traceEvents": events}, f, default=str)
+
+tracer = Instrumentation()
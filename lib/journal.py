@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# BigQuery keeps the results of a query job in an anonymous table for about
+# a day, so older jobs can't be reattached to.
+JOB_RESULTS_TTL = 23*60*60
+
+# Queries are identified by their text and parameters.
+def query_hash(query, parameters=None):
+  text = json.dumps([query, parameters or {}], sort_keys=True, default=str)
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Records the query jobs of a report run, keyed by query hash, with the
+# metric, job reference and state of each job.  The journal is saved to
+# disk on every change so that a run that crashed or was interrupted can
+# reattach to the jobs it submitted.
+class JobJournal:
+  def __init__(self, filename):
+    self.filename = filename
+    self.lock = threading.Lock()
+    self.jobs = {}
+    if os.path.isfile(filename):
+      try:
+        with open(filename, 'r') as f:
+          self.jobs = json.load(f)
+      except ValueError:
+        print(f"WARNING: ignoring invalid job journal {filename}.")
+
+    now = time.time()
+    self.jobs = {key: job for key, job in self.jobs.items()
+                 if now - job.get("created", 0) < JOB_RESULTS_TTL}
+
+  def get(self, key):
+    with self.lock:
+      return self.jobs.get(key)
+
+  def record(self, key, **values):
+    with self.lock:
+      self.jobs.setdefault(key, {}).update(values)
+      self.save()
+
+  def remove(self, key):
+    with self.lock:
+      if self.jobs.pop(key, None) is not None:
+        self.save()
+
+  def clear(self):
+    with self.lock:
+      self.jobs = {}
+      if os.path.isfile(self.filename):
+        os.remove(self.filename)
+
+  # Write to a temporary file first, so a crash never leaves a partial journal.
+  def save(self):
+    tmpFile = f"{self.filename}.tmp"
+    with open(tmpFile, 'w') as f:
+      json.dump(self.jobs, f, indent=2)
+    os.replace(tmpFile, self.filename)
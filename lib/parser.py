@@ -1,6 +1,4 @@
-import requests
 import json
-import yaml
 import sys
 import os
 import datetime
@@ -35,6 +33,9 @@ def annotatePageloadEventMetrics(config, probeIndex):
       config['pageload_event_metrics'][metric]["desc"] = event_schema[metric]["description"]
       config['pageload_event_metrics'][metric]["min"] = event_metrics[metric][0]
       config['pageload_event_metrics'][metric]["max"] = event_metrics[metric][1]
+      # Optional number of exponential buckets per power of two.
+      if len(event_metrics[metric]) > 2:
+        config['pageload_event_metrics'][metric]["log_buckets"] = int(event_metrics[metric][2])
     else:
       print(f"ERROR: {metric} not found in pageload event schema.") 
       sys.exit(1)
@@ -104,24 +105,37 @@ def annotateHistograms(config, probeIndex):
       print(f"ERROR: {hist_name} not found in histograms schema.") 
       sys.exit(1)
 
+# The API of an experiment that was still running when it was cached has no
+# end date, so it is fetched again until the experiment has ended.  Without
+# network access, the cached API is used.
 def retrieveNimbusAPI(dataDir, slug, skipCache):
   filename = f"{dataDir}/{slug}-nimbus-API.json"
   if skipCache:
-    values = None
+    cached = None
   else:
-    values = checkForLocalFile(filename)
-  if values is not None:
+    cached = checkForLocalFile(filename)
+  if cached is not None and cached.get("endDate") is not None:
     print(f"Using local config found in {filename}")
-    return values
+    return cached
 
+  import requests
   url=f'https://experimenter.services.mozilla.com/api/v6/experiments/{slug}/'
   print(f"Loading nimbus API from {url}")
-  response = requests.get(url)
+  try:
+    response = requests.get(url)
+  except requests.RequestException as e:
+    if cached is not None:
+      print(f"WARNING: failed to retrieve {url}, using local config found in {filename}: {e}")
+      return cached
+    raise
   if response.ok:
     values = response.json()
     with open(filename, 'w') as f:
         json.dump(values, f, indent=2)
     return values
+  elif cached is not None:
+    print(f"WARNING: failed to retrieve {url}: {response.status_code}, using local config found in {filename}")
+    return cached
   else:
     print(f"Failed to retrieve {url}: {response.status_code}")
     sys.exit(1)
@@ -135,8 +149,11 @@ def extractValuesFromAPI(api):
   values["channel"] = api["channel"]
   values["isRollout"] = api["isRollout"]
 
+  # Ongoing experiments have no end date yet, so use the data up to today.
+  # Telemetry partitions are by UTC date.
+  values["isOngoing"] = values["endDate"] is None
   if values["endDate"] is None:
-    now = datetime.datetime.now();
+    now = datetime.datetime.now(datetime.timezone.utc)
     values["endDate"] = now.strftime('%Y-%m-%d')
 
   values["branches"] = []
@@ -158,4 +175,13 @@ def parseConfigFile(configFile):
   else:
     config["is_experiment"] = True
 
+  # The ISP blacklist excludes test infrastructure from the enrolled clients
+  # of experiments, and doesn't change the population of other reports.
+  if not config["is_experiment"] and "isp_blacklist" in config:
+    print("WARNING: isp_blacklist only applies to experiments, and is ignored.")
+
+  # Only experiments are fetched by day.
+  if not config["is_experiment"] and config.get("daily_trends", False):
+    print("WARNING: daily_trends only applies to experiments, and is ignored.")
+
   return config
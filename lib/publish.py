@@ -0,0 +1,171 @@
+import gzip
+import hashlib
+import json
+import os
+
+# Reports are published to a static host.  Every artifact gets precompressed
+# .gz and .br siblings, and the manifest in the report directory records the
+# hash and size of each artifact.  Artifacts are only rewritten when their
+# content changed, so unchanged reports keep their modification time and are
+# neither uploaded nor downloaded again.
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), 'templates', 'static')
+MANIFEST = "manifest.json"
+
+CHUNK_SIZE = 1 << 20
+
+def contentHash(data):
+  return hashlib.sha256(data).hexdigest()
+
+def fileChunks(filename):
+  with open(filename, 'rb') as f:
+    while chunk := f.read(CHUNK_SIZE):
+      yield chunk
+
+def fileHash(filename):
+  digest = hashlib.sha256()
+  for chunk in fileChunks(filename):
+    digest.update(chunk)
+  return digest.hexdigest()
+
+# Compressors write the compressed chunks to f, and return False when they
+# are not available.  Brotli is optional, without it only the .gz siblings
+# are written.
+def brotliCompress(chunks, f):
+  try:
+    import brotli
+  except ImportError:
+    return False
+  compressor = brotli.Compressor(quality=11)
+  for chunk in chunks:
+    f.write(compressor.process(chunk))
+  f.write(compressor.finish())
+  return True
+
+# The gzip header stores a timestamp, which is zeroed so that the same
+# content always compresses to the same bytes.
+def gzipCompress(chunks, f):
+  with gzip.GzipFile(filename="", mode='wb', fileobj=f, compresslevel=9, mtime=0) as gz:
+    for chunk in chunks:
+      gz.write(chunk)
+  return True
+
+COMPRESSORS = [("gz", gzipCompress), ("br", brotliCompress)]
+
+def loadManifest(rootDir):
+  filename = os.path.join(rootDir, MANIFEST)
+  if not os.path.isfile(filename):
+    return {}
+  try:
+    with open(filename, 'r') as f:
+      return json.load(f)
+  except ValueError:
+    print(f"WARNING: ignoring invalid manifest {filename}.")
+    return {}
+
+# Write to a temporary file first, so a crash never leaves a partial file.
+def writeFile(filename, data):
+  tmpFile = f"{filename}.tmp"
+  with open(tmpFile, 'wb') as f:
+    f.write(data)
+  os.replace(tmpFile, filename)
+
+def saveManifest(rootDir, manifest):
+  data = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+  writeFile(os.path.join(rootDir, MANIFEST), data)
+
+def readFile(filename):
+  if not os.path.isfile(filename):
+    return None
+  with open(filename, 'rb') as f:
+    return f.read()
+
+def sameContent(filename, size, digest):
+  return (os.path.isfile(filename) and os.path.getsize(filename) == size
+          and fileHash(filename) == digest)
+
+# Publish the file sourceFile as filename under rootDir (the directory of the
+# file by default), writing its compressed siblings unless they are up to
+# date.  The source file is moved into place, or removed when filename
+# already has the same content.  Without a source file, filename itself is
+# published.  Files are read and compressed in chunks, so large reports are
+# never held in memory.  Returns whether anything was written.
+def publishFile(filename, sourceFile=None, rootDir=None):
+  if rootDir is None:
+    rootDir = os.path.dirname(filename)
+  key = os.path.relpath(filename, rootDir).replace(os.sep, "/")
+  manifest = loadManifest(rootDir)
+  entry = manifest.get(key, {})
+
+  if sourceFile is None:
+    size = os.path.getsize(filename)
+    digest = fileHash(filename)
+    changed = entry.get("sha256") != digest
+  else:
+    size = os.path.getsize(sourceFile)
+    digest = fileHash(sourceFile)
+    changed = not sameContent(filename, size, digest)
+    if changed:
+      os.replace(sourceFile, filename)
+    else:
+      os.remove(sourceFile)
+
+  encodings = {}
+  for ext, compress in COMPRESSORS:
+    sibling = f"{filename}.{ext}"
+    upToDate = (not changed and entry.get("sha256") == digest
+                and ext in entry.get("encodings", {}) and os.path.isfile(sibling))
+    if upToDate:
+      encodings[ext] = entry["encodings"][ext]
+      continue
+    tmpFile = f"{sibling}.tmp"
+    with open(tmpFile, 'wb') as f:
+      available = compress(fileChunks(filename), f)
+    if not available:
+      os.remove(tmpFile)
+      # Never leave a sibling with stale content behind.
+      if os.path.isfile(sibling):
+        os.remove(sibling)
+        changed = True
+      continue
+    os.replace(tmpFile, sibling)
+    encodings[ext] = os.path.getsize(sibling)
+    changed = True
+
+  newEntry = {"sha256": digest, "size": size, "encodings": encodings}
+  if newEntry != entry:
+    manifest[key] = newEntry
+    saveManifest(rootDir, manifest)
+  return changed
+
+# Publish an artifact from its content.
+def publish(filename, content, rootDir=None):
+  data = content.encode("utf-8") if isinstance(content, str) else content
+  tmpFile = f"{filename}.publish"
+  with open(tmpFile, 'wb') as f:
+    f.write(data)
+  return publishFile(filename, tmpFile, rootDir)
+
+# Shared javascript and css are served from files named after a hash of
+# their content, so they can be cached forever: a change gives them a new
+# name, and the reports linking to the old name keep working.
+def assetName(name, data):
+  base, ext = os.path.splitext(name)
+  return f"{base}.{contentHash(data)[:16]}{ext}"
+
+def staticAssets():
+  assets = {}
+  for name in sorted(os.listdir(STATIC_DIR)):
+    data = readFile(os.path.join(STATIC_DIR, name))
+    assets[name] = (f"static/{assetName(name, data)}", data)
+  return assets
+
+# Urls of the static assets, relative to the report directory.
+def assetUrls():
+  return {name: url for name, (url, data) in staticAssets().items()}
+
+def publishAssets(reportDir):
+  staticDir = os.path.join(reportDir, "static")
+  os.makedirs(staticDir, exist_ok=True)
+  for name, (url, data) in staticAssets().items():
+    publish(os.path.join(reportDir, url), data, reportDir)
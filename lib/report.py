@@ -1,12 +1,19 @@
+import hashlib
 import json
 import os
+import re
+import shutil
 import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from scipy import interpolate
 from django.template import Template, Context
 from django.template.loader import get_template
 from airium import Airium
 from bs4 import BeautifulSoup as bs
+from lib.instrumentation import tracer
+from lib.publish import assetUrls
 
 # These values are mostly hand-wavy that seem to 
 # fit the telemetry result impacts.
@@ -42,8 +49,7 @@ def cubic_spline_prep(x, y):
 def cubic_spline_smooth(x, y, x_new):
   [x_prep, y_prep] = cubic_spline_prep(x, y)
   tck = interpolate.splrep(x_prep, y_prep, k=3)
-  y_new = interpolate.splev(x_new, tck, der=0)
-  return list(y_new)
+  return interpolate.splev(x_new, tck, der=0)
 
 def find_value_at_quantile(values, cdf, q=0.95):
   for i, e in reversed(list(enumerate(cdf))):
@@ -53,6 +59,17 @@ def find_value_at_quantile(values, cdf, q=0.95):
       else:
         return values[i+1]
 
+# Segment names are used in element ids and javascript variable names, so
+# names that aren't valid identifiers, e.g. "8+ cores", are sanitized.  A
+# hash of the name keeps different names from getting the same identifier.
+def segment_id(segment):
+  ident = re.sub(r"\W", "_", segment)
+  if ident != segment:
+    ident = f"{ident}_{zlib.crc32(segment.encode('utf-8')):08x}"
+  if not ident or ident[0].isdigit():
+    ident = f"segment_{ident}"
+  return ident
+
 def getIconForSegment(segment):
   iconMap = {
       "All": "fa-solid fa-globe",
@@ -66,21 +83,93 @@ def getIconForSegment(segment):
   else:
     return "fa-solid fa-chart-simple"
 
+def format_interval(interval):
+  return "[{0:.1f}, {1:.1f}]".format(interval["min"], interval["max"])
+
+# Numeric arrays are formatted as javascript once, instead of element by
+# element by the template engine.  Missing values become null.
+def format_series(values, digits=None):
+  values = np.asarray(values, dtype=float).tolist()
+  if digits is not None:
+    values = [round(x, digits) for x in values]
+  return json.dumps(values).replace("NaN", "null")
+
 def flip_row_background(color):
   if color == "white":
     return "#ececec"
   else:
     return "white"
 
+# The cell of a metric only uses the results of that metric and segment.
+def metric_slice(data, segment, metric_type, metric):
+  result = {"branches": data["branches"]}
+  for branch in data["branches"]:
+    result[branch] = {segment: {metric_type: {metric: data[branch][segment][metric_type][metric]}}}
+  return result
+
+# Render the html cell of a metric from a slice of the results.  This
+# doesn't depend on any other state, so cells can be rendered in worker
+# processes.
+def render_metric_cell(data, segment, metric, metric_type, kind):
+  gen = ReportGenerator(data)
+  return gen.createMetricCell(segment, metric, metric_type, kind)
+
+# Cells rendered in a worker process record their spans in the tracer of
+# the worker, so they are returned with the cell and merged by the parent.
+def render_metric_cell_traced(data, segment, metric, metric_type, kind):
+  tracer.reset()
+  cell = render_metric_cell(data, segment, metric, metric_type, kind)
+  return cell, tracer.records()
+
+# Templates used to render the cell of a metric.
+def cell_templates(data, segment, metric, metric_type, kind):
+  if kind == "categorical":
+    return ["cell.html", "categorical.html"]
+  templates = ["cell.html", "mean.html", "cdf.html", "uplift.html"]
+  control = data["branches"][0]
+  if "daily" in data[control][segment][metric_type][metric]:
+    templates.append("trend.html")
+  return templates
+
+# Rendered cells are cached by a hash of their slice of the results, and of
+# the templates and code used to render them, so a report is only
+# re-rendered where its data or templates changed.
+def cell_hash(data, segment, metric, metric_type, kind, sources):
+  text = json.dumps([data, segment, metric, metric_type, kind, sources], sort_keys=True,
+                    default=lambda x: x.tolist() if hasattr(x, "tolist") else str(x))
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Remove the cached cells that the last render didn't use, e.g. the cells
+# of older results or templates, so the cache doesn't keep growing.
+def prune_cell_cache(cacheDir, keys):
+  if cacheDir is None or not os.path.isdir(cacheDir):
+    return
+  removed = 0
+  for filename in os.listdir(cacheDir):
+    key, ext = os.path.splitext(filename)
+    if ext == ".html" and key not in keys:
+      os.remove(os.path.join(cacheDir, filename))
+      removed = removed + 1
+  tracer.count("html.cache.pruned", removed)
+
 class ReportGenerator:
-  def __init__(self, data):
+  def __init__(self, data, cacheDir=None):
     self.data = data
     self.doc = Airium()
+    self.cacheDir = cacheDir
+    self.sources = {}
+    self.usedKeys = set()
 
   def createHeader(self):
     t = get_template("header.html")
+    title = f"{self.data['slug']} experimental results"
+    if self.data.get('sample_percent', 100) < 100:
+      title = f"{title} (preview, {self.data['sample_percent']}% sample)"
+    assets = assetUrls()
     context = {
-          "title": f"{self.data['slug']} experimental results"
+          "title": title,
+          "css": assets["report.css"],
+          "js": assets["report.js"]
     }
     self.doc(t.render(context))
 
@@ -94,6 +183,7 @@ class ReportGenerator:
     segments = []
     for segment in self.data['segments']:
       entry = { "name": segment,
+                "id": segment_id(segment),
                 "icon": getIconForSegment(segment),
                 "pageload_metrics" : [],
                 "histograms" : []
@@ -142,17 +232,23 @@ class ReportGenerator:
               if "uplift" in self.data[branch][segment][metric_type][metric]:
                 rows = []
                 n_labels = len(self.data[branch][segment][metric_type][metric]["labels"])
+                significant = self.data[branch][segment][metric_type][metric].get("significant")
                 for i in range(n_labels):
                   label = self.data[branch][segment][metric_type][metric]["labels"][i]
                   uplift = self.data[branch][segment][metric_type][metric]["uplift"][i]
 
-                  # Enumerated histograms have a lot of labels, so try and limit the ones
-                  # we show.
-                  if n_labels > 5 and abs(uplift)<0.05:
-                    continue
+                  # Enumerated histograms have a lot of labels, so only show the
+                  # ones with a significant change.
+                  if n_labels > 5:
+                    if significant is not None and i not in significant:
+                      continue
+                    if significant is None and abs(uplift)<0.05:
+                      continue
 
                   weight="font-weight:normal;"
-                  if abs(uplift) >= 10:
+                  if significant is not None and i not in significant:
+                    effect = "None"
+                  elif abs(uplift) >= 10:
                     effect = "Large"
                     weight = "font-weight:bold;"
                   elif abs(uplift) >= 5:
@@ -176,6 +272,13 @@ class ReportGenerator:
                     "weight": weight,
                     "style": f"background:{row_background};",
                   })
+                if len(rows) == 0:
+                  rows.append({
+                    "uplift": "No significant changes",
+                    "effect": "None",
+                    "weight": "font-weight:normal;",
+                    "style": f"background:{row_background};",
+                  })
                 rows[-1]["style"] = rows[-1]["style"] + "border-bottom-style: solid;"
 
                 branches.append({
@@ -259,6 +362,7 @@ class ReportGenerator:
 
       segments.append({
         "name": segment, 
+        "id": segment_id(segment),
         "numerical_metrics": numerical_metrics,
         "categorical_metrics": categorical_metrics
       }) 
@@ -299,7 +403,8 @@ class ReportGenerator:
       "channel": channel,
       "branches": branches,
       "segments": segments,
-      "branchlen": len(branches)
+      "branchlen": len(branches),
+      "sample_percent": self.data.get('sample_percent', 100)
     }
     self.doc(t.render(context))
 
@@ -312,14 +417,12 @@ class ReportGenerator:
     self.doc(t.render(context))
 
   def createCDFComparison(self, segment, metric, metric_type):
-    t = get_template("cdf.html")
-
     control = self.data["branches"][0]
     values_control = self.data[control][segment][metric_type][metric]["pdf"]["values"]
     cdf_control = self.data[control][segment][metric_type][metric]["pdf"]["cdf"]
 
     maxValue = find_value_at_quantile(values_control, cdf_control)
-    values_int = list(np.around(np.linspace(0, maxValue, 100), 2))
+    values_int = np.around(np.linspace(0, maxValue, 100), 2)
 
     datasets = []
     for branch in self.data["branches"]:
@@ -328,25 +431,22 @@ class ReportGenerator:
       cdf = self.data[branch][segment][metric_type][metric]["pdf"]["cdf"]
 
       # Smooth out pdf and cdf, and use common X values for each branch.
-      density_int = cubic_spline_smooth(values, density, values_int)
-      cdf_int = cubic_spline_smooth(values, cdf, values_int)
+      with tracer.span("spline_smoothing", metric=metric, branch=branch, segment=segment):
+        density_int = cubic_spline_smooth(values, density, values_int)
+        cdf_int = cubic_spline_smooth(values, cdf, values_int)
 
       dataset = {
           "branch": branch,
-          "cdf": cdf_int,
-          "density": density_int,
+          "cdf": format_series(cdf_int),
+          "density": format_series(density_int),
       }
 
       datasets.append(dataset)
 
-    context = {
-        "segment": segment,
-        "metric": metric,
-        "values": values_int,
+    return {
+        "values": format_series(values_int),
         "datasets": datasets
     }
-    self.doc(t.render(context))
-    return
 
   def calculate_uplift_interp(self, quantiles, branch, segment, metric_type, metric):
     control = self.data["branches"][0]
@@ -363,21 +463,13 @@ class ReportGenerator:
     tck = interpolate.splrep(quantiles_branch_n, values_branch_n, k=1)
     values_branch_n = interpolate.splev(quantiles, tck, der=0)
 
-    uplifts = []
-    diffs = []
-    for i in range(len(quantiles)):
-      diff = values_branch_n[i] - values_control_n[i]
-      uplift = diff/values_control_n[i]*100
-      diffs.append(diff)
-      uplifts.append(uplift)
-
+    diffs = values_branch_n - values_control_n
+    uplifts = diffs/values_control_n*100
     return [diffs, uplifts]
 
   def createUpliftComparison(self, segment, metric, metric_type):
-    t = get_template("uplift.html")
-
     control = self.data["branches"][0]
-    quantiles = list(np.around(np.linspace(0.1, 0.99, 99), 2))
+    quantiles = np.around(np.linspace(0.1, 0.99, 99), 2)
 
     datasets = []
     for branch in self.data["branches"]:
@@ -387,8 +479,8 @@ class ReportGenerator:
       [diff, uplift] = self.calculate_uplift_interp(quantiles, branch, segment, metric_type, metric)
       dataset = {
           "branch": branch,
-          "diff": diff,
-          "uplift": uplift,
+          "diff": format_series(diff),
+          "uplift": format_series(uplift),
       }
       datasets.append(dataset)
 
@@ -402,21 +494,50 @@ class ReportGenerator:
       if abs(x) > maxPerc:
         maxPerc = abs(x)
 
-    context = {
-        "segment": segment,
-        "metric": metric,
-        "quantiles": quantiles,
+    return {
+        "quantiles": format_series(quantiles),
         "datasets": datasets,
-        "upliftMax": maxPerc,
-        "upliftMin": -maxPerc,
-        "diffMax": maxVal,
-        "diffMin": -maxVal
+        "upliftMax": float(maxPerc),
+        "upliftMin": -float(maxPerc),
+        "diffMax": float(maxVal),
+        "diffMin": -float(maxVal)
     }
-    self.doc(t.render(context))
   
-  def createMeanComparison(self, segment, metric, metric_type):
-    t = get_template("mean.html")
+  # Missing values are rendered as null so the charts leave a gap.
+  def createTrendComparison(self, segment, metric, metric_type):
+    control = self.data["branches"][0]
+    days = [entry["day"] for entry in self.data[control][segment][metric_type][metric]["daily"]]
+
+    def series(values):
+      return format_series([np.nan if x is None else x for x in values], 2)
 
+    datasets = []
+    uplifts = []
+    for branch in self.data["branches"]:
+      entries = self.data[branch][segment][metric_type][metric]["daily"]
+      for stat in ["mean", "median", "p95"]:
+        datasets.append({
+          "branch": branch,
+          "stat": stat,
+          "daily": series([entry[stat] for entry in entries]),
+          "cumulative": series([entry["cumulative"][stat] for entry in entries]),
+          "hidden": "false" if stat == "mean" else "true"
+        })
+
+      if branch != control:
+        uplifts.append({
+          "branch": branch,
+          "daily": series([entry["uplift"] for entry in entries]),
+          "cumulative": series([entry["cumulative"]["uplift"] for entry in entries])
+        })
+
+    return {
+        "days": json.dumps(days),
+        "datasets": datasets,
+        "uplifts": uplifts
+    }
+
+  def createMeanComparison(self, segment, metric, metric_type):
     datasets = []
     control=self.data["branches"][0]
       
@@ -436,6 +557,26 @@ class ReportGenerator:
       se   = "{0:.1f}".format(self.data[branch][segment][metric_type][metric]["se"])
       std  = "{0:.1f}".format(self.data[branch][segment][metric_type][metric]["std"])
 
+      # Bootstrap confidence intervals, missing from older results.
+      confidence = ""
+      uplift_confidence = ""
+      quantiles = []
+      bootstrap = self.data[branch][segment][metric_type][metric].get("bootstrap")
+      if bootstrap is not None:
+        confidence = format_interval(self.data[branch][segment][metric_type][metric]["confidence"])
+        for label, interval in bootstrap["stats"].items():
+          if label == "mean":
+            if "uplift" in interval:
+              uplift_confidence = format_interval(interval["uplift"])
+            continue
+          quantiles.append({
+            "label": label,
+            "value": "{0:.1f}".format(interval["value"]),
+            "confidence": format_interval(interval),
+            "uplift": "{0:.1f}".format(interval["uplift"]["value"]) if "uplift" in interval else "",
+            "uplift_confidence": format_interval(interval["uplift"]) if "uplift" in interval else ""
+          })
+
       dataset = {
           "branch": branch,
           "mean": mean,
@@ -443,6 +584,9 @@ class ReportGenerator:
           "n": n,
           "se": se,
           "std": std,
+          "confidence": confidence,
+          "uplift_confidence": uplift_confidence,
+          "quantiles": quantiles,
           "control": branch==control
       }
       
@@ -457,103 +601,206 @@ class ReportGenerator:
 
       datasets.append(dataset)
 
-    context = {
-        "segment": segment,
-        "metric": metric,
-        "branches": self.data["branches"],
-        "datasets": datasets
+    bootstrap = self.data[control][segment][metric_type][metric].get("bootstrap")
+    return {
+        "branches": json.dumps(self.data["branches"]),
+        "datasets": datasets,
+        "bootstrap": bootstrap is not None,
+        "level": "{0:g}".format(bootstrap["level"]*100) if bootstrap else ""
     }
-    self.doc(t.render(context))
 
   def createCategoricalComparison(self, segment, metric, metric_type):
-    t = get_template("categorical.html")
-
-    # If the histogram has too many buckets, then only display a 
-    # set of interesting comparisons instead of all of them.
-    indices = set()
-
+    # If the histogram has too many labels, then only display the labels
+    # with a significant change in any branch, or the largest changes when
+    # none are significant.
     control = self.data["branches"][0]
     n_elem = len(self.data[control][segment][metric_type][metric]["ratios"])
     if n_elem <= 10:
-      indices = set(range(0, n_elem-1))
-
-    for branch in self.data["branches"]:
-      if branch == control:
-        continue
-      uplift = self.data[branch][segment][metric_type][metric]["uplift"]
-      ratios = self.data[branch][segment][metric_type][metric]["ratios"]
-      ratios_control = self.data[control][segment][metric_type][metric]["ratios"]
-
-      for i in range(len(uplift)):
-        if abs(uplift[i]) > 0.01 and (ratios[i] >= 0.05 or ratios_control[i] >= 0.1):
-          indices.add(i)
+      indices = list(range(n_elem))
+    else:
+      significant = set()
+      largest = np.zeros(n_elem)
+      for branch in self.data["branches"]:
+        if branch == control:
+          continue
+        result = self.data[branch][segment][metric_type][metric]
+        significant.update(result.get("significant", []))
+        largest = np.maximum(largest, np.abs(result["uplift"]))
+      if significant:
+        indices = sorted(significant)
+      else:
+        indices = sorted(np.argsort(-largest)[:10].tolist())
 
     datasets=[]
+    tests=[]
     for branch in self.data["branches"]:
-      ratios_branch = [self.data[branch][segment][metric_type][metric]["ratios"][i] for i in indices]
+      result = self.data[branch][segment][metric_type][metric]
       datasets.append({
         "branch": branch,
-        "ratios": ratios_branch,
+        "ratios": format_series([result["ratios"][i] for i in indices]),
       })
 
       if branch != control:
-        ratios_control = [self.data[control][segment][metric_type][metric]["ratios"][i] for i in indices]
-        uplift = [self.data[branch][segment][metric_type][metric]["uplift"][i] for i in indices]
-        datasets[-1]["uplift"] = uplift
+        datasets[-1]["uplift"] = format_series([result["uplift"][i] for i in indices])
+        if "chi2" in result.get("tests", {}):
+          tests.append({
+            "branch": branch,
+            "score": "{0:.1f}".format(result["tests"]["chi2"]["score"]),
+            "pval": "{0:.2g}".format(result["tests"]["chi2"]["p-value"]),
+            "significant": len(result.get("significant", []))
+          })
 
     labels=[self.data[control][segment][metric_type][metric]["labels"][i] for i in indices]
-    context = {
-      "labels": labels,
+    return {
+      "labels": json.dumps(labels),
       "datasets": datasets,
-      "metric": metric,
-      "segment": segment
-        
+      "tests": tests,
+      "n_labels": n_elem
     }
-    self.doc(t.render(context))
 
-  def createMetrics(self, segment, metric, metric_type, kind):
-    # Perform a separate comparison when data is categorical.
-    if kind=="categorical":
-      self.createCategoricalComparison(segment, metric, metric_type)
+  # The charts and tables of a metric are rendered in a single template pass.
+  def createMetricCell(self, segment, metric, metric_type, kind):
+    with tracer.span("render_metric", metric=metric, segment=segment):
+      context = {
+          "segment": segment,
+          "segment_id": segment_id(segment),
+          "metric": metric
+      }
+      # Perform a separate comparison when data is categorical.
+      if kind=="categorical":
+        context["categorical"] = self.createCategoricalComparison(segment, metric, metric_type)
+      else:
+        # Add mean comparison
+        context["mean"] = self.createMeanComparison(segment, metric, metric_type)
+        # Add PDF and CDF comparison
+        context["cdf"] = self.createCDFComparison(segment, metric, metric_type)
+        # Add uplift comparison
+        context["uplift"] = self.createUpliftComparison(segment, metric, metric_type)
+        # Add daily trends when the data was fetched by day
+        control = self.data["branches"][0]
+        if "daily" in self.data[control][segment][metric_type][metric]:
+          context["trend"] = self.createTrendComparison(segment, metric, metric_type)
+
+      t = get_template("cell.html")
+      return t.render(context)
+
+  # Cells in the order they appear in the report: the histograms and then
+  # the pageload event metrics of each segment.
+  def metricCells(self):
+    cells = []
+    for segment in self.data['segments']:
+      for hist in self.data['histograms']:
+        kind = self.data["histograms"][hist]["kind"]
+        cells.append((segment, hist.split('.')[-1], "histograms", kind))
+      for metric in self.data['pageload_event_metrics']:
+        cells.append((segment, metric, "pageload_event_metrics", "numerical"))
+    return cells
+
+  def templateSource(self, name):
+    if name not in self.sources:
+      if name == "report.py":
+        with open(__file__, 'r') as f:
+          self.sources[name] = f.read()
+      else:
+        self.sources[name] = get_template(name).template.source
+    return self.sources[name]
+
+  def cellFile(self, key):
+    return os.path.join(self.cacheDir, f"{key}.html")
+
+  def loadCachedCell(self, key):
+    if self.cacheDir is None or not os.path.isfile(self.cellFile(key)):
+      return None
+    with open(self.cellFile(key), 'r') as f:
+      return f.read()
+
+  # Write to a temporary file first, so a crash never leaves a partial cell.
+  def saveCachedCell(self, key, cell):
+    if self.cacheDir is None:
       return
+    os.makedirs(self.cacheDir, exist_ok=True)
+    tmpFile = f"{self.cellFile(key)}.tmp"
+    with open(tmpFile, 'w') as f:
+      f.write(cell)
+    os.replace(tmpFile, self.cellFile(key))
+
+  # Cells that aren't cached are rendered across a pool of processes.  map()
+  # returns them in the order they were submitted, so the report doesn't
+  # depend on the number of jobs.
+  def renderMetricCells(self, jobs=None, cells=None):
+    if cells is None:
+      cells = self.metricCells()
+    tasks = [(metric_slice(self.data, segment, metric_type, metric), segment, metric, metric_type, kind)
+             for segment, metric, metric_type, kind in cells]
+
+    keys = [None] * len(tasks)
+    rendered = [None] * len(tasks)
+    if self.cacheDir is not None:
+      with tracer.span("cell_cache"):
+        for i, task in enumerate(tasks):
+          templates = ["report.py"] + cell_templates(*task)
+          keys[i] = cell_hash(*task, {name: self.templateSource(name) for name in templates})
+          rendered[i] = self.loadCachedCell(keys[i])
+        self.usedKeys.update(keys)
+    missing = [i for i in range(len(tasks)) if rendered[i] is None]
+    tracer.count("html.cache.hit", len(tasks) - len(missing))
+    tracer.count("html.cache.miss", len(missing))
+
+    jobs = min(jobs or os.cpu_count() or 1, len(missing))
+    if jobs <= 1:
+      cells = [render_metric_cell(*tasks[i]) for i in missing]
+    else:
+      from lib.generate import setupDjango
+      with ProcessPoolExecutor(max_workers=jobs, initializer=setupDjango) as executor:
+        cells = []
+        for cell, records in executor.map(render_metric_cell_traced, *zip(*[tasks[i] for i in missing])):
+          tracer.merge(records)
+          cells.append(cell)
+
+    for i, cell in zip(missing, cells):
+      rendered[i] = cell
+      self.saveCachedCell(keys[i], cell)
+    return rendered
+
+  # Render the cell of a single metric and segment, for streamed reports.
+  def createMetricFragment(self, segment, metric, metric_type, kind):
+    [cell] = self.renderMetricCells(1, [(segment, metric, metric_type, kind)])
+    with tracer.span("prettify"):
+      return bs(cell, 'html.parser').prettify()
+
+  # Streamed results only hold the small records used by the summary, and
+  # the cells of each metric were rendered to fragment files when the metric
+  # was processed.  The report is written to f as it is assembled, so only
+  # one fragment is in memory at a time.
+  def writeStreamedHTMLReport(self, f, fragmentFile):
+    self.createHeader()
+    self.createSidebar()
+    with tracer.span("render_summary"):
+      self.createSummarySection()
+    f.write(str(self.doc))
 
-    # Add mean comparison
-    self.createMeanComparison(segment, metric, metric_type)
-    # Add PDF and CDF comparison
-    self.createCDFComparison(segment, metric, metric_type)
-    # Add uplift comparison
-    self.createUpliftComparison(segment, metric, metric_type)
-
-  def createPageloadEventMetrics(self, segment):
-    for metric in self.data['pageload_event_metrics']:
-      with self.doc.div(id=f"{segment}-{metric}", klass="cell"):
-        # Add title for metric
-        with self.doc.div(klass="title"):
-          self.doc(f"({segment}) - {metric}")
-        self.createMetrics(segment, metric, "pageload_event_metrics", "numerical")
-
-  def createHistogramMetrics(self, segment):
-    for hist in self.data['histograms']:
-      kind = self.data["histograms"][hist]["kind"]
-      metric = hist.split('.')[-1]
-      with self.doc.div(id=f"{segment}-{metric}", klass="cell"):
-        # Add title for metric
-        with self.doc.div(klass="title"):
-          self.doc(f"({segment}) - {metric}")
-        self.createMetrics(segment, metric, "histograms", kind)
-    return
+    for segment, metric, metric_type, kind in self.metricCells():
+      with open(fragmentFile(segment, metric_type, metric), 'r') as fragment:
+        shutil.copyfileobj(fragment, f)
+
+    self.doc = Airium()
+    self.createConfigSection()
+    self.endDocument()
+    f.write(str(self.doc))
 
-  def createHTMLReport(self):
+  def createHTMLReport(self, jobs=None):
     self.createHeader()
     self.createSidebar()
 
     # Create a summary of results
-    self.createSummarySection()
+    with tracer.span("render_summary"):
+      self.createSummarySection()
 
     # Generate charts and tables for each segment and metric
-    for segment in self.data['segments']:
-      self.createHistogramMetrics(segment)
-      self.createPageloadEventMetrics(segment)
+    with tracer.span("render_cells"):
+      for cell in self.renderMetricCells(jobs):
+        self.doc(cell)
+    prune_cell_cache(self.cacheDir, self.usedKeys)
 
     # Dump the config and queries used for the report
     self.createConfigSection()
@@ -561,5 +808,6 @@ class ReportGenerator:
     self.endDocument()
     
     # Prettify the output
-    soup = bs(str(self.doc), 'html.parser')
-    return soup.prettify()
+    with tracer.span("prettify"):
+      soup = bs(str(self.doc), 'html.parser')
+      return soup.prettify()
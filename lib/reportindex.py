@@ -0,0 +1,65 @@
+import json
+import os
+from lib.publish import publish, publishFile
+
+# The index page is a static shell that loads the list of reports from
+# reports.jsonl, one compact json record per line, and sorts, filters and
+# paginates it client-side.  Adding a report appends a single line.
+INDEX_DATA = "reports.jsonl"
+
+# The config of a report is embedded in its config section.
+def readReportConfig(reportFile):
+  from bs4 import BeautifulSoup as bs
+  with open(reportFile) as fp:
+    soup = bs(fp, 'html.parser')
+  element_by_id = soup.find("div", {"id": "config"})
+  return json.loads(element_by_id.section.div.code.pre.text)
+
+def indexRecord(config):
+  record = {
+    "slug": config["slug"],
+    "is_experiment": config["is_experiment"]
+  }
+  if config["is_experiment"]:
+    record["startDate"] = config["startDate"]
+    record["endDate"] = config["endDate"]
+    record["channel"] = config["channel"]
+  else:
+    record["branches"] = [{key: branch[key] for key in ["name", "startDate", "endDate", "channel"]}
+                          for branch in config["branches"]]
+    # Use the dates of the first and last branch for non-experiments.
+    record["startDate"] = config["branches"][0]["startDate"]
+    record["endDate"] = config["branches"][-1]["endDate"]
+  return record
+
+def formatRecord(record):
+  return json.dumps(record, separators=(",", ":")) + "\n"
+
+def indexDataFile(indexDir):
+  return os.path.join(indexDir, INDEX_DATA)
+
+# Later records of the same report replace earlier ones.
+def loadIndexRecords(indexDir):
+  records = {}
+  with open(indexDataFile(indexDir), 'r') as f:
+    for line in f:
+      if line.strip():
+        record = json.loads(line)
+        records[record["slug"]] = record
+  return records
+
+def publishIndexData(indexDir):
+  publishFile(indexDataFile(indexDir))
+
+def writeIndexRecords(indexDir, records):
+  records = sorted(records, key=lambda record: record["endDate"])
+  publish(indexDataFile(indexDir), "".join(formatRecord(record) for record in records))
+
+# Returns False when the report is already in the index.
+def appendIndexRecord(indexDir, record):
+  if record["slug"] in loadIndexRecords(indexDir):
+    return False
+  with open(indexDataFile(indexDir), 'a') as f:
+    f.write(formatRecord(record))
+  publishIndexData(indexDir)
+  return True
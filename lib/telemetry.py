@@ -1,10 +1,21 @@
+import datetime
+import hashlib
+import json
 import os
+import re
 import sys
+import time
 import numpy as np
 import pandas as pd
-from google.cloud import bigquery
 from django.template import Template, Context
 from django.template.loader import get_template
+from concurrent.futures import ThreadPoolExecutor
+from lib.backend import BigQueryBackend
+from lib.instrumentation import tracer
+from lib.journal import JobJournal, query_hash
+
+# Number of times a failed query is retried.
+QUERY_RETRIES = 2
 
 # Remove any histograms that have empty datasets in
 # either a branch, or branch segment.
@@ -29,25 +40,86 @@ def invalidDataSet(df, histogram, branches, segments):
 
   return False
 
+# Sum the bucket counts of daily partitions into a single histogram.
+def sumPartitions(partitions):
+  if len(partitions) == 0:
+    return pd.DataFrame(columns=["segment", "branch", "bucket", "counts"])
+  df = pd.concat(partitions, ignore_index=True)
+  df = df.groupby(["segment", "branch", "bucket"], observed=True, as_index=False)["counts"].sum()
+  return df.sort_values(["segment", "branch", "bucket"], ignore_index=True)
+
+BYTE_UNITS = ["B", "KB", "MB", "GB", "TB", "PB"]
+
+# Byte sizes in the config are either a number of bytes, or a string with
+# a unit, e.g. "500 GB".
+def parseBytes(value):
+  if isinstance(value, (int, float)):
+    return int(value)
+  m = re.fullmatch(r"\s*([0-9.]+)\s*([KMGTP]?B)?\s*", value, re.IGNORECASE)
+  if m is None:
+    print(f"ERROR: invalid byte size '{value}'.")
+    sys.exit(1)
+  unit = (m.group(2) or "B").upper()
+  return int(float(m.group(1)) * 1024**BYTE_UNITS.index(unit))
+
+def formatBytes(n):
+  for unit in BYTE_UNITS:
+    if n < 1024 or unit == BYTE_UNITS[-1]:
+      return f"{n:.1f} {unit}"
+    n = n / 1024
+
+OS_SEGMENTS = set(["Windows", "All", "Linux", "Mac", "Android"])
+
 def segments_are_all_OS(segments):
-  os_segments = set(["Windows", "All", "Linux", "Mac", "Android"])
   for segment in segments:
-    if segment not in os_segments:
+    if segment not in OS_SEGMENTS:
       return False
   return True
 
 class TelemetryClient:
-  def __init__(self, dataDir, config, skipCache):
-    self.client = bigquery.Client()
+  def __init__(self, dataDir, config, skipCache, backend=None, shardDays=None, jobs=4, sampleRanges=None):
+    if backend is None:
+      backend = BigQueryBackend()
+    self.backend = backend
+    self.shardDays = shardDays
+    self.jobs = jobs
+    self.sampleRanges = sampleRanges
     self.config = config
     self.dataDir = dataDir
     self.skipCache = skipCache
+    self.fetchByDay = config.get('isOngoing', False) or config.get('daily_trends', False)
+    self.dailyHistograms = {}
+    self.dailyEventMetrics = {}
     self.queries = []
 
+    self.maxBytes = None
+    if 'max_bytes_scanned' in self.config:
+      self.maxBytes = parseBytes(self.config['max_bytes_scanned'])
+
+    # Backends with jobs that outlive the process record them in a journal.
+    self.journal = None
+    if hasattr(self.backend, "submit"):
+      self.journal = JobJournal(os.path.join(dataDir, f"{config['slug']}-jobs.json"))
+      if skipCache:
+        self.journal.clear()
+
+    # Segments other than the OS are computed by the queries, from the
+    # conditions of each segment in the config.
+    self.genericSegments = not segments_are_all_OS(config['segments'])
+    if self.genericSegments and not isinstance(config['segments'], dict):
+      print("ERROR: segments other than the OS need a list of conditions, e.g.")
+      print('  "segments": {"All": [], "8+ cores": ["AND metrics.quantity.hw_cpu_count >= 8"]}')
+      sys.exit(1)
+
+    self.blacklist = []
+    if 'isp_blacklist' in self.config:
+      with open(self.config['isp_blacklist'], 'r') as file:
+        self.blacklist = [line.strip() for line in file]
+
   def collectResultsFromQuery_OS_segments(self, results, branch, segment, event_metrics, histograms):
     for histogram in self.config['histograms']:
       df = histograms[histogram]
-      if segment == "All":
+      if segment == "All" and not self.genericSegments:
         subset = df[df["branch"] == branch][['bucket', 'counts']].groupby(['bucket']).sum()
         buckets = list(subset.index)
         counts = list(subset['counts'])
@@ -116,7 +188,7 @@ class TelemetryClient:
 
     for metric in self.config['pageload_event_metrics']:
       df = event_metrics[metric]
-      if segment == "All":
+      if segment == "All" and not self.genericSegments:
         subset = df[df["branch"] == branch][['bucket', 'counts']].groupby(['bucket']).sum()
         buckets = list(subset.index)
         counts = list(subset['counts'])
@@ -133,22 +205,34 @@ class TelemetryClient:
 
   def getResults(self):
     if self.config['is_experiment'] is True:
-      return self.getResultsForExperiment()
+      results = self.getResultsForExperiment()
     else:
-      return self.getResultsForNonExperiment()
+      results = self.getResultsForNonExperiment()
+
+    # All the fetched data is cached now, so the jobs are no longer needed.
+    if self.journal is not None:
+      self.journal.clear()
+    return results
+
+  def getMetricsToFetch(self):
+    metrics = [("pageload", metric) for metric in self.config['pageload_event_metrics']]
+    metrics.extend(("histogram", histogram) for histogram in self.config['histograms'])
+    return metrics
 
   def getResultsForNonExperiment(self):
+    data = self.fetchMetrics(self.getMetricsToFetch())
+
     # Get data for each pageload event metric.
     event_metrics = {}
     for metric in self.config['pageload_event_metrics']:
-      event_metrics[metric] = self.getPageloadEventDataNonExperiment(metric)
+      event_metrics[metric] = data[("pageload", metric)]
       print(event_metrics[metric])
 
     #Get data for each histogram in this segment.
     histograms = {}
     remove = []
     for histogram in self.config['histograms']:
-      df = self.getHistogramDataNonExperiment(self.config, histogram)
+      df = data[("histogram", histogram)]
       print(df)
 
       # Remove histograms that are empty.
@@ -177,17 +261,19 @@ class TelemetryClient:
     return results
 
   def getResultsForExperiment(self):
+    data = self.fetchMetrics(self.getMetricsToFetch())
+
     # Get data for each pageload event metric.
     event_metrics = {}
     for metric in self.config['pageload_event_metrics']:
-      event_metrics[metric] = self.getPageloadEventData(metric)
+      event_metrics[metric] = data[("pageload", metric)]
       print(event_metrics[metric])
 
     #Get data for each histogram in this segment.
     histograms = {}
     remove = []
     for histogram in self.config['histograms']:
-      df = self.getHistogramData(self.config, histogram)
+      df = data[("histogram", histogram)]
 
       # Mark histograms that have invalid data sets.
       if invalidDataSet(df, histogram, self.config['branches'], self.config['segments']):
@@ -213,158 +299,307 @@ class TelemetryClient:
         # Special case when segments is OS only.
         self.collectResultsFromQuery_OS_segments(results, branch_name, segment, event_metrics, histograms)
 
+    if self.fetchByDay:
+      with tracer.span("daily_results"):
+        results['daily'] = self.getDailyResults()
+
     results['queries'] = self.queries
     return results
 
-  def generatePageloadEventQuery_OS_segments_non_experiment(self, metric):
+  # Collect the histograms of each day separately, for the daily trends.
+  def getDailyResults(self):
+    days = set()
+    for partitions in list(self.dailyHistograms.values()) + list(self.dailyEventMetrics.values()):
+      days.update(partitions.keys())
+
+    daily = {}
+    for day in sorted(days):
+      histograms = {}
+      for histogram in self.config['histograms']:
+        histograms[histogram] = self.dailyHistograms[histogram][day]
+      event_metrics = {}
+      for metric in self.config['pageload_event_metrics']:
+        event_metrics[metric] = self.dailyEventMetrics[metric][day]
+
+      # Skip days without any data, e.g. before the first enrollments.
+      if all(df.empty for df in list(histograms.values()) + list(event_metrics.values())):
+        continue
+
+      daily[day] = {}
+      for branch in self.config['branches']:
+        branch_name = branch['name']
+        daily[day][branch_name] = {}
+        for segment in self.config['segments']:
+          daily[day][branch_name][segment] = {"histograms": {}, "pageload_event_metrics": {}}
+          self.collectResultsFromQuery_OS_segments(daily[day], branch_name, segment, event_metrics, histograms)
+    return daily
+
+  # Non-experiment queries scan each table once over the union of the branch
+  # date ranges and channels, and assign every row to the branches whose
+  # conditions it matches.  versionField and archField are the columns
+  # holding the version and architecture in the scanned tables.  The branch
+  # values are returned as query parameters.
+  def getNonExperimentBranchConditions(self, versionField, archField, conditionsKey, sample=None):
+    branches = []
+    scan_conditions = []
+    parameters = self.getSampleParameters(sample)
+    for i, branch in enumerate(self.config["branches"]):
+      parameters[f"branch_{i}"] = branch["name"]
+      parameters[f"startDate_{i}"] = branch["startDate"]
+      parameters[f"endDate_{i}"] = branch["endDate"]
+      parameters[f"channel_{i}"] = branch["channel"]
+      scan_condition = (f"DATE(submission_timestamp) >= DATE(@startDate_{i})"
+                        f" AND DATE(submission_timestamp) <= DATE(@endDate_{i})"
+                        f" AND normalized_channel = @channel_{i}")
+      scan_conditions.append(f"({scan_condition})")
+
+      conditions = [scan_condition]
+      if "version" in branch:
+        parameters[f"version_{i}"] = str(branch["version"])
+        conditions.append(f"SPLIT({versionField}, '.')[offset(0)] = @version_{i}")
+      if "architecture" in branch:
+        parameters[f"architecture_{i}"] = branch["architecture"]
+        conditions.append(f"{archField} = @architecture_{i}")
+      # Extra conditions are written as "AND <expr>" clauses.
+      for condition in branch.get(conditionsKey, []):
+        condition = re.sub(r"^\s*AND\s+", "", condition, flags=re.IGNORECASE)
+        conditions.append(f"({condition})")
+
+      branches.append({
+        "param": f"branch_{i}",
+        "condition": " AND ".join(conditions)
+      })
+    return branches, " OR ".join(scan_conditions), parameters
+
+  # Generic segments are computed in the same scan as the OS segments: each
+  # row is labelled with every segment whose conditions it matches, so rows
+  # can belong to overlapping segments.  Segments named after an OS only
+  # match the rows of that OS, and "All" matches every row.  Returns no
+  # segments when they are all OS segments, which use normalized_os directly.
+  def getSegmentConditions(self):
+    if not self.genericSegments:
+      return [], {}
+
+    segments = []
+    parameters = {}
+    for i, (segment, segmentConditions) in enumerate(self.config['segments'].items()):
+      parameters[f"segment_{i}"] = segment
+      conditions = []
+      if segment in OS_SEGMENTS and segment != "All":
+        conditions.append(f"normalized_os = @segment_{i}")
+      # Conditions are written as "AND <expr>" clauses.
+      for condition in segmentConditions:
+        condition = re.sub(r"^\s*AND\s+", "", condition, flags=re.IGNORECASE)
+        conditions.append(f"({condition})")
+      if segment == "All":
+        conditions.append("TRUE")
+      if len(conditions) == 0:
+        print(f"ERROR: segment '{segment}' has no conditions.")
+        sys.exit(1)
+
+      segments.append({
+        "param": f"segment_{i}",
+        "condition": " AND ".join(conditions)
+      })
+    return segments, parameters
+
+  # The data of generic segments depends on their conditions, so it is
+  # cached separately for each definition of the segments.
+  def segmentsName(self):
+    if not self.genericSegments:
+      return ""
+    text = json.dumps(self.config['segments'], sort_keys=True)
+    return "-segments" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:8]
+
+  # Values that change between reports are passed as query parameters, so
+  # the query text only depends on the metric and BigQuery's result cache
+  # can be reused across reruns.
+  def getQueryParameters(self, dates=None, sample=None):
+    return {
+      "slug": self.config['slug'],
+      "channel": self.config['channel'],
+      "startDate": dates[0] if dates else self.config['startDate'],
+      "endDate": dates[1] if dates else self.config['endDate'],
+      "blacklist": self.blacklist
+    } | self.getSampleParameters(sample)
+
+  # A sample is a range [min, max) of sample_id, which goes from 0 to 99.
+  def getSampleParameters(self, sample):
+    if sample is None:
+      return {}
+    return {"sampleMin": sample[0], "sampleMax": sample[1]}
+
+  def generatePageloadEventQuery_OS_segments_non_experiment(self, metric, sample=None):
     t = get_template("other/glean/pageload_events_os_segments.sql")
 
-    minVal = self.config['pageload_event_metrics'][metric]['min']
-    maxVal = self.config['pageload_event_metrics'][metric]['max']
+    branches, scan_condition, parameters = self.getNonExperimentBranchConditions(
+        "client_info.app_display_version", "client_info.architecture", "glean_conditions", sample)
 
-    branches = self.config["branches"]
-    for i in range(len(branches)):
-      branches[i]["last"] = False
-      if "version" in self.config["branches"][i]:
-        version = self.config["branches"][i]["version"]
-        branches[i]["ver_condition"] = f"AND SPLIT(client_info.app_display_version, '.')[offset(0)] = \"{version}\""
-      if "architecture" in self.config["branches"][i]:
-        arch = self.config["branches"][i]["architecture"]
-        branches[i]["arch_condition"] = f"AND client_info.architecture = \"{arch}\""
-      if "glean_conditions" in self.config["branches"][i]:
-        branches[i]["glean_conditions"] = self.config["branches"][i]["glean_conditions"]
-    branches[-1]["last"] = True
+    parameters["minVal"] = self.config['pageload_event_metrics'][metric]['min']
+    parameters["maxVal"] = self.config['pageload_event_metrics'][metric]['max']
+    parameters["logBuckets"] = self.config['pageload_event_metrics'][metric].get('log_buckets')
 
-    print(branches)
+    segments, segmentParameters = self.getSegmentConditions()
+    parameters = parameters | segmentParameters
 
     context = {
-        "minVal": minVal,
-        "maxVal": maxVal,
+        "segments": segments,
+        "log_buckets": parameters["logBuckets"],
         "metric": metric,
-        "branches": branches
+        "branches": branches,
+        "scan_condition": scan_condition,
+        "sample": sample is not None
     }
 
     query = t.render(context)
     # Remove empty lines before returning
     query = "".join([s for s in query.strip().splitlines(True) if s.strip()])
-    self.queries.append({
-      "name": f"Pageload event: {metric}",
-      "query": query
-    })
-    return query
+    return query, parameters
 
-  def generatePageloadEventQuery_OS_segments(self, metric):
+  # With nonEnrolled, the query returns the clients that are not enrolled in
+  # any experiment instead of the experiment branches.
+  def generatePageloadEventQuery_OS_segments(self, metric, dates=None, byDay=False, sample=None, nonEnrolled=False):
     t = get_template("experiment/glean/pageload_events_os_segments.sql")
 
     print(self.config['pageload_event_metrics'][metric])
 
-    metricMin = self.config['pageload_event_metrics'][metric]['min']
-    metricMax = self.config['pageload_event_metrics'][metric]['max']
+    parameters = self.getQueryParameters(dates, sample)
+    parameters["minVal"] = self.config['pageload_event_metrics'][metric]['min']
+    parameters["maxVal"] = self.config['pageload_event_metrics'][metric]['max']
+    parameters["logBuckets"] = self.config['pageload_event_metrics'][metric].get('log_buckets')
 
-    isp_blacklist = []
-    if 'isp_blacklist' in self.config:
-      with open(self.config['isp_blacklist'], 'r') as file:
-        isp_blacklist = [line.strip() for line in file]
+    segments, segmentParameters = self.getSegmentConditions()
+    parameters = parameters | segmentParameters
 
     context = {
-        "include_non_enrolled_branch": self.config['include_non_enrolled_branch'],
-        "minVal": metricMin,
-        "maxVal": metricMax,
-        "slug": self.config['slug'],
-        "channel": self.config['channel'],
-        "startDate": self.config['startDate'],
-        "endDate": self.config['endDate'],
+        "segments": segments,
+        "non_enrolled": nonEnrolled,
+        "log_buckets": parameters["logBuckets"],
+        "by_day": byDay,
+        "sample": sample is not None,
+        "metric": metric
+    }
+    query = t.render(context)
+    # Remove empty lines before returning
+    query = "".join([s for s in query.strip().splitlines(True) if s.strip()])
+    return query, parameters
+
+  # Scan the pageload events once for several metrics.  The results have
+  # an extra metric column.
+  def generatePageloadEventQuery_OS_segments_fused(self, metrics, sample=None):
+    t = get_template("experiment/glean/pageload_events_os_segments_fused.sql")
+
+    parameters = self.getQueryParameters(sample=sample)
+    parameters["metrics"] = metrics
+    metricInfo = []
+    for i, metric in enumerate(metrics):
+      parameters[f"minVal_{i}"] = self.config['pageload_event_metrics'][metric]['min']
+      parameters[f"maxVal_{i}"] = self.config['pageload_event_metrics'][metric]['max']
+      log_buckets = self.config['pageload_event_metrics'][metric].get('log_buckets')
+      if log_buckets:
+        parameters[f"logBuckets_{i}"] = log_buckets
+      metricInfo.append({"name": metric, "index": i, "log_buckets": log_buckets})
+
+    segments, segmentParameters = self.getSegmentConditions()
+    parameters = parameters | segmentParameters
+
+    context = {
+        "segments": segments,
+        "sample": sample is not None,
+        "metrics": metricInfo
+    }
+    query = t.render(context)
+    # Remove empty lines before returning
+    query = "".join([s for s in query.strip().splitlines(True) if s.strip()])
+    return query, parameters
+
+  # Batch queries scan the tables once for several experiments on the
+  # channel of this client, and tag the rows with the experiment slug.
+  # Each experiment is only counted within its own date range.
+  def getBatchConditions(self, experiments):
+    parameters = {
+      "channel": self.config['channel'],
+      "startDate": min(experiment['startDate'] for experiment in experiments),
+      "endDate": max(experiment['endDate'] for experiment in experiments),
+      "blacklist": self.blacklist
+    }
+    conditions = []
+    for i, experiment in enumerate(experiments):
+      parameters[f"slug_{i}"] = experiment['slug']
+      parameters[f"startDate_{i}"] = experiment['startDate']
+      parameters[f"endDate_{i}"] = experiment['endDate']
+      conditions.append(f"(experiment.key = @slug_{i}"
+                        f" AND DATE(submission_timestamp) >= DATE(@startDate_{i})"
+                        f" AND DATE(submission_timestamp) <= DATE(@endDate_{i}))")
+    return " OR ".join(conditions), parameters
+
+  def generatePageloadEventQuery_OS_segments_batch(self, metric, experiments):
+    t = get_template("batch/glean/pageload_events_os_segments.sql")
+
+    experiment_condition, parameters = self.getBatchConditions(experiments)
+    parameters["minVal"] = self.config['pageload_event_metrics'][metric]['min']
+    parameters["maxVal"] = self.config['pageload_event_metrics'][metric]['max']
+    parameters["logBuckets"] = self.config['pageload_event_metrics'][metric].get('log_buckets')
+
+    context = {
+        "log_buckets": parameters["logBuckets"],
         "metric": metric,
-        "blacklist": isp_blacklist
+        "experiment_condition": experiment_condition
     }
     query = t.render(context)
     # Remove empty lines before returning
     query = "".join([s for s in query.strip().splitlines(True) if s.strip()])
-    self.queries.append({
-      "name": f"Pageload event: {metric}",
-      "query": query
-    })
-    return query
-
-  # Not currently used, and not well supported.
-  def generatePageloadEventQuery_Generic(self):
-    t = get_template("archived/events_generic.sql")
-
-    segmentInfo = []
-    for segment in self.config['segments']:
-      segmentInfo.append({
-            "name": segment, 
-            "conditions": self.config['segments'][segment]
-            })
-
-    maxBucket = 0
-    minBucket = 30000
-    for metric in self.config['pageload_event_metrics']:
-      metricMin = self.config['pageload_event_metrics'][metric]['min']
-      metricMax = self.config['pageload_event_metrics'][metric]['max']
-      if metricMax > maxBucket:
-        maxBucket = metricMax
-      if metricMin < minBucket:
-        minBucket = metricMin
+    return query, parameters
+
+  def generateHistogramQuery_OS_segments_batch(self, histogram, experiments):
+    t = get_template("batch/glean/histogram_os_segments.sql")
 
+    experiment_condition, parameters = self.getBatchConditions(experiments)
     context = {
-        "minBucket": minBucket,
-        "maxBucket": maxBucket,
-        "is_experiment": self.config['is_experiment'],
-        "slug": self.config['slug'],
-        "channel": self.config['channel'],
-        "startDate": self.config['startDate'],
-        "endDate": self.config['endDate'],
-        "metrics": self.config['pageload_event_metrics'],
-        "segments": segmentInfo
+        "histogram": histogram,
+        "available_on_desktop": self.config['histograms'][histogram]['available_on_desktop'],
+        "available_on_android": self.config['histograms'][histogram]['available_on_android'],
+        "experiment_condition": experiment_condition
     }
     query = t.render(context)
     # Remove empty lines before returning
     query = "".join([s for s in query.strip().splitlines(True) if s.strip()])
-    self.queries.append({
-      "name": f"Pageload event: {metric}",
-      "query": query
-    })
-    return query
+    return query, parameters
 
   # Use *_os_segments queries if the segments is OS only which is much faster than generic query.
-  def generateHistogramQuery_OS_segments_legacy(self, histogram):
+  def generateHistogramQuery_OS_segments_legacy(self, histogram, dates=None, byDay=False, sample=None):
     t = get_template("experiment/legacy/histogram_os_segments.sql")
 
-    isp_blacklist = []
-    if 'isp_blacklist' in self.config:
-      with open(self.config['isp_blacklist'], 'r') as file:
-        isp_blacklist = [line.strip() for line in file]
+    parameters = self.getQueryParameters(dates, sample)
+    segments, segmentParameters = self.getSegmentConditions()
+    parameters = parameters | segmentParameters
 
     context = {
+        "segments": segments,
         "include_non_enrolled_branch": self.config['include_non_enrolled_branch'],
-        "slug": self.config['slug'],
-        "channel": self.config['channel'],
-        "startDate": self.config['startDate'],
-        "endDate": self.config['endDate'],
+        "by_day": byDay,
+        "sample": sample is not None,
         "histogram": histogram,
         "available_on_desktop": self.config['histograms'][histogram]['available_on_desktop'],
         "available_on_android": self.config['histograms'][histogram]['available_on_android'],
-        "blacklist": isp_blacklist
     }
     query = t.render(context)
     # Remove empty lines before returning
     query = "".join([s for s in query.strip().splitlines(True) if s.strip()])
-    self.queries.append({
-      "name": f"Histogram: {histogram}",
-      "query": query
-    })
-    return query
+    return query, parameters
 
-  def generateHistogramQuery_OS_segments_glean(self, histogram):
+  def generateHistogramQuery_OS_segments_glean(self, histogram, dates=None, byDay=False, sample=None, nonEnrolled=False):
     t = get_template("experiment/glean/histogram_os_segments.sql")
 
+    parameters = self.getQueryParameters(dates, sample)
+    segments, segmentParameters = self.getSegmentConditions()
+    parameters = parameters | segmentParameters
+
     context = {
-        "include_non_enrolled_branch": self.config['include_non_enrolled_branch'],
-        "slug": self.config['slug'],
-        "channel": self.config['channel'],
-        "startDate": self.config['startDate'],
-        "endDate": self.config['endDate'],
+        "segments": segments,
+        "non_enrolled": nonEnrolled,
+        "by_day": byDay,
+        "sample": sample is not None,
         "histogram": histogram,
         "available_on_desktop": self.config['histograms'][histogram]['available_on_desktop'],
         "available_on_android": self.config['histograms'][histogram]['available_on_android'],
@@ -372,210 +607,531 @@ class TelemetryClient:
     query = t.render(context)
     # Remove empty lines before returning
     query = "".join([s for s in query.strip().splitlines(True) if s.strip()])
-    self.queries.append({
-      "name": f"Histogram: {histogram}",
-      "query": query
-    })
-    return query
+    return query, parameters
 
-  def generateHistogramQuery_OS_segments_non_experiment_legacy(self, histogram):
+  def generateHistogramQuery_OS_segments_non_experiment_legacy(self, histogram, sample=None):
     t = get_template("other/legacy/histogram_os_segments.sql")
 
-    branches = self.config["branches"]
-    for i in range(len(branches)):
-      branches[i]["last"] = False
-      if "version" in self.config["branches"][i]:
-        version = self.config["branches"][i]["version"]
-        branches[i]["ver_condition"] = f"AND SPLIT(application.display_version, '.')[offset(0)] = \"{version}\""
-      if "architecture" in self.config["branches"][i]:
-        arch = self.config["branches"][i]["architecture"]
-        branches[i]["arch_condition"] = f"AND application.architecture = \"{arch}\""
-      if "legacy_conditions" in self.config["branches"][i]:
-        branches[i]["legacy_conditions"] = self.config["branches"][i]["legacy_conditions"]
+    branches, scan_condition, parameters = self.getNonExperimentBranchConditions(
+        "application.display_version", "application.architecture", "legacy_conditions", sample)
 
-    branches[-1]["last"] = True
+    segments, segmentParameters = self.getSegmentConditions()
+    parameters = parameters | segmentParameters
 
     context = {
+        "segments": segments,
         "histogram": histogram,
-        "available_on_desktop": self.config['histograms'][histogram]['available_on_desktop'],
-        "available_on_android": self.config['histograms'][histogram]['available_on_android'],
         "branches": branches,
-        "channel": self.config["branches"][0]["channel"],
+        "scan_condition": scan_condition,
+        "sample": sample is not None
     }
     query = t.render(context)
     # Remove empty lines before returning
     query = "".join([s for s in query.strip().splitlines(True) if s.strip()])
-    self.queries.append({
-      "name": f"Histogram: {histogram}",
-      "query": query
-    })
-    return query
+    return query, parameters
 
-  def generateHistogramQuery_OS_segments_non_experiment_glean(self, histogram):
+  def generateHistogramQuery_OS_segments_non_experiment_glean(self, histogram, sample=None):
     t = get_template("other/glean/histogram_os_segments.sql")
 
-    branches = self.config["branches"]
-    for i in range(len(branches)):
-      branches[i]["last"] = False
-      if "version" in self.config["branches"][i]:
-        version = self.config["branches"][i]["version"]
-        branches[i]["ver_condition"] = f"AND SPLIT(client_info.app_display_version, '.')[offset(0)] = \"{version}\""
-      if "architecture" in self.config["branches"][i]:
-        arch = self.config["branches"][i]["architecture"]
-        branches[i]["arch_condition"] = f"AND client_info.architecture = \"{arch}\""
-      if "glean_conditions" in self.config["branches"][i]:
-        branches[i]["glean_conditions"] = self.config["branches"][i]["glean_conditions"]
+    branches, scan_condition, parameters = self.getNonExperimentBranchConditions(
+        "client_info.app_display_version", "client_info.architecture", "glean_conditions", sample)
 
-    branches[-1]["last"] = True
+    segments, segmentParameters = self.getSegmentConditions()
+    parameters = parameters | segmentParameters
 
     context = {
+        "segments": segments,
         "histogram": histogram,
         "available_on_desktop": self.config['histograms'][histogram]['available_on_desktop'],
         "available_on_android": self.config['histograms'][histogram]['available_on_android'],
-        "branches": branches
+        "branches": branches,
+        "scan_condition": scan_condition,
+        "sample": sample is not None
     }
 
     query = t.render(context)
     # Remove empty lines before returning
     query = "".join([s for s in query.strip().splitlines(True) if s.strip()])
-    self.queries.append({
-      "name": f"Histogram: {histogram}",
-      "query": query
-    })
-    return query
-
-  # Not currently used, and not well supported.
-  def generateHistogramQuery_Generic(self, histogram):
-    t = get_template("archived/histogram_generic.sql")
-
-    segmentInfo = []
-    for segment in self.config['segments']:
-      segmentInfo.append({
-            "name": segment, 
-            "conditions": self.config['segments'][segment]
-            })
+    return query, parameters
 
-    context = {
-        "is_experiment": self.config['is_experiment'],
-        "slug": self.config['slug'],
-        "channel": self.config['channel'],
-        "startDate": self.config['startDate'],
-        "endDate": self.config['endDate'],
-        "histogram": histogram,
-        "available_available_on_desktop": self.config['histograms'][histogram]['available_on_desktop'],
-        "available_on_android": self.config['histograms'][histogram]['available_on_android'],
-        "segments": segmentInfo
-    }
-    query = t.render(context)
-    # Remove empty lines before returning
-    query = "".join([s for s in query.strip().splitlines(True) if s.strip()])
-    self.queries.append({
-      "name": f"Histogram: {histogram}",
-      "query": query
-    })
-    return query
-
-  def checkForExistingData(self, filename):
-    if self.skipCache:
-      df = None
-    else:
+  def runQuery(self, query, parameters=None, name=None):
+    print("Running query:\n" + query)
+    with tracer.span("query"):
+      if self.journal is None:
+        return self.backend.query(query, parameters)
+      return self.runJob(query, parameters, name)
+
+  # Jobs are recorded in the journal until the report is done, so that a
+  # run that crashed or was interrupted reattaches to the jobs that were
+  # still running, or downloads the results of the finished ones, instead
+  # of running and paying for the same queries again.
+  def runJob(self, query, parameters, name):
+    key = query_hash(query, parameters)
+    job = self.journal.get(key)
+    if job is not None:
+      print(f"Reattaching to {job['state']} job {job['job_id']} for {name}.")
       try:
-        df = pd.read_pickle(filename)
-        print(f"Found local data in {filename}")
-      except:
-        df = None
+        df = self.backend.result(job)
+        tracer.count("query.reattached")
+        self.journal.record(key, state="done")
+        return df
+      except Exception as e:
+        print(f"Could not reattach to job {job['job_id']}: {e}")
+        self.journal.remove(key)
+
+    job = self.backend.submit(query, parameters)
+    self.journal.record(key, **job, metric=name, state="running", created=time.time())
+    try:
+      df = self.backend.result(job)
+    except Exception:
+      self.journal.remove(key)
+      raise
+    self.journal.record(key, state="done")
     return df
 
-  def getHistogramDataNonExperiment(self, config, histogram):
-    slug = config['slug']
-    hist_name = histogram.split('.')[-1]
-    filename=os.path.join(self.dataDir, f"{slug}-{hist_name}.pkl")
-
-    df = self.checkForExistingData(filename)
-    if df is not None:
-      return df
-
-    if segments_are_all_OS(self.config['segments']):
-      if config["histograms"][histogram]["glean"]:
-        query = self.generateHistogramQuery_OS_segments_non_experiment_glean(histogram)
+  # Retry failed queries, e.g. transient BigQuery errors, with a backoff.
+  def runQueryWithRetries(self, query, parameters=None, name=None):
+    for attempt in range(QUERY_RETRIES+1):
+      try:
+        return self.runQuery(query, parameters, name)
+      except Exception as e:
+        if attempt == QUERY_RETRIES:
+          raise
+        tracer.count("query.retry")
+        delay = 2**attempt * 5
+        print(f"Query failed: {e}\nRetrying in {delay} seconds.")
+        time.sleep(delay)
+
+  # Describe how the data of a metric is fetched given the local cache: the
+  # data that is already cached, and the queries that still need to run.
+  # Ongoing experiments are fetched and cached one day at a time (byDay), so
+  # that rerunning the report only queries the days that are not cached yet.
+  # With shardDays, the date range is fetched in chunks of at most shardDays
+  # days which run concurrently, and are cached and retried independently.
+  # Each sample_id range is cached separately, so that later runs with a
+  # larger sample only fetch the ranges that are not cached yet.
+  # The clients not enrolled in any experiment (nonEnrolled) are the same
+  # for every experiment on a channel, so they are always fetched by day and
+  # cached in a directory shared by all the experiments.
+  def planFetch(self, kind, metric, sample=None, nonEnrolled=False):
+    if kind == "histogram":
+      name = metric.split('.')[-1]
+      title = f"Histogram: {metric}"
+      glean = self.config['histograms'][metric]['glean']
+      if not self.config['is_experiment'] and glean:
+        generateQuery = lambda dates, byDay: self.generateHistogramQuery_OS_segments_non_experiment_glean(metric, sample)
+      elif not self.config['is_experiment']:
+        generateQuery = lambda dates, byDay: self.generateHistogramQuery_OS_segments_non_experiment_legacy(metric, sample)
+      elif glean:
+        generateQuery = lambda dates, byDay: self.generateHistogramQuery_OS_segments_glean(metric, dates, byDay, sample, nonEnrolled)
       else:
-        query = self.generateHistogramQuery_OS_segments_non_experiment_legacy(histogram)
+        generateQuery = lambda dates, byDay: self.generateHistogramQuery_OS_segments_legacy(metric, dates, byDay, sample)
     else:
-      print("No current support for generic non-experiment queries.")
-      sys.exit(1)
+      name = self.pageloadEventDataName(metric)
+      title = f"Pageload event: {metric}"
+      if not self.config['is_experiment']:
+        generateQuery = lambda dates, byDay: self.generatePageloadEventQuery_OS_segments_non_experiment(metric, sample)
+      else:
+        generateQuery = lambda dates, byDay: self.generatePageloadEventQuery_OS_segments(metric, dates, byDay, sample, nonEnrolled)
+      if nonEnrolled:
+        info = self.config['pageload_event_metrics'][metric]
+        name = f"{name}-{info['min']}-{info['max']}"
+    name = name + self.segmentsName()
+
+    if nonEnrolled:
+      title = f"{title} (non-enrolled)"
+    elif self.includesNonEnrolled(kind, metric):
+      name = f"{name}-enrolled"
+
+    if sample is not None:
+      name = f"{name}-sample{sample[0]}-{sample[1]}"
+      title = f"{title} (sample_id {sample[0]} to {sample[1]-1})"
+
+    plan = {
+      "kind": kind,
+      "metrics": [metric],
+      "sample": sample,
+      "title": title,
+      "filenames": [os.path.join(self.dataDir, f"{self.config['slug']}-{name}.pkl")],
+      "byDay": False,
+      "partitionDir": None,
+      "partitions": {},
+      "chunks": [],
+      "queries": []
+    }
 
-    print("Running query:\n" + query)
-    job = self.client.query(query)
-    df = job.to_dataframe()
-    print(f"Writing '{slug}' histogram results for {histogram} to disk.")
-    df.to_pickle(filename)
-    return df
+    if nonEnrolled:
+      plan["byDay"] = True
+      sharedDir = os.path.join(os.path.dirname(self.dataDir), "non-enrolled", self.config['channel'])
+      self.planPartitions(plan, os.path.join(sharedDir, name), generateQuery)
+      return plan
 
-  def getHistogramData(self, config, histogram):
-    slug = config['slug']
-    hist_name = histogram.split('.')[-1]
-    filename=os.path.join(self.dataDir, f"{slug}-{hist_name}.pkl")
+    if self.config['is_experiment'] and self.fetchByDay:
+      plan["byDay"] = True
+      self.planPartitions(plan, os.path.join(self.dataDir, "daily", name), generateQuery)
+      return plan
 
-    df = self.checkForExistingData(filename)
+    df = self.checkForExistingData(plan["filenames"][0])
     if df is not None:
-      return df
+      plan["data"] = {metric: df}
+    elif self.config['is_experiment'] and self.shardDays:
+      self.planPartitions(plan, os.path.join(self.dataDir, "shards", name), generateQuery)
+    else:
+      plan["queries"].append(generateQuery(None, False))
+    return plan
 
-    if segments_are_all_OS(self.config['segments']):
-      if config["histograms"][histogram]["glean"]:
-        query = self.generateHistogramQuery_OS_segments_glean(histogram)
-      else:
-        query = self.generateHistogramQuery_OS_segments_legacy(histogram)
+  # Only the glean templates query the non-enrolled clients.
+  def includesNonEnrolled(self, kind, metric):
+    if not self.config['is_experiment'] or not self.config['include_non_enrolled_branch']:
+      return False
+    return kind == "pageload" or self.config['histograms'][metric]['glean']
+
+  # Load the cached partitions, and render the queries for the missing ones.
+  # The current day is still receiving data, so it is never cached.
+  def planPartitions(self, plan, partitionDir, generateQuery):
+    os.makedirs(partitionDir, exist_ok=True)
+    plan["partitionDir"] = partitionDir
+
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    startDate = datetime.date.fromisoformat(self.config['startDate'])
+    endDate = datetime.date.fromisoformat(self.config['endDate'])
+    oneDay = datetime.timedelta(days=1)
+
+    if plan["byDay"]:
+      partitionDays = 1
+    elif self.shardDays:
+      partitionDays = self.shardDays
     else:
-      # Generic segments are not well supported right now.
-      print("No current support for generic non-experiment queries.")
+      partitionDays = (endDate-startDate).days + 1
+
+    missing = []
+    first = startDate
+    while first <= endDate:
+      last = min(first + (partitionDays-1)*oneDay, endDate)
+      df = None
+      if last < today:
+        df = self.checkForExistingData(os.path.join(partitionDir, f"{self.partitionName(plan, first, last)}.pkl"))
+      if df is None:
+        missing.append((first, last))
+      else:
+        plan["partitions"][self.partitionName(plan, first, last)] = df
+      first = last + oneDay
+
+    # Query consecutive missing partitions together, up to shardDays at once.
+    for first, last in missing:
+      if plan["chunks"] and plan["chunks"][-1][1] + oneDay == first and \
+         (not self.shardDays or (last-plan["chunks"][-1][0]).days < self.shardDays):
+        plan["chunks"][-1][1] = last
+      else:
+        plan["chunks"].append([first, last])
+
+    for first, last in plan["chunks"]:
+      plan["queries"].append(generateQuery((str(first), str(last)), plan["byDay"]))
+
+  def partitionName(self, plan, first, last):
+    return str(first) if plan["byDay"] else f"{first}_{last}"
+
+  # Pageload event metrics are all read from the same tables, so scanning
+  # them once for every metric can be cheaper than a query per metric.  Use
+  # whichever strategy is estimated to scan fewer bytes.
+  def planFusedPageloadEvents(self, plans, sample=None):
+    candidates = [plan for plan in plans if plan["kind"] == "pageload" and plan["sample"] == sample and \
+                  plan["partitionDir"] is None and plan["queries"]]
+    if not self.config['is_experiment'] or len(candidates) < 2:
+      return plans
+
+    metrics = [plan["metrics"][0] for plan in candidates]
+    query = self.generatePageloadEventQuery_OS_segments_fused(metrics, sample)
+    estimate = self.estimateQueries([query])[0]
+    separate = sum(plan["estimate"] for plan in candidates)
+    print(f"Estimated bytes for pageload events: {formatBytes(separate)} separately, {formatBytes(estimate)} fused.")
+    if estimate >= separate:
+      return plans
+
+    title = f"Pageload events: {', '.join(metrics)}"
+    if sample is not None:
+      title = f"{title} (sample_id {sample[0]} to {sample[1]-1})"
+    fused = {
+      "kind": "pageload",
+      "metrics": metrics,
+      "sample": sample,
+      "title": title,
+      "filenames": [filename for plan in candidates for filename in plan["filenames"]],
+      "byDay": False,
+      "partitionDir": None,
+      "partitions": {},
+      "chunks": [],
+      "queries": [query],
+      "estimates": [estimate],
+      "estimate": estimate
+    }
+    result = []
+    for plan in plans:
+      if plan is candidates[0]:
+        result.append(fused)
+      elif not any(plan is candidate for candidate in candidates):
+        result.append(plan)
+    return result
+
+  # Dry run the queries to estimate the bytes they scan.
+  def estimateQueries(self, queries):
+    def estimate(query):
+      return self.backend.estimate(*query)
+
+    if len(queries) > 1 and self.jobs > 1:
+      with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+        return list(executor.map(estimate, queries))
+    return [estimate(query) for query in queries]
+
+  # Plan the fetch of the metrics, and dry run their queries to estimate
+  # the bytes they scan.  Pageload event metrics are fused into a single
+  # query when that is cheaper, unless fuse is False.
+  def planMetrics(self, metrics, fuse=True):
+    samples = self.sampleRanges or [None]
+    plans = []
+    for sample in samples:
+      for kind, metric in metrics:
+        plans.append(self.planFetch(kind, metric, sample))
+        if self.includesNonEnrolled(kind, metric):
+          plans.append(self.planFetch(kind, metric, sample, True))
+
+    with tracer.span("estimate"):
+      estimates = self.estimateQueries([query for plan in plans for query in plan["queries"]])
+      i = 0
+      for plan in plans:
+        plan["estimates"] = estimates[i:i+len(plan["queries"])]
+        plan["estimate"] = sum(plan["estimates"])
+        i = i + len(plan["queries"])
+      if fuse:
+        for sample in samples:
+          plans = self.planFusedPageloadEvents(plans, sample)
+    return plans
+
+  # Print the estimates, and stop before any query runs if they are larger
+  # than the byte budget (max_bytes_scanned).
+  def checkBudget(self, plans):
+    total = sum(plan["estimate"] for plan in plans)
+    print("Estimated bytes scanned:")
+    for plan in plans:
+      print(f"  {plan['title']:<60} {formatBytes(plan['estimate']):>10}")
+    print(f"  {'Total':<60} {formatBytes(total):>10}")
+    if self.maxBytes is not None and total > self.maxBytes:
+      print(f"ERROR: queries are estimated to scan {formatBytes(total)}, more than max_bytes_scanned ({formatBytes(self.maxBytes)}).")
       sys.exit(1)
 
-    print("Running query:\n" + query)
-    job = self.client.query(query)
-    df = job.to_dataframe()
-    print(f"Writing '{slug}' histogram results for {histogram} to disk.")
-    df.to_pickle(filename)
-    return df
+  # Every query is dry run before any of them runs, so that the estimated
+  # cost can be checked against the byte budget, and the cheapest metrics
+  # are fetched first.  Returns the data keyed by (kind, metric).
+  def fetchMetrics(self, metrics):
+    plans = self.planMetrics(metrics)
+    self.checkBudget(plans)
+    tracer.count("bytes.estimated", sum(plan["estimate"] for plan in plans))
+
+    for plan in plans:
+      for (query, parameters), estimate in zip(plan["queries"], plan["estimates"]):
+        self.queries.append({
+          "name": plan["title"],
+          "query": query,
+          "parameters": parameters,
+          "estimated_bytes": estimate
+        })
+
+    # The data of each sample range is summed up.
+    data = {}
+    for plan in sorted(plans, key=lambda plan: plan["estimate"]):
+      with tracer.span("fetch", metric=", ".join(plan["metrics"])):
+        for metric, df in self.fetchPlan(plan).items():
+          if (plan["kind"], metric) in data:
+            df = sumPartitions([data[(plan["kind"], metric)], df])
+          data[(plan["kind"], metric)] = df
+    return data
+
+  # Run the queries of a plan, and cache the results.  Returns the data of
+  # each metric of the plan.
+  def fetchPlan(self, plan):
+    if "data" in plan:
+      return plan["data"]
+
+    if plan["partitionDir"] is None:
+      df = self.runQueryWithRetries(*plan["queries"][0], name=plan["title"])
+      if len(plan["metrics"]) > 1:
+        data = self.splitFusedData(plan, df)
+      else:
+        data = {plan["metrics"][0]: df}
+      for metric, filename in zip(plan["metrics"], plan["filenames"]):
+        print(f"Writing '{self.config['slug']}' results for {metric} to disk.")
+        data[metric].to_pickle(filename)
+      return data
+
+    metric = plan["metrics"][0]
+    partitions = self.fetchPartitions(plan)
+    if plan["byDay"]:
+      df = sumPartitions(list(partitions.values()))
+      if not self.fetchByDay:
+        return {metric: df}
+      daily = self.dailyHistograms if plan["kind"] == "histogram" else self.dailyEventMetrics
+      if metric in daily:
+        partitions = {day: sumPartitions([daily[metric][day], partition]) for day, partition in partitions.items()}
+      daily[metric] = partitions
+      return {metric: df}
+
+    df = sumPartitions(list(partitions.values()))
+    print(f"Writing '{self.config['slug']}' results for {metric} to disk.")
+    df.to_pickle(plan["filenames"][0])
+    return {metric: df}
+
+  # Returns the partitions keyed by day, or by chunk.
+  def fetchPartitions(self, plan):
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    oneDay = datetime.timedelta(days=1)
+
+    def fetchChunk(chunk, query):
+      first, last = chunk
+      print(f"Fetching {plan['title']} for {first} to {last}.")
+      df = self.runQueryWithRetries(*query, name=plan["title"])
+
+      fetched = {}
+      if plan["byDay"]:
+        days = pd.to_datetime(df["day"]).dt.date
+        day = first
+        while day <= last:
+          fetched[str(day)] = df[days == day].drop(columns=["day"]).reset_index(drop=True)
+          day = day + oneDay
+      else:
+        fetched[self.partitionName(plan, first, last)] = df
 
-  def getPageloadEventDataNonExperiment(self, metric):
-    slug = self.config['slug']
-    filename=os.path.join(self.dataDir, f"{slug}-pageload-events-{metric}.pkl")
+      for key, partition in fetched.items():
+        if key.split("_")[-1] < str(today):
+          partition.to_pickle(os.path.join(plan["partitionDir"], f"{key}.pkl"))
+      return fetched
 
-    df = self.checkForExistingData(filename)
-    if df is not None:
-      return df
+    if len(plan["chunks"]) > 1 and self.jobs > 1:
+      with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+        results = list(executor.map(fetchChunk, plan["chunks"], plan["queries"]))
+    else:
+      results = [fetchChunk(chunk, query) for chunk, query in zip(plan["chunks"], plan["queries"])]
+
+    partitions = dict(plan["partitions"])
+    for fetched in results:
+      partitions.update(fetched)
+    return dict(sorted(partitions.items()))
+
+  # Split the results of a fused query into the data of each metric.
+  def splitFusedData(self, plan, df):
+    data = {}
+    for metric in plan["metrics"]:
+      subset = df[df["metric"] == metric].drop(columns=["metric"]).reset_index(drop=True)
+      if not self.config['pageload_event_metrics'][metric].get('log_buckets'):
+        subset["bucket"] = subset["bucket"].astype("int64")
+      for column in ["segment", "branch"]:
+        if isinstance(subset[column].dtype, pd.CategoricalDtype):
+          subset[column] = subset[column].cat.remove_unused_categories()
+      data[metric] = subset
+    return data
 
-    if segments_are_all_OS(self.config['segments']):
-      query = self.generatePageloadEventQuery_OS_segments_non_experiment(metric)
+  def checkForExistingData(self, filename):
+    if self.skipCache:
+      df = None
     else:
-      print("Generic non-experiment query currently not supported.")
-      sys.exit(1)
+      try:
+        with tracer.span("cache_load"):
+          df = pd.read_pickle(filename)
+        print(f"Found local data in {filename}")
+      except:
+        df = None
 
-    print("Running query:\n" + query)
-    job = self.client.query(query)
-    df = job.to_dataframe()
-    print(f"Writing '{slug}' pageload event results to disk.")
-    df.to_pickle(filename)
+    if df is None:
+      tracer.count("data.cache.miss")
+    else:
+      tracer.count("data.cache.hit")
     return df
 
-  def getPageloadEventData(self, metric):
-    slug = self.config['slug']
-    filename=os.path.join(self.dataDir, f"{slug}-pageload-events-{metric}.pkl")
-
-    df = self.checkForExistingData(filename)
-    if df is not None:
-      return df
-
-    if segments_are_all_OS(self.config['segments']):
-      query = self.generatePageloadEventQuery_OS_segments(metric)
+  # Queries that fetched data into the cache of this client from elsewhere,
+  # e.g. batch queries, are added to the cached queries of the report, which
+  # are shown with the queries of the metrics it fetched itself.
+  def recordCachedQueries(self, entries):
+    filename = os.path.join(self.dataDir, f"{self.config['slug']}-queries.json")
+    queries = []
+    if os.path.isfile(filename):
+      with open(filename, 'r') as f:
+        queries = json.load(f)
+    names = set(entry["name"] for entry in entries)
+    queries = [query for query in queries if query["name"] not in names] + entries
+    with open(filename, 'w') as f:
+      json.dump(queries, f, indent=2, default=str)
+
+  # Data bucketed with a different resolution is cached separately.
+  def pageloadEventDataName(self, metric):
+    log_buckets = self.config['pageload_event_metrics'][metric].get('log_buckets')
+    if log_buckets:
+      return f"pageload-events-{metric}-log{log_buckets}"
+    return f"pageload-events-{metric}"
+
+# Fetch the data of several experiments together: every metric that isn't
+# cached yet is queried once for all the experiments on the same channel,
+# and the results are split into the cache of each experiment, where its
+# TelemetryClient finds them when the report is generated.  Only metrics
+# fetched over the whole date range with the glean templates are batched,
+# and only when the batch query fits the byte budget of every experiment.
+def prefetchExperiments(clients):
+  groups = {}
+  for client in clients:
+    if not client.config['is_experiment'] or not segments_are_all_OS(client.config['segments']):
+      continue
+    for kind, metric in client.getMetricsToFetch():
+      if kind == "histogram" and not client.config['histograms'][metric]['glean']:
+        continue
+      plan = client.planFetch(kind, metric)
+      if plan["partitionDir"] is not None or len(plan["queries"]) != 1:
+        continue
+      info = client.config['histograms' if kind == "histogram" else 'pageload_event_metrics'][metric]
+      key = (client.config['channel'], kind, metric, repr(info), tuple(client.blacklist))
+      groups.setdefault(key, []).append((client, plan))
+
+  for (channel, kind, metric, info, blacklist), members in groups.items():
+    if len(members) < 2:
+      continue
+    client = members[0][0]
+    experiments = [{
+      "slug": member.config['slug'],
+      "startDate": member.config['startDate'],
+      "endDate": member.config['endDate']
+    } for member, plan in members]
+    if kind == "histogram":
+      query, parameters = client.generateHistogramQuery_OS_segments_batch(metric, experiments)
     else:
-      #query = self.generatePageloadEventQuery_Generic()
-      print("No current support for generic pageload event queries.")
-      sys.exit(1)
-
-    print("Running query:\n" + query)
-    job = self.client.query(query)
-    df = job.to_dataframe()
-    print(f"Writing '{slug}' pageload event results to disk.")
-    df.to_pickle(filename)
-    return df
+      query, parameters = client.generatePageloadEventQuery_OS_segments_batch(metric, experiments)
+
+    slugs = ", ".join(experiment["slug"] for experiment in experiments)
+
+    # The batch query scans the data of every experiment in the group, so it
+    # must fit the budget of each of them.  Otherwise each experiment fetches
+    # the metric on its own, within its own budget.
+    with tracer.span("estimate"):
+      estimate = client.backend.estimate(query, parameters)
+    budgets = [member.maxBytes for member, plan in members if member.maxBytes is not None]
+    print(f"Estimated bytes scanned by {metric} for {slugs}: {formatBytes(estimate)}")
+    if budgets and estimate > min(budgets):
+      print(f"Not batching {metric}, the query is larger than max_bytes_scanned ({formatBytes(min(budgets))}).")
+      continue
+    tracer.count("bytes.estimated", estimate)
+
+    print(f"Fetching {metric} for {slugs} on {channel} with a single query.")
+    with tracer.span("batch_fetch", metric=metric):
+      df = client.runQueryWithRetries(query, parameters, name=f"{metric} (batch)")
+
+    slugColumn = df["slug"].astype(str)
+    for member, plan in members:
+      subset = df[slugColumn == member.config['slug']].drop(columns=["slug"]).reset_index(drop=True)
+      for column in ["segment", "branch"]:
+        if isinstance(subset[column].dtype, pd.CategoricalDtype):
+          subset[column] = subset[column].cat.remove_unused_categories()
+      print(f"Writing '{member.config['slug']}' results for {metric} to disk.")
+      subset.to_pickle(plan["filenames"][0])
+      member.recordCachedQueries([{
+        "name": plan["title"],
+        "query": query,
+        "parameters": parameters,
+        "estimated_bytes": estimate,
+        "batch": [experiment["slug"] for experiment in experiments]
+      }])
@@ -0,0 +1,85 @@
+{% autoescape off %}
+with 
+{% if available_on_desktop == True %}
+desktop_data as (
+    SELECT 
+        normalized_os as segment,
+        experiment.key as slug,
+        experiment.value.branch as branch,
+        CAST(key as INT64)/1000000 AS bucket,
+        value as count
+    FROM `mozdata.firefox_desktop.metrics` as d
+      CROSS JOIN UNNEST(ping_info.experiments) AS experiment
+      CROSS JOIN UNNEST({{histogram}}.values)
+    WHERE
+      DATE(submission_timestamp) >= DATE(@startDate)
+      AND DATE(submission_timestamp) <= DATE(@endDate)
+      AND normalized_channel = @channel
+      AND normalized_app_name = "Firefox"
+      AND {{histogram}} is not null
+      AND experiment.value.branch is not null
+      AND ({{experiment_condition}})
+      AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
+),
+{% else %}
+desktop_data as (
+  SELECT
+    "" as segment,
+    "" as slug,
+    "" as branch,
+    0 as bucket,
+    0 as count
+  FROM `mozdata.firefox_desktop.metrics` as d
+  WHERE FALSE
+),
+{% endif %}
+{% if available_on_android == True %}
+android_data as (
+    SELECT 
+        normalized_os as segment,
+        experiment.key as slug,
+        experiment.value.branch as branch,
+        CAST(key as INT64)/1000000 AS bucket,
+        value as count
+    FROM `mozdata.fenix.metrics` as f
+      CROSS JOIN UNNEST(ping_info.experiments) AS experiment
+      CROSS JOIN UNNEST({{histogram}}.values)
+    WHERE
+      DATE(submission_timestamp) >= DATE(@startDate)
+      AND DATE(submission_timestamp) <= DATE(@endDate)
+      AND normalized_channel = @channel
+      AND {{histogram}} is not null
+      AND experiment.value.branch is not null
+      AND ({{experiment_condition}})
+      AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
+)
+{% else %}
+android_data as (
+  SELECT
+    "" as segment,
+    "" as slug,
+    "" as branch,
+    0 as bucket,
+    0 as count
+  FROM `mozdata.fenix.metrics` as f
+  WHERE FALSE
+)
+{% endif %}
+
+SELECT
+    segment,
+    slug,
+    branch,
+    bucket,
+    SUM(count) as counts
+FROM
+    (
+        SELECT * FROM desktop_data
+        UNION ALL
+        SELECT * FROM android_data
+    ) s
+GROUP BY
+  segment, slug, branch, bucket
+ORDER BY
+  segment, slug, branch, bucket
+{% endautoescape %}
@@ -0,0 +1,65 @@
+{% autoescape off %}
+with desktop_eventdata as (
+SELECT
+  normalized_os as segment,
+  experiment.key as slug,
+  experiment.value.branch as branch,
+  SAFE_CAST((SELECT value FROM UNNEST(event.extra) WHERE key = '{{metric}}') AS int) AS {{metric}},
+FROM
+  `moz-fx-data-shared-prod.firefox_desktop.pageload` as d
+CROSS JOIN
+  UNNEST(ping_info.experiments) AS experiment
+CROSS JOIN
+  UNNEST(events) AS event
+WHERE
+  normalized_channel = @channel
+  AND DATE(submission_timestamp) >= DATE(@startDate)
+  AND DATE(submission_timestamp) <= DATE(@endDate)
+  AND experiment.value.branch is not null
+  AND ({{experiment_condition}})
+  AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
+)
+, android_eventdata as (
+SELECT
+  normalized_os as segment,
+  experiment.key as slug,
+  experiment.value.branch as branch,
+  SAFE_CAST((SELECT value FROM UNNEST(event.extra) WHERE key = '{{metric}}') AS int) AS {{metric}},
+FROM
+  `moz-fx-data-shared-prod.fenix.pageload` as f
+CROSS JOIN
+  UNNEST(ping_info.experiments) AS experiment
+CROSS JOIN
+  UNNEST(events) AS event
+WHERE
+  normalized_channel = @channel
+  AND DATE(submission_timestamp) >= DATE(@startDate)
+  AND DATE(submission_timestamp) <= DATE(@endDate)
+  AND experiment.value.branch is not null
+  AND ({{experiment_condition}})
+  AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
+)
+
+SELECT
+  segment,
+  slug,
+  branch,
+{% if log_buckets %}
+  ROUND(POW(2, (FLOOR(LN({{metric}} + 1) / LN(2) * @logBuckets) + 0.5) / @logBuckets) - 1, 2) as bucket,
+{% else %}
+  {{metric}} as bucket,
+{% endif %}
+  COUNT(*) as counts
+FROM
+  (
+    SELECT * from desktop_eventdata
+    UNION ALL
+    SELECT * from android_eventdata
+  )
+WHERE
+  {{metric}} >= @minVal AND {{metric}} <= @maxVal
+GROUP BY
+  segment, slug, branch, bucket
+ORDER BY
+  segment, slug, branch, bucket
+{% endautoescape %}
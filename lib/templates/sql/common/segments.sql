@@ -0,0 +1,7 @@
+{% if segments %}
+    CROSS JOIN UNNEST([
+{% for segment in segments %}
+        CASE WHEN {{segment.condition}} THEN @{{segment.param}} END{% if not forloop.last %},{% endif %}
+{% endfor %}
+    ]) AS segment
+{% endif %}
@@ -1,30 +1,34 @@
 {% autoescape off %}
 with 
+{% if not non_enrolled %}
 {% if available_on_desktop == True %}
 desktop_data as (
     SELECT 
-        normalized_os as segment,
-        mozfun.map.get_key(ping_info.experiments, "{{slug}}").branch as branch,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        {% if by_day %}DATE(submission_timestamp) as day,{% endif %}
+        mozfun.map.get_key(ping_info.experiments, @slug).branch as branch,
         CAST(key as INT64)/1000000 AS bucket,
         value as count
     FROM `mozdata.firefox_desktop.metrics` as d
+    {% include "common/segments.sql" %}
       CROSS JOIN UNNEST({{histogram}}.values)
     WHERE
-      DATE(submission_timestamp) >= DATE('{{startDate}}')
-      AND DATE(submission_timestamp) <= DATE('{{endDate}}')
-      AND normalized_channel = "{{channel}}"
+      DATE(submission_timestamp) >= DATE(@startDate)
+      AND DATE(submission_timestamp) <= DATE(@endDate)
+      {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+      {% if segments %}AND segment is not null{% endif %}
+      AND normalized_channel = @channel
       AND normalized_app_name = "Firefox"
       AND {{histogram}} is not null
       AND ARRAY_LENGTH(ping_info.experiments) > 0
-      AND mozfun.map.get_key(ping_info.experiments, "{{slug}}").branch is not null
-      {% for isp in blacklist %}
-      AND metadata.isp.name != "{{isp}}"
-      {% endfor %}
+      AND mozfun.map.get_key(ping_info.experiments, @slug).branch is not null
+      AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
 ),
 {% else %}
 desktop_data as (
   SELECT
     "" as segment,
+    {% if by_day %}CAST(NULL AS DATE) as day,{% endif %}
     "" as branch,
     0 as bucket,
     0 as count
@@ -35,27 +39,30 @@ desktop_data as (
 {% if available_on_android == True %}
 android_data as (
     SELECT 
-        normalized_os as segment,
-        mozfun.map.get_key(ping_info.experiments, "{{slug}}").branch as branch,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        {% if by_day %}DATE(submission_timestamp) as day,{% endif %}
+        mozfun.map.get_key(ping_info.experiments, @slug).branch as branch,
         CAST(key as INT64)/1000000 AS bucket,
         value as count
     FROM `mozdata.fenix.metrics` as f
+    {% include "common/segments.sql" %}
       CROSS JOIN UNNEST({{histogram}}.values)
     WHERE
-      DATE(submission_timestamp) >= DATE('{{startDate}}')
-      AND DATE(submission_timestamp) <= DATE('{{endDate}}')
-      AND normalized_channel = "{{channel}}"
+      DATE(submission_timestamp) >= DATE(@startDate)
+      AND DATE(submission_timestamp) <= DATE(@endDate)
+      {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+      {% if segments %}AND segment is not null{% endif %}
+      AND normalized_channel = @channel
       AND {{histogram}} is not null
       AND ARRAY_LENGTH(ping_info.experiments) > 0
-      AND mozfun.map.get_key(ping_info.experiments, "{{slug}}").branch is not null
-      {% for isp in blacklist %}
-      AND metadata.isp.name != "{{isp}}"
-      {% endfor %}
+      AND mozfun.map.get_key(ping_info.experiments, @slug).branch is not null
+      AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
 )
 {% else %}
 android_data as (
   SELECT
     "" as segment,
+    {% if by_day %}CAST(NULL AS DATE) as day,{% endif %}
     "" as branch,
     0 as bucket,
     0 as count
@@ -63,28 +70,33 @@ android_data as (
   WHERE FALSE
 )
 {% endif %}
-{% if include_non_enrolled_branch == True %}
+{% else %}
 {% if available_on_desktop == True %}
-,desktop_data_non_enrolled as (
+desktop_data as (
     SELECT 
-        normalized_os as segment,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        {% if by_day %}DATE(submission_timestamp) as day,{% endif %}
         "non-enrolled" as branch,
         CAST(key as INT64)/1000000 AS bucket,
         value as count
     FROM `mozdata.firefox_desktop.metrics` as d
+    {% include "common/segments.sql" %}
       CROSS JOIN UNNEST({{histogram}}.values)
     WHERE
-      DATE(submission_timestamp) >= DATE('{{startDate}}')
-      AND DATE(submission_timestamp) <= DATE('{{endDate}}')
-      AND normalized_channel = "{{channel}}"
+      DATE(submission_timestamp) >= DATE(@startDate)
+      AND DATE(submission_timestamp) <= DATE(@endDate)
+      {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+      {% if segments %}AND segment is not null{% endif %}
+      AND normalized_channel = @channel
       AND normalized_app_name = "Firefox"
       AND {{histogram}} is not null
       AND ARRAY_LENGTH(ping_info.experiments) = 0
 ),
 {% else %}
-,desktop_data_non_enrolled as (
+desktop_data as (
   SELECT 
     "" as segment,
+    {% if by_day %}CAST(NULL AS DATE) as day,{% endif %}
     "" as branch,
     0 as bucket,
     0 as count
@@ -93,25 +105,30 @@ android_data as (
 ),
 {% endif %}
 {% if available_on_android == True %}
-android_data_non_enrolled as (
+android_data as (
     SELECT 
-        normalized_os as segment,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        {% if by_day %}DATE(submission_timestamp) as day,{% endif %}
         "non-enrolled" as branch,
         CAST(key as INT64)/1000000 AS bucket,
         value as count
     FROM `mozdata.fenix.metrics` as f
+    {% include "common/segments.sql" %}
       CROSS JOIN UNNEST({{histogram}}.values)
     WHERE
-      DATE(submission_timestamp) >= DATE('{{startDate}}')
-      AND DATE(submission_timestamp) <= DATE('{{endDate}}')
-      AND normalized_channel = "{{channel}}"
+      DATE(submission_timestamp) >= DATE(@startDate)
+      AND DATE(submission_timestamp) <= DATE(@endDate)
+      {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+      {% if segments %}AND segment is not null{% endif %}
+      AND normalized_channel = @channel
       AND {{histogram}} is not null
       AND ARRAY_LENGTH(ping_info.experiments) = 0
 )
 {% else %}
-android_data_non_enrolled as (
+android_data as (
   SELECT
     "" as segment,
+    {% if by_day %}CAST(NULL AS DATE) as day,{% endif %}
     "" as branch,
     0 as bucket,
     0 as count
@@ -123,6 +140,7 @@ android_data_non_enrolled as (
 
 SELECT
     segment,
+    {% if by_day %}day,{% endif %}
     branch,
     bucket,
     SUM(count) as counts
@@ -131,15 +149,9 @@ FROM
         SELECT * FROM desktop_data
         UNION ALL
         SELECT * FROM android_data
-{% if include_non_enrolled_branch == True %}
-        UNION ALL
-        SELECT * FROM desktop_data_non_enrolled
-        UNION ALL
-        SELECT * FROM android_data_non_enrolled
-{% endif %}
     ) s
 GROUP BY
-  segment, branch, bucket
+  segment, {% if by_day %}day, {% endif %}branch, bucket
 ORDER BY
-  segment, branch, bucket
+  segment, {% if by_day %}day, {% endif %}branch, bucket
 {% endautoescape %}
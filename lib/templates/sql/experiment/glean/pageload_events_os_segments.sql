@@ -1,104 +1,106 @@
 {% autoescape off %}
+{% if not non_enrolled %}
 with desktop_eventdata as (
 SELECT
-  normalized_os as segment,
-  mozfun.map.get_key(ping_info.experiments, "{{slug}}").branch as branch,
+  {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+  {% if by_day %}DATE(submission_timestamp) as day,{% endif %}
+  mozfun.map.get_key(ping_info.experiments, @slug).branch as branch,
   SAFE_CAST((SELECT value FROM UNNEST(event.extra) WHERE key = '{{metric}}') AS int) AS {{metric}},
 FROM
   `moz-fx-data-shared-prod.firefox_desktop.pageload` as d
+  {% include "common/segments.sql" %}
 CROSS JOIN
   UNNEST(events) AS event
 WHERE
-  normalized_channel = "{{channel}}"
-  AND DATE(submission_timestamp) >= DATE('{{startDate}}')
-  AND DATE(submission_timestamp) <= DATE('{{endDate}}')  
-  AND mozfun.map.get_key(ping_info.experiments, "{{slug}}").branch is not null
-  {% for isp in blacklist %}
-  AND metadata.isp.name != "{{isp}}"
-  {% endfor %}
+  normalized_channel = @channel
+  AND DATE(submission_timestamp) >= DATE(@startDate)
+  AND DATE(submission_timestamp) <= DATE(@endDate)
+  {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+  {% if segments %}AND segment is not null{% endif %}
+  AND mozfun.map.get_key(ping_info.experiments, @slug).branch is not null
+  AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
 )
-{% if include_non_enrolled_branch == True %}
-,
-desktop_eventdata_non_enrolled as (
+, android_eventdata as (
 SELECT
-  normalized_os as segment,
-  "non-enrolled" as branch,
+  {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+  {% if by_day %}DATE(submission_timestamp) as day,{% endif %}
+  mozfun.map.get_key(ping_info.experiments, @slug).branch as branch,
   SAFE_CAST((SELECT value FROM UNNEST(event.extra) WHERE key = '{{metric}}') AS int) AS {{metric}},
 FROM
-  `moz-fx-data-shared-prod.firefox_desktop.pageload`
+  `moz-fx-data-shared-prod.fenix.pageload` as f
+  {% include "common/segments.sql" %}
 CROSS JOIN
   UNNEST(events) AS event
 WHERE
-  normalized_channel = "{{channel}}"
-  AND DATE(submission_timestamp) >= DATE('{{startDate}}')
-  AND DATE(submission_timestamp) <= DATE('{{endDate}}')
-  AND ARRAY_LENGTH(ping_info.experiments) = 0
+  normalized_channel = @channel
+  AND DATE(submission_timestamp) >= DATE(@startDate)
+  AND DATE(submission_timestamp) <= DATE(@endDate)
+  {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+  {% if segments %}AND segment is not null{% endif %}
+  AND mozfun.map.get_key(ping_info.experiments, @slug).branch is not null
+  AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
 )
-{% endif %}
-, android_eventdata as (
+{% else %}
+with desktop_eventdata as (
 SELECT
-  normalized_os as segment,
-  mozfun.map.get_key(ping_info.experiments, "{{slug}}").branch as branch,
+  {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+  {% if by_day %}DATE(submission_timestamp) as day,{% endif %}
+  "non-enrolled" as branch,
   SAFE_CAST((SELECT value FROM UNNEST(event.extra) WHERE key = '{{metric}}') AS int) AS {{metric}},
 FROM
-  `moz-fx-data-shared-prod.fenix.pageload` as f
+  `moz-fx-data-shared-prod.firefox_desktop.pageload`
+  {% include "common/segments.sql" %}
 CROSS JOIN
   UNNEST(events) AS event
 WHERE
-  normalized_channel = "{{channel}}"
-  AND DATE(submission_timestamp) >= DATE('{{startDate}}')
-  AND DATE(submission_timestamp) <= DATE('{{endDate}}')  
-  AND mozfun.map.get_key(ping_info.experiments, "{{slug}}").branch is not null
-  {% for isp in blacklist %}
-  AND metadata.isp.name != "{{isp}}"
-  {% endfor %}
+  normalized_channel = @channel
+  AND DATE(submission_timestamp) >= DATE(@startDate)
+  AND DATE(submission_timestamp) <= DATE(@endDate)
+  {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+  {% if segments %}AND segment is not null{% endif %}
+  AND ARRAY_LENGTH(ping_info.experiments) = 0
 )
-{% if include_non_enrolled_branch == True %}
-,
-android_eventdata_non_enrolled as (
+, android_eventdata as (
 SELECT
-  normalized_os as segment,
+  {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+  {% if by_day %}DATE(submission_timestamp) as day,{% endif %}
   "non-enrolled" as branch,
   SAFE_CAST((SELECT value FROM UNNEST(event.extra) WHERE key = '{{metric}}') AS int) AS {{metric}},
 FROM
   `moz-fx-data-shared-prod.fenix.pageload`
+  {% include "common/segments.sql" %}
 CROSS JOIN
   UNNEST(events) AS event
 WHERE
-  normalized_channel = "{{channel}}"
-  AND DATE(submission_timestamp) >= DATE('{{startDate}}')
-  AND DATE(submission_timestamp) <= DATE('{{endDate}}')
+  normalized_channel = @channel
+  AND DATE(submission_timestamp) >= DATE(@startDate)
+  AND DATE(submission_timestamp) <= DATE(@endDate)
+  {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+  {% if segments %}AND segment is not null{% endif %}
   AND ARRAY_LENGTH(ping_info.experiments) = 0
 )
 {% endif %}
 
 SELECT
   segment,
+  {% if by_day %}day,{% endif %}
   branch,
+{% if log_buckets %}
+  ROUND(POW(2, (FLOOR(LN({{metric}} + 1) / LN(2) * @logBuckets) + 0.5) / @logBuckets) - 1, 2) as bucket,
+{% else %}
   {{metric}} as bucket,
+{% endif %}
   COUNT(*) as counts
 FROM
-{% if include_non_enrolled_branch == True %}
-  (
-    SELECT * from desktop_eventdata
-    UNION ALL
-    SELECT * from desktop_eventdata_non_enrolled
-    UNION ALL
-    SELECT * from android_eventdata
-    UNION ALL
-    SELECT * from android_eventdata_non_enrolled
-  )
-{% else %}
   (
     SELECT * from desktop_eventdata
     UNION ALL
     SELECT * from android_eventdata
   )
-{% endif %}
 WHERE
-  {{metric}} >= {{minVal}} AND {{metric}} <= {{maxVal}}
+  {{metric}} >= @minVal AND {{metric}} <= @maxVal
 GROUP BY
-  segment, branch, bucket
+  segment, {% if by_day %}day, {% endif %}branch, bucket
 ORDER BY
-  segment, branch, bucket
+  segment, {% if by_day %}day, {% endif %}branch, bucket
 {% endautoescape %}
@@ -0,0 +1,77 @@
+{% autoescape off %}
+with desktop_eventdata as (
+SELECT
+  {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+  mozfun.map.get_key(ping_info.experiments, @slug).branch as branch,
+  extra.key as metric,
+  SAFE_CAST(extra.value AS int) AS value,
+FROM
+  `moz-fx-data-shared-prod.firefox_desktop.pageload` as d
+  {% include "common/segments.sql" %}
+CROSS JOIN
+  UNNEST(events) AS event
+CROSS JOIN
+  UNNEST(event.extra) AS extra
+WHERE
+  normalized_channel = @channel
+  AND DATE(submission_timestamp) >= DATE(@startDate)
+  AND DATE(submission_timestamp) <= DATE(@endDate)
+  {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+  {% if segments %}AND segment is not null{% endif %}
+  AND mozfun.map.get_key(ping_info.experiments, @slug).branch is not null
+  AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
+  AND extra.key IN UNNEST(@metrics)
+)
+, android_eventdata as (
+SELECT
+  {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+  mozfun.map.get_key(ping_info.experiments, @slug).branch as branch,
+  extra.key as metric,
+  SAFE_CAST(extra.value AS int) AS value,
+FROM
+  `moz-fx-data-shared-prod.fenix.pageload` as f
+  {% include "common/segments.sql" %}
+CROSS JOIN
+  UNNEST(events) AS event
+CROSS JOIN
+  UNNEST(event.extra) AS extra
+WHERE
+  normalized_channel = @channel
+  AND DATE(submission_timestamp) >= DATE(@startDate)
+  AND DATE(submission_timestamp) <= DATE(@endDate)
+  {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+  {% if segments %}AND segment is not null{% endif %}
+  AND mozfun.map.get_key(ping_info.experiments, @slug).branch is not null
+  AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
+  AND extra.key IN UNNEST(@metrics)
+)
+
+SELECT
+  segment,
+  branch,
+  metric,
+  CASE metric
+{% for m in metrics %}
+{% if m.log_buckets %}
+    WHEN '{{m.name}}' THEN ROUND(POW(2, (FLOOR(LN(value + 1) / LN(2) * @logBuckets_{{m.index}}) + 0.5) / @logBuckets_{{m.index}}) - 1, 2)
+{% else %}
+    WHEN '{{m.name}}' THEN value
+{% endif %}
+{% endfor %}
+  END as bucket,
+  COUNT(*) as counts
+FROM
+  (
+    SELECT * from desktop_eventdata
+    UNION ALL
+    SELECT * from android_eventdata
+  )
+WHERE
+{% for m in metrics %}
+  {% if not forloop.first %}OR {% endif %}(metric = '{{m.name}}' AND value >= @minVal_{{m.index}} AND value <= @maxVal_{{m.index}})
+{% endfor %}
+GROUP BY
+  segment, branch, metric, bucket
+ORDER BY
+  segment, branch, metric, bucket
+{% endautoescape %}
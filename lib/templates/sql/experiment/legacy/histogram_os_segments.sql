@@ -1,27 +1,30 @@
 {% autoescape off %}
 with json_strings as (
     SELECT 
-        normalized_os as segment,
-        mozfun.map.get_key(environment.experiments, "{{slug}}").branch as branch,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        {% if by_day %}DATE(submission_timestamp) as day,{% endif %}
+        mozfun.map.get_key(environment.experiments, @slug).branch as branch,
         JSON_EXTRACT({{histogram}}, '$.values') as hist
     FROM
       `moz-fx-data-shared-prod.telemetry.main`
+      {% include "common/segments.sql" %}
     WHERE
-        DATE(submission_timestamp) >= DATE('{{startDate}}')
-        AND DATE(submission_timestamp) <= DATE('{{endDate}}')
-        AND normalized_channel = "{{channel}}"
+        DATE(submission_timestamp) >= DATE(@startDate)
+        AND DATE(submission_timestamp) <= DATE(@endDate)
+        {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+        {% if segments %}AND segment is not null{% endif %}
+        AND normalized_channel = @channel
         AND normalized_app_name = "Firefox"
         AND {{histogram}} is not null
         AND payload.processes.parent.scalars.browser_engagement_total_uri_count > 0
-        AND mozfun.map.get_key(environment.experiments, "{{slug}}").branch is not null
-        {% for isp in blacklist %}
-        AND metadata.isp.name != "{{isp}}"
-        {% endfor %}
+        AND mozfun.map.get_key(environment.experiments, @slug).branch is not null
+        AND (ARRAY_LENGTH(@blacklist) = 0 OR metadata.isp.name NOT IN UNNEST(@blacklist))
 )
 ,
 keyValuePairs as (
 SELECT
     segment,
+    {% if by_day %}day,{% endif %}
     branch,
     SAFE_CAST(key AS float64) as bucket,
     INT64(PARSE_JSON(hist)[key]) as count
@@ -33,15 +36,19 @@ FROM
 ,
 json_strings_null as (
     SELECT
-        normalized_os as segment,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        {% if by_day %}DATE(submission_timestamp) as day,{% endif %}
         "null" as branch,
         JSON_EXTRACT({{histogram}}, '$.values') as hist
     FROM
       `moz-fx-data-shared-prod.telemetry.main`
+      {% include "common/segments.sql" %}
     WHERE
-        DATE(submission_timestamp) >= DATE('{{startDate}}')
-        AND DATE(submission_timestamp) <= DATE('{{endDate}}')
-        AND normalized_channel = "{{channel}}"
+        DATE(submission_timestamp) >= DATE(@startDate)
+        AND DATE(submission_timestamp) <= DATE(@endDate)
+        {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+        {% if segments %}AND segment is not null{% endif %}
+        AND normalized_channel = @channel
         AND normalized_app_name = "Firefox"
         AND {{histogram}} is not null
         AND payload.processes.parent.scalars.browser_engagement_total_uri_count > 0
@@ -51,6 +58,7 @@ json_strings_null as (
 keyValuePairs_null as (
 SELECT
     segment,
+    {% if by_day %}day,{% endif %}
     branch,
     SAFE_CAST(key AS float64) as bucket,
     INT64(PARSE_JSON(hist)[key]) as count
@@ -61,6 +69,7 @@ FROM
 {% endif %}
 SELECT
     segment,
+    {% if by_day %}day,{% endif %}
     branch,
     bucket,
     SUM(count) as counts
@@ -75,7 +84,7 @@ FROM
     keyValuePairs
 {% endif %}
 GROUP BY
-   segment, branch, bucket
+   segment, {% if by_day %}day, {% endif %}branch, bucket
 ORDER BY
-   segment, branch, bucket
+   segment, {% if by_day %}day, {% endif %}branch, bucket
 {% endautoescape %}
@@ -1,55 +1,55 @@
 {% autoescape off %}
 with 
-{% for branch in branches %}
-{{branch.name}}_desktop as (
+{% if available_on_desktop == True %}
+desktop_data as (
     SELECT
-        normalized_os as segment,
-        "{{branch.name}}" as branch,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        branch,
         CAST(key as INT64)/1000000 AS bucket,
         value as count
     FROM `mozdata.firefox_desktop.metrics` as d
+    {% include "common/segments.sql" %}
+        CROSS JOIN UNNEST([
+{% for branch in branches %}
+            CASE WHEN {{branch.condition}} THEN @{{branch.param}} END{% if not forloop.last %},{% endif %}
+{% endfor %}
+        ]) AS branch
         CROSS JOIN UNNEST({{histogram}}.values)
     WHERE 
-        DATE(submission_timestamp) >= DATE('{{branch.startDate}}')
-        AND DATE(submission_timestamp) <= DATE('{{branch.endDate}}')    
-        AND normalized_channel = "{{branch.channel}}"
+        ({{scan_condition}})
+        {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+        {% if segments %}AND segment is not null{% endif %}
         AND normalized_app_name = "Firefox"
         AND {{histogram}} is not null
-        {{branch.ver_condition}}
-        {{branch.arch_condition}}
-{% for condition in branch.glean_conditions %}
-        {{condition}}
-{% endfor %}
-        {% for isp in blacklist %}
-        AND metadata.isp.name != "{{isp}}"
-        {% endfor %}
-),
-{{branch.name}}_android as (
+        AND branch is not null
+)
+{% endif %}
+{% if available_on_desktop == True and available_on_android == True %}
+,
+{% endif %}
+{% if available_on_android == True %}
+android_data as (
     SELECT
-        normalized_os as segment,
-        "{{branch.name}}" as branch,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        branch,
         CAST(key as INT64)/1000000 AS bucket,
         value as count
     FROM `mozdata.fenix.metrics` as f
+    {% include "common/segments.sql" %}
+        CROSS JOIN UNNEST([
+{% for branch in branches %}
+            CASE WHEN {{branch.condition}} THEN @{{branch.param}} END{% if not forloop.last %},{% endif %}
+{% endfor %}
+        ]) AS branch
         CROSS JOIN UNNEST({{histogram}}.values)
     WHERE 
-        DATE(submission_timestamp) >= DATE('{{branch.startDate}}')
-        AND DATE(submission_timestamp) <= DATE('{{branch.endDate}}')    
-        AND normalized_channel = "{{branch.channel}}"
+        ({{scan_condition}})
+        {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+        {% if segments %}AND segment is not null{% endif %}
         AND {{histogram}} is not null
-        {{branch.ver_condition}}
-        {{branch.arch_condition}}
-{% for condition in branch.glean_conditions %}
-        {{condition}}
-{% endfor %}
-        {% for isp in blacklist %}
-        AND metadata.isp.name != "{{isp}}"
-        {% endfor %}
+        AND branch is not null
 )
-{% if branch.last == False %}
-,
 {% endif %}
-{% endfor %}
 
 SELECT 
     segment,
@@ -58,14 +58,15 @@ SELECT
     SUM(count) as counts
 FROM
     (
-{% for branch in branches %}
-        SELECT * FROM {{branch.name}}_android
-        UNION ALL
-        SELECT * FROM {{branch.name}}_desktop
-{% if branch.last == False %}
+{% if available_on_desktop == True %}
+        SELECT * FROM desktop_data
+{% endif %}
+{% if available_on_desktop == True and available_on_android == True %}
         UNION ALL
 {% endif %}
-{% endfor %}
+{% if available_on_android == True %}
+        SELECT * FROM android_data
+{% endif %}
     ) s
 GROUP BY
   segment, branch, bucket
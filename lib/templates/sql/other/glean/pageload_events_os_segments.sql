@@ -1,100 +1,68 @@
 {% autoescape off %}
 with 
-{% for branch in branches %}
-eventdata_{{branch.name}}_desktop as (
+eventdata_desktop as (
     SELECT
-        normalized_os as segment,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        branch,
         SAFE_CAST((SELECT value FROM UNNEST(event.extra) WHERE key = '{{metric}}') AS int) AS {{metric}},
     FROM
         `moz-fx-data-shared-prod.firefox_desktop.pageload` as m
+        {% include "common/segments.sql" %}
+    CROSS JOIN UNNEST([
+{% for branch in branches %}
+        CASE WHEN {{branch.condition}} THEN @{{branch.param}} END{% if not forloop.last %},{% endif %}
+{% endfor %}
+    ]) AS branch
     CROSS JOIN
       UNNEST(events) AS event
     WHERE
-        DATE(submission_timestamp) >= DATE('{{branch.startDate}}')
-        AND DATE(submission_timestamp) <= DATE('{{branch.endDate}}')
-        AND normalized_channel = "{{branch.channel}}"
+        ({{scan_condition}})
+        {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+        {% if segments %}AND segment is not null{% endif %}
         AND normalized_app_name = "Firefox"
-        {{branch.ver_condition}}
-        {{branch.arch_condition}}
-{% for condition in branch.glean_conditions %}
-        {{condition}}
-{% endfor %}
-        {% for isp in blacklist %}
-        AND metadata.isp.name != "{{isp}}"
-        {% endfor %}
+        AND branch is not null
 ),
-eventdata_{{branch.name}}_android as (
+eventdata_android as (
     SELECT
-        normalized_os as segment,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        branch,
         SAFE_CAST((SELECT value FROM UNNEST(event.extra) WHERE key = '{{metric}}') AS int) AS {{metric}},
     FROM
         `moz-fx-data-shared-prod.fenix.pageload` as m
+        {% include "common/segments.sql" %}
+    CROSS JOIN UNNEST([
+{% for branch in branches %}
+        CASE WHEN {{branch.condition}} THEN @{{branch.param}} END{% if not forloop.last %},{% endif %}
+{% endfor %}
+    ]) AS branch
     CROSS JOIN
       UNNEST(events) AS event
     WHERE
-        DATE(submission_timestamp) >= DATE('{{branch.startDate}}')
-        AND DATE(submission_timestamp) <= DATE('{{branch.endDate}}')
-        AND normalized_channel = "{{branch.channel}}"
-        {{branch.ver_condition}}
-        {{branch.arch_condition}}
-{% for condition in branch.glean_conditions %}
-        {{condition}}
-{% endfor %}
-        {% for isp in blacklist %}
-        AND metadata.isp.name != "{{isp}}"
-        {% endfor %}
-),
-aggregate_{{branch.name}}_desktop as (
-SELECT
-    segment,
-    "{{branch.name}}" as branch,
-    {{metric}} as bucket,
-    COUNT(*) as counts
-FROM
-    eventdata_{{branch.name}}_desktop
-WHERE
-    {{metric}} > {{minVal}} AND {{metric}} < {{maxVal}}
-GROUP BY
-    segment, branch, bucket
-ORDER BY
-    segment, branch, bucket
-),
-aggregate_{{branch.name}}_android as (
-SELECT
-    segment,
-    "{{branch.name}}" as branch,
-    {{metric}} as bucket,
-    COUNT(*) as counts
-FROM
-    eventdata_{{branch.name}}_android
-WHERE
-    {{metric}} > {{minVal}} AND {{metric}} < {{maxVal}}
-GROUP BY
-    segment, branch, bucket
-ORDER BY
-    segment, branch, bucket
+        ({{scan_condition}})
+        {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+        {% if segments %}AND segment is not null{% endif %}
+        AND branch is not null
 )
-{% if branch.last == False %}
-,
-{% endif %}
-{% endfor %}
 
 SELECT
     segment,
     branch,
-    bucket,
-    counts
+{% if log_buckets %}
+    ROUND(POW(2, (FLOOR(LN({{metric}} + 1) / LN(2) * @logBuckets) + 0.5) / @logBuckets) - 1, 2) as bucket,
+{% else %}
+    {{metric}} as bucket,
+{% endif %}
+    COUNT(*) as counts
 FROM
     (
-{% for branch in branches %}
-        SELECT * FROM aggregate_{{branch.name}}_desktop
-        UNION ALL
-        SELECT * FROM aggregate_{{branch.name}}_android
-{% if branch.last == False %}
+        SELECT * FROM eventdata_desktop
         UNION ALL
-{% endif %}
-{% endfor %}
+        SELECT * FROM eventdata_android
     )
+WHERE
+    {{metric}} > @minVal AND {{metric}} < @maxVal
+GROUP BY
+    segment, branch, bucket
 ORDER BY
     segment, branch, bucket
 {% endautoescape %}
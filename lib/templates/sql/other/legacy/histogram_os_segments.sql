@@ -1,70 +1,45 @@
 {% autoescape off %}
-with 
-{% for branch in branches %}
-{{branch.name}} as (
+with json_strings as (
     SELECT
-        normalized_os as segment,
-        "{{branch.name}}" as branch,
+        {% if segments %}segment,{% else %}normalized_os as segment,{% endif %}
+        branch,
         JSON_EXTRACT({{histogram}}, '$.values') as hist
     FROM
         `moz-fx-data-shared-prod.telemetry.main`
+        {% include "common/segments.sql" %}
+    CROSS JOIN UNNEST([
+{% for branch in branches %}
+        CASE WHEN {{branch.condition}} THEN @{{branch.param}} END{% if not forloop.last %},{% endif %}
+{% endfor %}
+    ]) AS branch
     WHERE
-        DATE(submission_timestamp) >= DATE('{{branch.startDate}}')
-        AND DATE(submission_timestamp) <= DATE('{{branch.endDate}}')    
-        AND normalized_channel = "{{branch.channel}}"
+        ({{scan_condition}})
+        {% if sample %}AND sample_id >= @sampleMin AND sample_id < @sampleMax{% endif %}
+        {% if segments %}AND segment is not null{% endif %}
         AND normalized_app_name = "Firefox"
         AND {{histogram}} is not null
-        {{branch.ver_condition}}
-        {{branch.arch_condition}}
-{% for condition in branch.legacy_conditions %}
-        {{condition}}
-{% endfor %}
-        {% for isp in blacklist %}
-        AND metadata.isp.name != "{{isp}}"
-        {% endfor %}
+        AND branch is not null
 ),
-bucketCounts_{{branch.name}} as (
+bucketCounts as (
 SELECT
     segment,
     branch,
     SAFE_CAST(key AS float64) as bucket,
     INT64(PARSE_JSON(hist)[key]) as count
 FROM
-    {{branch.name}},
+    json_strings,
     UNNEST(bqutil.fn.json_extract_keys(hist)) as key
-),
-histogram_{{branch.name}} as (
-SELECT
-    segment,
-    branch,
-    bucket,
-    SUM(count) as counts
-FROM
-    bucketCounts_{{branch.name}}
-GROUP BY
-   segment, branch, bucket
-ORDER BY
-    segment, branch, bucket
 )
-{% if branch.last == False %}
-,
-{% endif %}
-{% endfor %}
 
 SELECT 
     segment,
     branch,
     bucket,
-    counts
+    SUM(count) as counts
 FROM
-    (
-{% for branch in branches %}
-        SELECT * FROM histogram_{{branch.name}}
-{% if branch.last == False %}
-        UNION ALL
-{% endif %}
-{% endfor %}
-    ) s
+    bucketCounts
+GROUP BY
+   segment, branch, bucket
 ORDER BY 
     segment, branch, bucket
 {% endautoescape %}
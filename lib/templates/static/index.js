@@ -0,0 +1,163 @@
+// The index loads the list of reports from a file with one json record per
+// line, and renders it a page at a time.
+const PAGE_SIZE = 50;
+
+// Later records of the same report replace earlier ones.
+function parseReports(text) {
+  const reports = new Map();
+  for (const line of text.split("\n")) {
+    if (line.trim()) {
+      const report = JSON.parse(line);
+      reports.set(report.slug, report);
+    }
+  }
+  return Array.from(reports.values());
+}
+
+function addCell(row, text, rowSpan) {
+  const cell = document.createElement("td");
+  cell.textContent = text;
+  if (rowSpan) {
+    cell.rowSpan = rowSpan;
+  }
+  row.appendChild(cell);
+  return cell;
+}
+
+function addLinkCell(row, report, rowSpan) {
+  const link = document.createElement("a");
+  link.href = report.slug + ".html";
+  link.textContent = report.slug;
+  addCell(row, "", rowSpan).appendChild(link);
+}
+
+function experimentRows(report) {
+  const row = document.createElement("tr");
+  addLinkCell(row, report);
+  addCell(row, report.startDate);
+  addCell(row, report.endDate);
+  addCell(row, report.channel);
+  return [row];
+}
+
+// Non-experiment reports have a row per branch.
+function otherRows(report) {
+  return report.branches.map((branch, i) => {
+    const row = document.createElement("tr");
+    if (i == 0) {
+      addLinkCell(row, report, report.branches.length);
+    }
+    addCell(row, branch.name);
+    addCell(row, branch.startDate);
+    addCell(row, branch.endDate);
+    addCell(row, branch.channel);
+    return row;
+  });
+}
+
+function searchText(report) {
+  const fields = [report.slug, report.channel || ""];
+  for (const branch of report.branches || []) {
+    fields.push(branch.name, branch.channel);
+  }
+  return fields.join(" ").toLowerCase();
+}
+
+class ReportTable {
+  constructor(name, reports, createRows) {
+    this.table = document.getElementById(name + "-table");
+    this.pager = document.getElementById(name + "-pager");
+    this.reports = reports;
+    this.createRows = createRows;
+    this.query = "";
+    this.sortKey = "endDate";
+    this.ascending = false;
+    this.page = 0;
+
+    for (const header of this.table.querySelectorAll("th[data-key]")) {
+      header.addEventListener("click", () => this.sortBy(header.dataset.key));
+    }
+  }
+
+  sortBy(key) {
+    this.ascending = key == this.sortKey ? !this.ascending : true;
+    this.sortKey = key;
+    this.page = 0;
+    this.render();
+  }
+
+  search(query) {
+    this.query = query.toLowerCase();
+    this.page = 0;
+    this.render();
+  }
+
+  selected() {
+    const reports = this.reports.filter(report => searchText(report).includes(this.query));
+    const order = this.ascending ? 1 : -1;
+    reports.sort((a, b) => order * String(a[this.sortKey]).localeCompare(String(b[this.sortKey])));
+    return reports;
+  }
+
+  render() {
+    const reports = this.selected();
+    const pages = Math.max(1, Math.ceil(reports.length / PAGE_SIZE));
+    this.page = Math.min(this.page, pages - 1);
+
+    // Each report gets its own tbody, so its rows are styled together.
+    for (const body of this.table.querySelectorAll("tbody")) {
+      body.remove();
+    }
+    for (const report of reports.slice(this.page * PAGE_SIZE, (this.page + 1) * PAGE_SIZE)) {
+      const body = document.createElement("tbody");
+      for (const row of this.createRows(report)) {
+        body.appendChild(row);
+      }
+      this.table.appendChild(body);
+    }
+
+    for (const header of this.table.querySelectorAll("th[data-key]")) {
+      if (header.dataset.key == this.sortKey) {
+        header.dataset.sort = this.ascending ? "▲" : "▼";
+      } else {
+        delete header.dataset.sort;
+      }
+    }
+    this.renderPager(reports.length, pages);
+  }
+
+  renderPager(count, pages) {
+    this.pager.replaceChildren();
+    const addButton = (label, page) => {
+      const button = document.createElement("button");
+      button.textContent = label;
+      button.disabled = page < 0 || page >= pages;
+      button.addEventListener("click", () => {
+        this.page = page;
+        this.render();
+      });
+      this.pager.appendChild(button);
+    };
+    addButton("Previous", this.page - 1);
+    this.pager.appendChild(document.createTextNode(
+      ` Page ${this.page + 1} of ${pages} (${count} reports) `));
+    addButton("Next", this.page + 1);
+  }
+}
+
+// The data file is revalidated on every load, since appending a report
+// changes it without changing the index page.
+function showIndex(url) {
+  fetch(url, { cache: "no-cache" })
+    .then(response => response.text())
+    .then(text => {
+      const reports = parseReports(text);
+      const tables = [
+        new ReportTable("experiment", reports.filter(report => report.is_experiment), experimentRows),
+        new ReportTable("other", reports.filter(report => !report.is_experiment), otherRows)
+      ];
+      const search = document.getElementById("search");
+      search.addEventListener("input", () => tables.forEach(table => table.search(search.value)));
+      tables.forEach(table => table.render());
+    });
+}
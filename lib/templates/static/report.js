@@ -0,0 +1,19 @@
+Chart.register(ChartDataLabels);
+Chart.defaults.font.size = 14;
+Chart.defaults.color = '#000000';
+zoomOptions = {
+    pan: {
+        enabled: true,
+        mode: 'xy',
+        modifierKey: 'ctrl',
+    },
+    zoom: {
+        mode: 'xy',
+        drag: {
+            enabled: true,
+            borderColor: 'rgb(54, 162, 235)',
+            borderWidth: 1,
+            backgroundColor: 'rgba(54, 162, 235, 0.3)'
+          }
+      }
+  };
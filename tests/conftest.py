@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The probes used by the test configs, in the format of lib/probe-index.json.
+PROBE_INDEX = {
+  "glean": {
+    "perf_page_load": {
+      "type": "event", "description": "Pageload events", "repos": ["gecko"],
+      "extra_keys": {"fcp_time": {"description": "First contentful paint"}}
+    },
+    "performance_pageload_fcp": {
+      "type": "timing_distribution", "description": "First contentful paint", "repos": ["gecko"]
+    }
+  },
+  "legacy": {},
+  "sources": {}
+}
+
+# Columns shared by the metrics and pageload tables.  Every row is on
+# nightly, and alternates between the two versions and the three OSes, and
+# between the two branches of the duckdb-exp experiment.
+COMMON_COLUMNS = """
+  TIMESTAMP '2024-01-22' + to_days(CAST(i % 60 AS INTEGER)) AS submission_timestamp,
+  {os} AS normalized_os,
+  'nightly' AS normalized_channel,
+  'Firefox' AS normalized_app_name,
+  CAST(i % 100 AS BIGINT) AS sample_id,
+  {{'app_display_version': ['124.0', '125.0'][1 + (i // 7) % 2], 'architecture': 'x86_64'}} AS client_info,
+  {{'experiments': [{{'key': 'duckdb-exp', 'value': {{'branch': ['control', 'treatment'][1 + (i // 5) % 2],
+    'extra': NULL::VARCHAR}}}}]}} AS ping_info,
+  {{'isp': {{'name': 'isp'}}}} AS metadata,
+"""
+
+def writeTable(con, parquetDir, table, columns, rows):
+  tableDir = os.path.join(parquetDir, table)
+  os.makedirs(tableDir)
+  con.execute(f"COPY (SELECT {columns} FROM range({rows}) t(i)) "
+              f"TO '{tableDir}/part-0.parquet' (FORMAT parquet)")
+
+# A few thousand rows of desktop and android metrics and pageload events.
+@pytest.fixture(scope="session")
+def parquetDir(tmp_path_factory):
+  duckdb = pytest.importorskip("duckdb")
+  parquetDir = str(tmp_path_factory.mktemp("parquet"))
+  con = duckdb.connect()
+  for app, os_expr in [("firefox_desktop", "['Windows', 'Mac', 'Linux'][1 + i % 3]"), ("fenix", "'Android'")]:
+    common = COMMON_COLUMNS.format(os=os_expr)
+    writeTable(con, parquetDir, f"mozdata.{app}.metrics", common + """
+      {'timing_distribution': {'performance_pageload_fcp': {'values': list_transform(range(3), j -> {
+        'key': CAST(CAST(pow(1.09, (i * 7 + j + (i % 2) * 3) % 100) AS BIGINT) * 1000000 AS VARCHAR),
+        'value': CAST(1 + (i + j) % 5 AS BIGINT)})}}} AS metrics""", 3000)
+    writeTable(con, parquetDir, f"moz-fx-data-shared-prod.{app}.pageload", common + """
+      [{'category': 'perf', 'name': 'page_load', 'extra': [
+        {'key': 'fcp_time', 'value': CAST((i * 37) % 4000 + (i % 2) * 50 AS VARCHAR)}]}] AS events""", 3000)
+  con.close()
+  return parquetDir
+
+@pytest.fixture
+def probeIndex(monkeypatch):
+  import lib.parser
+  monkeypatch.setattr(lib.parser, "loadProbeIndex", lambda: PROBE_INDEX)
+  return PROBE_INDEX
+
+# Writes a config to a file, and returns its name.
+@pytest.fixture
+def writeConfig(tmp_path):
+  def write(config):
+    filename = tmp_path / f"{config['slug']}.json"
+    filename.write_text(json.dumps(config))
+    return str(filename)
+  return write
+
+@pytest.fixture
+def nonExperimentConfigData():
+  return {
+    "slug": "duckdb-test",
+    "histograms": ["metrics.timing_distribution.performance_pageload_fcp"],
+    "pageload_event_metrics": {"fcp_time": [0, 5000]},
+    "segments": ["All", "Windows", "Linux", "Mac"],
+    "branches": [
+      {"name": "Firefox124", "startDate": "2024-01-22", "endDate": "2024-02-29", "channel": "nightly", "version": 124},
+      {"name": "Firefox125", "startDate": "2024-02-19", "endDate": "2024-03-05", "channel": "nightly", "version": 125}
+    ]
+  }
+
+@pytest.fixture
+def nonExperimentConfig(writeConfig, nonExperimentConfigData):
+  return writeConfig(nonExperimentConfigData)
+
+# Builds the arguments of generate-perf-report, with its defaults.
+@pytest.fixture
+def reportArgs(tmp_path):
+  def build(config, **kwargs):
+    args = {
+      "config": config,
+      "dataDir": str(tmp_path / "data"),
+      "reportDir": str(tmp_path / "reports"),
+      "skip_cache": False,
+      "backend": "bigquery",
+      "parquetDir": None,
+      "shard_days": None,
+      "jobs": 4,
+      "render_jobs": 1,
+      "preview": False,
+      "stream": False,
+      "trace": False,
+      "html_report": True
+    }
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+  return build
+
+# An experiment config, with the Nimbus API of the experiment already cached
+# in the data directory of the duckdb backend.
+@pytest.fixture
+def experimentConfig(writeConfig, tmp_path):
+  dataDir = tmp_path / "data" / "duckdb" / "duckdb-exp"
+  os.makedirs(dataDir)
+  with open(dataDir / "duckdb-exp-nimbus-API.json", 'w') as f:
+    json.dump({"startDate": "2024-01-22", "endDate": "2024-03-05", "channel": "nightly", "isRollout": False,
+               "branches": [{"slug": "control"}, {"slug": "treatment"}]}, f)
+  return writeConfig({
+    "slug": "duckdb-exp",
+    "histograms": ["metrics.timing_distribution.performance_pageload_fcp"],
+    "pageload_event_metrics": {"fcp_time": [0, 5000]},
+    "segments": ["All", "Windows", "Linux", "Mac"]
+  })
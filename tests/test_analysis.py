@@ -0,0 +1,198 @@
+import copy
+import numpy as np
+from scipy import stats
+from lib.analysis import (DataAnalyzer, align_categorical_counts, bootstrap_histogram, calc_categorical_tests,
+                          calc_chi_square, calculate_bootstrap_intervals, holm_correction, rebin_histogram)
+
+DAYS = ["2024-01-22", "2024-01-23", "2024-01-24"]
+
+def dailyConfig(**metric):
+  return {
+    "branches": ["control", "treatment"],
+    "segments": ["All"],
+    "histograms": {},
+    "pageload_event_metrics": {"fcp_time": {"min": 0, "max": 5000} | metric}
+  }
+
+def dailyData():
+  daily = {}
+  for i, day in enumerate(DAYS):
+    daily[day] = {}
+    for branch in ["control", "treatment"]:
+      data = {"bins": [100, 200, 400], "counts": [10 + i, 20, 5]}
+      daily[day][branch] = {"All": {"histograms": {}, "pageload_event_metrics": {"fcp_time": data}}}
+  return daily
+
+def dailyMeans(results, branch="control"):
+  return [entry["mean"] for entry in results[branch]["All"]["pageload_event_metrics"]["fcp_time"]["daily"]]
+
+# Complete days of the previous results are reused, as long as they were
+# computed with the same config.
+def test_daily_results_reused_with_same_config(tmp_path):
+  analyzer = DataAnalyzer(dailyConfig())
+  analyzer.processDailyData(dailyData())
+  previous = copy.deepcopy(analyzer.results) | {"endDate": DAYS[-1]}
+  for entry in previous["control"]["All"]["pageload_event_metrics"]["fcp_time"]["daily"]:
+    entry["mean"] = -1
+
+  analyzer = DataAnalyzer(dailyConfig(), previous)
+  analyzer.processDailyData(dailyData())
+  means = dailyMeans(analyzer.results)
+  assert means[:-1] == [-1, -1]
+  assert means[-1] != -1
+
+  blacklist = tmp_path / "blacklist.txt"
+  blacklist.write_text("isp\n")
+  changed = [
+    dailyConfig(max=2000),
+    dailyConfig(log_buckets=8),
+    dailyConfig() | {"segments": ["All", "Windows"]},
+    dailyConfig() | {"isp_blacklist": str(blacklist)}
+  ]
+  for config in changed:
+    daily = dailyData()
+    for day in daily.values():
+      for branch in day.values():
+        branch["Windows"] = branch["All"]
+    analyzer = DataAnalyzer(config, previous)
+    analyzer.processDailyData(daily)
+    assert -1 not in dailyMeans(analyzer.results)
+
+def test_daily_results_not_reused_without_config_hash():
+  analyzer = DataAnalyzer(dailyConfig())
+  analyzer.processDailyData(dailyData())
+  previous = copy.deepcopy(analyzer.results) | {"endDate": DAYS[-1]}
+  del previous["daily_config"]
+  for entry in previous["control"]["All"]["pageload_event_metrics"]["fcp_time"]["daily"]:
+    entry["mean"] = -1
+
+  analyzer = DataAnalyzer(dailyConfig(), previous)
+  analyzer.processDailyData(dailyData())
+  assert -1 not in dailyMeans(analyzer.results)
+
+def bootstrapConfig(**options):
+  return dailyConfig() | options
+
+def test_rebin_histogram():
+  rng = np.random.default_rng(1)
+  bins = np.arange(5000)*2.0
+  counts = rng.integers(0, 50, size=len(bins))
+  bin_counts, means, lo, hi = rebin_histogram(bins[::-1], counts[::-1], max_bins=100)
+
+  assert bin_counts.sum() == counts.sum()
+  assert len(bin_counts) <= 100
+  # Each bin holds about 1/100th of the samples, give or take a bucket.
+  assert np.all(np.abs(bin_counts-counts.sum()/100) <= counts.max())
+  assert np.all((lo <= means) & (means <= hi))
+  assert np.all(lo[1:] > hi[:-1])
+  assert np.isclose(bin_counts @ means, counts @ bins)
+
+  # Small histograms are only sorted.
+  bin_counts, means, lo, hi = rebin_histogram([3, 1, 2], [30, 10, 20])
+  assert list(bin_counts) == [10, 20, 30]
+  assert list(means) == list(lo) == list(hi) == [1, 2, 3]
+
+def test_bootstrap_disabled():
+  assert bootstrap_histogram([1, 2], [10, 10], [0.5], 0, np.random.default_rng(0)) == (None, None)
+
+  analyzer = DataAnalyzer(bootstrapConfig(bootstrap_resamples=0))
+  result = {}
+  analyzer.processBootstrap([1, 2, 3], [10, 20, 30], result, "control", "All", "fcp_time")
+  assert result == {}
+
+def bootstrapIntervals(seed, bins, counts, branch="control", control=None):
+  analyzer = DataAnalyzer(bootstrapConfig(bootstrap_seed=seed, bootstrap_resamples=200))
+  if control is not None:
+    analyzer.processBootstrap(bins, control, {}, "control", "All", "fcp_time")
+  result = {}
+  analyzer.processBootstrap(bins, counts, result, branch, "All", "fcp_time")
+  return result
+
+def test_bootstrap_reproducible():
+  bins = list(range(100))
+  counts = [1 + (i*7) % 13 for i in bins]
+  result = bootstrapIntervals(3, bins, counts)
+  assert result == bootstrapIntervals(3, bins, counts)
+  assert result != bootstrapIntervals(4, bins, counts)
+  assert set(result["bootstrap"]["stats"]) == {"mean", "median", "p95"}
+  assert result["bootstrap"]["resamples"] == 200
+
+  branch = bootstrapIntervals(3, bins, counts[::-1], "treatment", counts)
+  assert branch == bootstrapIntervals(3, bins, counts[::-1], "treatment", counts)
+  assert "uplift" in branch["bootstrap"]["stats"]["mean"]
+
+# The 95% interval of the mean of histograms sampled from a known
+# distribution covers its mean about 95% of the time.
+def test_bootstrap_covers_mean():
+  rng = np.random.default_rng(5)
+  bins = np.arange(50)
+  p = np.exp(-bins/10.0)
+  p = p/p.sum()
+  mean = bins @ p
+
+  covered = 0
+  for i in range(200):
+    counts = rng.multinomial(500, p)
+    observed, resampled = bootstrap_histogram(bins, counts, [0.5], 400, np.random.default_rng(i))
+    result = {}
+    calculate_bootstrap_intervals(observed, resampled, ["mean", "median"], result)
+    assert result["confidence"]["min"] <= observed[0] <= result["confidence"]["max"]
+    covered += result["confidence"]["min"] <= mean <= result["confidence"]["max"]
+  assert 0.88 <= covered/200 <= 0.99
+
+def test_holm_correction():
+  # Sorted: 0.005*4, 0.01*3, 0.03*2, 0.04*1, each at least the previous one.
+  corrected = holm_correction(np.array([[0.01, 0.04, 0.03, 0.005]]))
+  assert np.allclose(corrected, [[0.03, 0.06, 0.06, 0.02]])
+
+  # Ties, one row per branch, and adjusted p-values capped at 1.
+  corrected = holm_correction(np.array([[0.02, 0.02, 0.5], [0.6, 0.9, 0.4]]))
+  assert np.allclose(corrected, [[0.06, 0.06, 0.5], [1.0, 1.0, 1.0]])
+
+def chiSquare(table):
+  table = np.asarray(table, dtype=float)
+  table = table[:, table.sum(axis=0) > 0]
+  score, p_value, dof, _ = stats.chi2_contingency(table, correction=False)
+  return score, p_value, dof
+
+def test_chi_square():
+  tables = np.array([
+    [[30, 50, 20], [45, 40, 15]],
+    # A label missing from both rows is ignored.
+    [[10, 0, 90], [25, 0, 75]],
+    [[10, 20, 30], [20, 40, 60]]
+  ], dtype=float)
+  score, p_value, dof = calc_chi_square(tables)
+  for i, table in enumerate(tables):
+    assert np.allclose((score[i], p_value[i], dof[i]), chiSquare(table))
+
+  # A table without counts in one row has nothing to test.
+  score, p_value, dof = calc_chi_square(np.array([[[0, 0], [5, 10]]], dtype=float))
+  assert dof[0] == 0 and p_value[0] == 1.0
+
+def test_categorical_tests():
+  # The last label is missing from control and from the second branch.
+  labels, counts = align_categorical_counts([
+    (["a", "b", "c"], [300, 500, 200]),
+    (["c", "a", "b", "d"], [150, 450, 380, 20]),
+    (["b", "a", "c"], [500, 300, 200])
+  ])
+  assert labels == ["a", "b", "c", "d"]
+  tests = calc_categorical_tests(counts)
+
+  assert np.allclose(tests["totals"], [1000, 1000, 1000])
+  assert np.allclose(tests["ratios"][1], [0.45, 0.38, 0.15, 0.02])
+  assert np.allclose(tests["uplift"][0], [15, -12, -5, 2])
+  assert np.allclose(tests["overall"], np.array(chiSquare(counts))[:, np.newaxis])
+  for i, branch in enumerate(counts[1:]):
+    score, p_value, dof = chiSquare([counts[0], branch])
+    assert np.allclose((tests["chi2"][0][i], tests["chi2"][1][i], tests["chi2"][2][i]), (score, p_value, dof))
+  assert tests["chi2"][2][1] == 2
+
+  # Two-proportion z-test of each label against control.
+  pooled = (300+450)/2000
+  z = (0.45-0.30)/np.sqrt(pooled*(1-pooled)*(2/1000))
+  assert np.isclose(tests["z"][0][0], z)
+  assert np.isclose(tests["p_value"][0][0], 2*stats.norm.sf(z))
+  assert np.allclose(tests["p_value"][1], [1, 1, 1, 1])
+  assert np.allclose(tests["p_adjusted"], holm_correction(tests["p_value"]))
@@ -0,0 +1,162 @@
+import json
+import os
+import pathlib
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from lib.generate import generate_report
+from lib.telemetry import TelemetryClient
+
+def test_pipeline(parquetDir, probeIndex, nonExperimentConfig, reportArgs, tmp_path):
+  generate_report(reportArgs(nonExperimentConfig, backend="duckdb", parquetDir=parquetDir))
+
+  # Local backend data is kept apart from BigQuery data.
+  assert not os.path.exists(tmp_path / "data" / "duckdb-test")
+  resultsFile = tmp_path / "data" / "duckdb" / "duckdb-test" / "duckdb-test-results.json"
+  with open(resultsFile) as f:
+    results = json.load(f)
+
+  for branch in ["Firefox124", "Firefox125"]:
+    for segment in ["All", "Windows", "Linux", "Mac"]:
+      segmentResults = results[branch][segment]
+      fcp = segmentResults["histograms"]["performance_pageload_fcp"]
+      assert fcp["n"] > 0
+      events = segmentResults["pageload_event_metrics"]["fcp_time"]
+      assert events["n"] > 0
+      assert 0 <= events["mean"] <= 5000
+
+  report = (tmp_path / "reports" / "duckdb-test.html").read_text()
+  assert "performance_pageload_fcp" in report
+  assert "fcp_time" in report
+
+# A regenerated report with the same content isn't rewritten, and must
+# still be found up to date by the next run.
+def test_unchanged_report_is_current(parquetDir, probeIndex, nonExperimentConfig, reportArgs, capsys):
+  generate_report(reportArgs(nonExperimentConfig, backend="duckdb", parquetDir=parquetDir))
+  generate_report(reportArgs(nonExperimentConfig, backend="duckdb", parquetDir=parquetDir, skip_cache=True))
+  assert "is unchanged" in capsys.readouterr().out
+
+  generate_report(reportArgs(nonExperimentConfig, backend="duckdb", parquetDir=parquetDir))
+  assert "Found up to date html report" in capsys.readouterr().out
+
+def test_missing_table(parquetDir, probeIndex, nonExperimentConfig, reportArgs, tmp_path, capsys):
+  partialDir = tmp_path / "parquet"
+  shutil.copytree(parquetDir, partialDir)
+  shutil.rmtree(partialDir / "moz-fx-data-shared-prod.firefox_desktop.pageload")
+
+  with pytest.raises(SystemExit):
+    generate_report(reportArgs(nonExperimentConfig, backend="duckdb", parquetDir=str(partialDir)))
+  assert "no parquet data for moz-fx-data-shared-prod.firefox_desktop.pageload" in capsys.readouterr().out
+
+# Every client of the fixture is on the same ISP, which the blacklist of an
+# experiment would exclude, but other reports keep their whole population.
+def test_isp_blacklist_ignored_without_experiment(parquetDir, probeIndex, nonExperimentConfigData, writeConfig,
+                                                  reportArgs, tmp_path, capsys):
+  blacklist = tmp_path / "blacklist.txt"
+  blacklist.write_text("isp\n")
+  config = writeConfig(nonExperimentConfigData | {"isp_blacklist": str(blacklist)})
+  generate_report(reportArgs(config, backend="duckdb", parquetDir=parquetDir))
+  assert "isp_blacklist only applies to experiments" in capsys.readouterr().out
+
+  with open(tmp_path / "data" / "duckdb" / "duckdb-test" / "duckdb-test-results.json") as f:
+    results = json.load(f)
+  assert results["Firefox124"]["All"]["histograms"]["performance_pageload_fcp"]["n"] > 0
+  assert results["Firefox124"]["All"]["pageload_event_metrics"]["fcp_time"]["n"] > 0
+  assert all("blacklist" not in query["parameters"] for query in results["queries"])
+
+# Every metric fits the budget on its own, but the whole report doesn't, and
+# a streamed report must stop before fetching any metric.
+def test_stream_checks_budget_of_whole_report(parquetDir, probeIndex, nonExperimentConfigData, writeConfig,
+                                              reportArgs, tmp_path, capsys):
+  tables = sum(f.stat().st_size for f in pathlib.Path(parquetDir).rglob("*.parquet"))
+  config = writeConfig(nonExperimentConfigData | {"max_bytes_scanned": tables - 1})
+
+  with pytest.raises(SystemExit):
+    generate_report(reportArgs(config, backend="duckdb", parquetDir=parquetDir, stream=True))
+  assert "more than max_bytes_scanned" in capsys.readouterr().out
+  assert list((tmp_path / "data").rglob("*.pkl")) == []
+
+# Streamed reports are built from the files of each metric, so a change to
+# one of them makes the report outdated even if the results didn't change.
+def test_streamed_report_depends_on_metric_files(parquetDir, probeIndex, nonExperimentConfig, reportArgs,
+                                                 tmp_path, capsys):
+  args = reportArgs(nonExperimentConfig, backend="duckdb", parquetDir=parquetDir, stream=True)
+  generate_report(args)
+  generate_report(args)
+  assert "Found up to date html report" in capsys.readouterr().out
+
+  streamDir = tmp_path / "data" / "duckdb" / "duckdb-test" / "duckdb-test-stream"
+  fragment = sorted(streamDir.glob("*.html"))[0]
+  fragment.write_text("<div>stale</div>")
+  generate_report(args)
+  assert "Generating html report" in capsys.readouterr().out
+  assert "stale" not in (tmp_path / "reports" / "duckdb-test.html").read_text()
+
+# A batch query of prefetched experiments fetches some metrics of the report
+# in place of its own queries, so it must be shown with the queries of the
+# metrics the report fetched itself.
+def test_batch_queries_are_kept(parquetDir, probeIndex, nonExperimentConfigData, nonExperimentConfig, reportArgs,
+                                tmp_path):
+  generate_report(reportArgs(nonExperimentConfig, backend="duckdb", parquetDir=parquetDir))
+  dataDir = tmp_path / "data" / "duckdb" / "duckdb-test"
+  with open(dataDir / "duckdb-test-queries.json") as f:
+    names = [query["name"] for query in json.load(f)]
+
+  batched = "Pageload event: fcp_time"
+  client = TelemetryClient(str(dataDir), nonExperimentConfigData, False)
+  client.recordCachedQueries([{
+    "name": batched, "query": "SELECT 1", "parameters": {}, "batch": ["duckdb-test", "other-test"]
+  }])
+  os.remove(dataDir / "duckdb-test-results.json")
+  os.remove(dataDir / "duckdb-test-performance_pageload_fcp.pkl")
+  generate_report(reportArgs(nonExperimentConfig, backend="duckdb", parquetDir=parquetDir))
+
+  with open(dataDir / "duckdb-test-results.json") as f:
+    queries = json.load(f)["queries"]
+  assert sorted(query["name"] for query in queries) == sorted(names)
+  assert [query["name"] for query in queries if "batch" in query] == [batched]
+  report = (tmp_path / "reports" / "duckdb-test.html").read_text()
+  assert "Fetched in a batch with: duckdb-test, other-test" in report
+
+# Pageload events fetched with k buckets per power of two are the raw
+# values in bucket floor(log2(v+1)*k), reported at 2^((i+0.5)/k)-1.
+def test_log_buckets(parquetDir, probeIndex, nonExperimentConfigData, writeConfig, reportArgs, tmp_path, capsys):
+  dataDir = tmp_path / "data" / "duckdb" / "duckdb-test"
+  def fetch(*bounds):
+    config = writeConfig(nonExperimentConfigData | {"pageload_event_metrics": {"fcp_time": [0, 5000, *bounds]}})
+    if os.path.exists(dataDir / "duckdb-test-results.json"):
+      os.remove(dataDir / "duckdb-test-results.json")
+    generate_report(reportArgs(config, backend="duckdb", parquetDir=parquetDir, html_report=False))
+    return capsys.readouterr().out
+
+  fetch()
+  raw = pd.read_pickle(dataDir / "duckdb-test-pageload-events-fcp_time.pkl")
+  raw["bucket"] = raw["bucket"].astype(float)
+  for k in [8, 16]:
+    cacheFile = dataDir / f"duckdb-test-pageload-events-fcp_time-log{k}.pkl"
+    assert f"Found local data in {cacheFile}" not in fetch(k)
+    df = pd.read_pickle(cacheFile)
+
+    i = np.floor(np.log2(raw["bucket"]+1)*k)
+    expected = raw.assign(bucket=np.round(2**((i+0.5)/k)-1, 2))
+    expected = expected.groupby(["segment", "branch", "bucket"], observed=True)["counts"].sum()
+    actual = df.groupby(["segment", "branch", "bucket"], observed=True)["counts"].sum()
+    pd.testing.assert_series_equal(actual.sort_index(), expected.sort_index(), check_dtype=False,
+                                   check_categorical=False, check_index_type=False)
+
+    # The mean of every branch and segment is within the documented bound.
+    bound = 2**(1/(2*k))
+    for key, group in raw.groupby(["segment", "branch"], observed=True):
+      bucketed = df[(df["segment"] == key[0]) & (df["branch"] == key[1])]
+      rawMean = (group["bucket"]*group["counts"]).sum()/group["counts"].sum()
+      mean = (bucketed["bucket"]*bucketed["counts"]).sum()/bucketed["counts"].sum()
+      assert (rawMean+1)/bound <= mean+1 <= (rawMean+1)*bound
+
+  # Each resolution is cached separately, and reused.
+  assert f"Found local data in {dataDir / 'duckdb-test-pageload-events-fcp_time-log8.pkl'}" in fetch(8)
+  assert sorted(f.name for f in dataDir.glob("*fcp_time*.pkl")) == [
+    "duckdb-test-pageload-events-fcp_time-log16.pkl",
+    "duckdb-test-pageload-events-fcp_time-log8.pkl",
+    "duckdb-test-pageload-events-fcp_time.pkl"
+  ]
@@ -0,0 +1,94 @@
+import json
+import time
+import pandas as pd
+import pytest
+from lib.journal import JobJournal, JOB_RESULTS_TTL, query_hash
+from lib.telemetry import TelemetryClient
+
+QUERY = "SELECT segment, branch, bucket, counts FROM `mozdata.firefox_desktop.metrics`"
+PARAMETERS = {"startDate": "2024-01-22"}
+
+# A backend with query jobs, like BigQuery: jobs are submitted, and their
+# results are fetched later, possibly by another run.  Jobs can be
+# interrupted while waiting for them, or have expired results.
+class FakeJobBackend:
+  def __init__(self, jobs=None):
+    self.jobs = {} if jobs is None else jobs
+    self.submitted = []
+    self.interrupt = False
+
+  def submit(self, query, parameters=None):
+    n = len(self.jobs)
+    job_id = f"job-{n}"
+    self.jobs[job_id] = pd.DataFrame({"segment": ["All"], "branch": ["control"], "bucket": [1], "counts": [n + 1]})
+    self.submitted.append(job_id)
+    return {"job_id": job_id, "location": "US"}
+
+  def result(self, jobRef):
+    if self.interrupt:
+      raise KeyboardInterrupt()
+    if jobRef["job_id"] not in self.jobs:
+      raise Exception(f"Not found: Job {jobRef['job_id']}")
+    return self.jobs[jobRef["job_id"]]
+
+  def query(self, query, parameters=None):
+    return self.result(self.submit(query, parameters))
+
+CONFIG = {"slug": "journal-test", "segments": ["All"], "is_experiment": True}
+
+def journalFile(tmp_path):
+  return tmp_path / "journal-test-jobs.json"
+
+def test_reattach_after_interrupted_run(tmp_path):
+  backend = FakeJobBackend()
+  backend.interrupt = True
+  client = TelemetryClient(str(tmp_path), dict(CONFIG), False, backend)
+  with pytest.raises(KeyboardInterrupt):
+    client.runJob(QUERY, PARAMETERS, "fcp")
+  job = JobJournal(str(journalFile(tmp_path))).get(query_hash(QUERY, PARAMETERS))
+  assert job["state"] == "running"
+
+  # The next run downloads the results of the job instead of submitting the
+  # query again.
+  backend = FakeJobBackend(backend.jobs)
+  client = TelemetryClient(str(tmp_path), dict(CONFIG), False, backend)
+  df = client.runJob(QUERY, PARAMETERS, "fcp")
+  assert backend.submitted == []
+  assert df["counts"].tolist() == [1]
+  assert client.journal.get(query_hash(QUERY, PARAMETERS))["state"] == "done"
+
+def test_resubmit_when_results_are_gone(tmp_path):
+  journal = JobJournal(str(journalFile(tmp_path)))
+  journal.record(query_hash(QUERY, PARAMETERS), job_id="lost", location="US", metric="fcp",
+                 state="running", created=time.time())
+
+  backend = FakeJobBackend()
+  client = TelemetryClient(str(tmp_path), dict(CONFIG), False, backend)
+  df = client.runJob(QUERY, PARAMETERS, "fcp")
+  assert backend.submitted == ["job-0"]
+  assert df["counts"].tolist() == [1]
+  assert client.journal.get(query_hash(QUERY, PARAMETERS))["job_id"] == "job-0"
+
+# Jobs older than the lifetime of their results are dropped when the
+# journal is loaded, and the query is submitted again without trying them.
+def test_expired_jobs_are_resubmitted(tmp_path):
+  key = query_hash(QUERY, PARAMETERS)
+  with open(journalFile(tmp_path), 'w') as f:
+    json.dump({key: {"job_id": "old", "location": "US", "metric": "fcp", "state": "done",
+                     "created": time.time() - JOB_RESULTS_TTL - 1}}, f)
+
+  backend = FakeJobBackend({"old": pd.DataFrame({"counts": [-1]})})
+  client = TelemetryClient(str(tmp_path), dict(CONFIG), False, backend)
+  assert client.journal.get(key) is None
+  df = client.runJob(QUERY, PARAMETERS, "fcp")
+  assert backend.submitted == ["job-1"]
+  assert df["counts"].tolist() == [2]
+
+def test_skip_cache_clears_journal(tmp_path):
+  journal = JobJournal(str(journalFile(tmp_path)))
+  journal.record(query_hash(QUERY, PARAMETERS), job_id="job-0", state="done", created=time.time())
+
+  backend = FakeJobBackend()
+  client = TelemetryClient(str(tmp_path), dict(CONFIG), True, backend)
+  client.runJob(QUERY, PARAMETERS, "fcp")
+  assert backend.submitted == ["job-0"]
@@ -0,0 +1,55 @@
+import json
+import pytest
+import requests
+import lib.parser as parser
+
+class FakeResponse:
+  def __init__(self, values, status_code=200):
+    self.values = values
+    self.status_code = status_code
+    self.ok = status_code == 200
+
+  def json(self):
+    return self.values
+
+API = {"startDate": "2024-01-22", "endDate": None, "channel": "release", "isRollout": False,
+       "branches": [{"slug": "control"}, {"slug": "treatment"}]}
+
+def writeCachedAPI(tmp_path, api):
+  with open(tmp_path / "exp-nimbus-API.json", 'w') as f:
+    json.dump(api, f)
+
+def test_ended_experiment_is_cached(tmp_path, monkeypatch):
+  writeCachedAPI(tmp_path, API | {"endDate": "2024-02-01"})
+  monkeypatch.setattr(requests, "get", lambda url: pytest.fail("the API was fetched"))
+  values = parser.parseNimbusAPI(str(tmp_path), "exp", False)
+  assert values["endDate"] == "2024-02-01"
+  assert not values["isOngoing"]
+
+# An experiment that was ongoing when it was cached may have ended since.
+def test_ongoing_experiment_is_refetched(tmp_path, monkeypatch):
+  writeCachedAPI(tmp_path, API)
+  monkeypatch.setattr(requests, "get", lambda url: FakeResponse(API | {"endDate": "2024-02-01"}))
+  values = parser.parseNimbusAPI(str(tmp_path), "exp", False)
+  assert values["endDate"] == "2024-02-01"
+  assert not values["isOngoing"]
+  with open(tmp_path / "exp-nimbus-API.json") as f:
+    assert json.load(f)["endDate"] == "2024-02-01"
+
+def test_ongoing_experiment_offline(tmp_path, monkeypatch):
+  writeCachedAPI(tmp_path, API)
+  def offline(url):
+    raise requests.ConnectionError("offline")
+  monkeypatch.setattr(requests, "get", offline)
+  values = parser.parseNimbusAPI(str(tmp_path), "exp", False)
+  assert values["isOngoing"]
+
+# Reports that aren't experiments are fetched whole, for every client.
+def test_experiment_options_warn_without_experiment(tmp_path, capsys):
+  configFile = tmp_path / "config.json"
+  configFile.write_text(json.dumps({"slug": "test", "branches": [], "daily_trends": True, "isp_blacklist": "isps.txt"}))
+  config = parser.parseConfigFile(str(configFile))
+  assert not config["is_experiment"]
+  out = capsys.readouterr().out
+  assert "WARNING: daily_trends only applies to experiments" in out
+  assert "WARNING: isp_blacklist only applies to experiments" in out
@@ -0,0 +1,111 @@
+import importlib.machinery
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "update-probe-index")
+
+def gleanMetric(metric_type, description, **info):
+  return {"history": [{"type": metric_type, "description": description} | info]}
+
+# The probeinfo endpoints used by update-probe-index, laid out like the
+# paths of probeinfo.telemetry.mozilla.org.
+MIRROR = {
+  "firefox/release/main/all_probes": {
+    "histogram/GC_MS": {"history": {"release": [{"description": "GC time", "details": {"kind": "exponential"}}]}},
+    "scalar/gc.count": {"history": {"release": [{"description": "GC count"}]}}
+  },
+  "glean/repositories": [{"name": "gecko"}, {"name": "fenix"}],
+  "glean/gecko/metrics": {
+    "performance.pageload.fcp": gleanMetric("timing_distribution", "First contentful paint"),
+    "javascript.gc.total_time": gleanMetric("timing_distribution", "GC time", telemetry_mirror="GC_MS")
+  },
+  "glean/fenix/metrics": {
+    "performance.pageload.fcp": gleanMetric("timing_distribution", "First contentful paint"),
+    "fenix.startup.time": gleanMetric("timing_distribution", "Startup time")
+  }
+}
+
+def writeMirror(mirrorDir, endpoints):
+  for path, values in endpoints.items():
+    filename = os.path.join(mirrorDir, *path.split("/"))
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+      json.dump(values, f)
+
+# Runs update-probe-index in a directory of its own, since it writes the
+# index to lib/probe-index.json.
+def updateProbeIndex(workDir, mirrorDir, *args):
+  result = subprocess.run([sys.executable, SCRIPT, "--mirror", str(mirrorDir), *args], cwd=workDir,
+                          capture_output=True, text=True, check=True)
+  with open(workDir / "lib" / "probe-index.json") as f:
+    return json.load(f), result.stdout
+
+@pytest.fixture
+def workDir(tmp_path):
+  os.makedirs(tmp_path / "work" / "lib")
+  return tmp_path / "work"
+
+def test_mirror_index(workDir, tmp_path):
+  mirrorDir = tmp_path / "mirror"
+  writeMirror(mirrorDir, MIRROR)
+  index, out = updateProbeIndex(workDir, mirrorDir)
+  assert "0/2 glean repositories unchanged." in out
+  assert set(index["legacy"]) == {"GC_MS"}
+  assert index["legacy"]["GC_MS"]["glean_mirror"] == "javascript_gc_total_time"
+  assert index["glean"]["performance_pageload_fcp"]["repos"] == ["gecko", "fenix"]
+  assert index["glean"]["fenix_startup_time"]["repos"] == ["fenix"]
+  assert set(index["sources"]) == {"firefox/release/main/all_probes", "glean/gecko/metrics", "glean/fenix/metrics"}
+
+  # Unchanged endpoints are skipped, and leave the index as it was.
+  rerun, out = updateProbeIndex(workDir, mirrorDir)
+  assert "2/2 glean repositories unchanged." in out
+  assert "Updating" not in out
+  assert rerun == index
+
+  # Probes deleted from a repository are removed from the index, unless
+  # another repository still has them.
+  fenix = dict(MIRROR["glean/fenix/metrics"])
+  del fenix["fenix.startup.time"]
+  del fenix["performance.pageload.fcp"]
+  writeMirror(mirrorDir, {"glean/fenix/metrics": fenix})
+  index, out = updateProbeIndex(workDir, mirrorDir)
+  assert "Updating glean repository: fenix" in out
+  assert "1/2 glean repositories unchanged." in out
+  assert "fenix_startup_time" not in index["glean"]
+  assert index["glean"]["performance_pageload_fcp"]["repos"] == ["gecko"]
+
+  # So are the probes of repositories that no longer exist.
+  writeMirror(mirrorDir, {"glean/repositories": [{"name": "fenix"}]})
+  writeMirror(mirrorDir, {"glean/fenix/metrics": MIRROR["glean/fenix/metrics"]})
+  index, out = updateProbeIndex(workDir, mirrorDir)
+  assert "Removing glean repository: gecko" in out
+  assert "javascript_gc_total_time" not in index["glean"]
+  assert "glean_mirror" not in index["legacy"]["GC_MS"]
+  assert index["glean"]["performance_pageload_fcp"]["repos"] == ["fenix"]
+  assert "glean/gecko/metrics" not in index["sources"]
+
+  # --force rebuilds the whole index.
+  _, out = updateProbeIndex(workDir, mirrorDir, "--force")
+  assert "0/1 glean repositories unchanged." in out
+
+# A failed write leaves the previous index in place, without temporary files.
+def test_index_write_is_atomic(workDir, monkeypatch):
+  loader = importlib.machinery.SourceFileLoader("update_probe_index", SCRIPT)
+  spec = importlib.util.spec_from_loader(loader.name, loader)
+  script = importlib.util.module_from_spec(spec)
+  loader.exec_module(script)
+
+  indexFile = workDir / "lib" / "probe-index.json"
+  monkeypatch.setattr(script, "probeIndexFile", str(indexFile))
+  script.writeProbeIndex({"glean": {}, "legacy": {}, "sources": {}})
+  previous = indexFile.read_text()
+
+  with pytest.raises(TypeError):
+    script.writeProbeIndex({"glean": {"probe": object()}, "legacy": {}, "sources": {}})
+  assert indexFile.read_text() == previous
+  assert os.listdir(workDir / "lib") == ["probe-index.json"]
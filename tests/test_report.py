@@ -0,0 +1,29 @@
+import re
+from lib.generate import generate_report
+from lib.report import segment_id
+
+def test_segment_id():
+  assert segment_id("Windows") == "Windows"
+  assert re.fullmatch(r"[A-Za-z_]\w*", segment_id("8+ cores"))
+  assert segment_id("8+ cores") != segment_id("8_ cores")
+
+# Generic segments can have any name, which must not end up in the element
+# ids and javascript variables of the report.
+def test_generic_segment_names(parquetDir, probeIndex, nonExperimentConfigData, writeConfig, reportArgs, tmp_path):
+  config = writeConfig(nonExperimentConfigData | {
+    "segments": {"All": [], "8+ cores": ["AND sample_id < 50"]}
+  })
+  generate_report(reportArgs(config, backend="duckdb", parquetDir=parquetDir))
+  report = (tmp_path / "reports" / "duckdb-test.html").read_text()
+
+  assert "segment: 8+ cores" in report
+  variables = re.findall(r"var (\S+) = new Chart", report)
+  assert len(variables) > 0
+  for variable in variables:
+    assert re.fullmatch(r"[A-Za-z_$][\w$]*", variable)
+
+  ids = set(re.findall(r'id="([^"]+)"', report))
+  for element in re.findall(r"getElementById\('([^']+)'\)", report):
+    assert element in ids
+  for link in re.findall(r'href="#([^"]+)"', report):
+    assert " " not in link and "+" not in link
@@ -0,0 +1,60 @@
+import collections
+import os
+import shutil
+import pandas as pd
+import lib.generate
+import lib.telemetry
+from lib.backend import DuckDBBackend
+from lib.generate import generate_report
+
+# Fails the first query of the chunk starting on failDate, like a transient
+# BigQuery error, and records every query that ran.
+class FailOnceBackend:
+  def __init__(self, backend, failDate):
+    self.backend = backend
+    self.failDate = failDate
+    self.failed = False
+    self.queries = []
+
+  def query(self, query, parameters=None):
+    self.queries.append((query, parameters["startDate"], parameters["endDate"]))
+    if not self.failed and parameters["startDate"] == self.failDate:
+      self.failed = True
+      raise RuntimeError("transient error")
+    return self.backend.query(query, parameters)
+
+  def estimate(self, query, parameters=None):
+    return self.backend.estimate(query, parameters)
+
+def readPickles(dataDir):
+  return {f: pd.read_pickle(os.path.join(dataDir, f)) for f in os.listdir(dataDir) if f.endswith(".pkl")}
+
+def test_sharded_fetch(parquetDir, probeIndex, experimentConfig, reportArgs, tmp_path, monkeypatch):
+  backend = FailOnceBackend(DuckDBBackend(parquetDir), "2024-02-11")
+  monkeypatch.setattr(lib.generate, "createBackend", lambda name, parquetDir: backend)
+  monkeypatch.setattr(lib.telemetry.time, "sleep", lambda seconds: None)
+  generate_report(reportArgs(experimentConfig, backend="duckdb", parquetDir=parquetDir, shard_days=10))
+  monkeypatch.undo()
+
+  # The 44 days of the experiment are fetched in 5 chunks for each metric,
+  # and only the failed chunk ran twice.
+  assert backend.failed
+  runs = collections.Counter(backend.queries)
+  assert len(runs) == 10
+  assert sorted(runs.values()) == [1]*9 + [2]
+  assert [chunk[1:] for chunk, count in runs.items() if count == 2] == [("2024-02-11", "2024-02-20")]
+
+  unshardedDir = tmp_path / "unsharded"
+  shardedData = tmp_path / "data" / "duckdb" / "duckdb-exp"
+  os.makedirs(unshardedDir / "duckdb" / "duckdb-exp")
+  shutil.copy(shardedData / "duckdb-exp-nimbus-API.json", unshardedDir / "duckdb" / "duckdb-exp")
+  generate_report(reportArgs(experimentConfig, backend="duckdb", parquetDir=parquetDir, dataDir=str(unshardedDir)))
+
+  sharded = readPickles(shardedData)
+  unsharded = readPickles(unshardedDir / "duckdb" / "duckdb-exp")
+  assert len(sharded) == 2 and sharded.keys() == unsharded.keys()
+  for name, df in sharded.items():
+    columns = [column for column in df.columns if column != "counts"]
+    expected = unsharded[name].sort_values(columns).reset_index(drop=True)
+    pd.testing.assert_frame_equal(df.sort_values(columns).reset_index(drop=True), expected, check_dtype=False,
+                                  check_categorical=False)